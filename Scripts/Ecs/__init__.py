@@ -1,5 +1,6 @@
 from . import components
 from . import entity
+from . import registry
 from . import managers
 
 Entity = entity.Entity
@@ -8,10 +9,12 @@ BaseSystem = components.BaseSystem
 ExtendedSystem = components.ExtendedSystem
 EntityManager = managers.EntityManager
 ComponentManager = managers.ComponentManager
+ComponentTypeRegistry = registry.ComponentTypeRegistry
 SystemManager = managers.SystemManager
 
 __all__ = ["components",
            "entity",
+           "registry",
            "managers",
            "BaseComponent",
            "BaseSystem",
@@ -19,4 +22,5 @@ __all__ = ["components",
            "Entity",
            "EntityManager",
            "ComponentManager",
+           "ComponentTypeRegistry",
            "SystemManager"]
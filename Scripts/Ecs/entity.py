@@ -1,14 +1,33 @@
+INDEX_BITS = 20  # max. 2**20 gleichzeitige entities
+INDEX_MASK = (1 << INDEX_BITS) - 1
+GENERATION_MASK = 0xFFFFFFFF  # generationen laufen über (array "L")
+
+
 class Entity:
+    """
+    Handle of an entity. `_id` packs the index in the entity table (lower `INDEX_BITS` bits) and the generation of
+    that slot, so a handle kept after the entity was removed never equals the entity that reuses the index.
+    """
     __slots__ = ("_id", )
 
-    def __init__(self, id) -> None:
-        self._id = id
+    def __init__(self, index: int, generation: int = 0) -> None:
+        self._id = generation << INDEX_BITS | index
+
+    @property
+    def index(self) -> int:
+        return self._id & INDEX_MASK
+
+    @property
+    def generation(self) -> int:
+        return self._id >> INDEX_BITS
 
     def __repr__(self) -> str:
+        if self.generation:
+            return f"<{type(self).__name__} {self.index} gen {self.generation}>"
         return f"<{type(self).__name__} {self._id}>"
 
     def __str__(self) -> str:
-        return f"<{type(self).__name__} {self._id}>"
+        return self.__repr__()
 
     def __hash__(self):
         return self._id
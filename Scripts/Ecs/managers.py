@@ -1,11 +1,20 @@
 import typing
-from .entity import Entity
+from itertools import chain
+from array import array
+from .entity import Entity, INDEX_MASK, GENERATION_MASK
 from .components import BaseComponent, BaseSystem, ExtendedSystem
+from .queries import QueryView
+from .registry import ComponentTypeRegistry, all_subclasses
 import time
 
 
 class EntityManager:
-    __slots__ = ("_count", "_entities",
+    """
+    Entity table with generational ids: the index of a removed entity goes to a free list and is reused with the
+    next generation, so the tables keyed by entity ids stay as big as the number of living entities.
+    Handles of removed entities are stale, `is_alive` / `get` detect them.
+    """
+    __slots__ = ("_entities", "_generations", "_free",
                  "component_manager",
                  "_entities_to_remove_next_frame")
 
@@ -13,34 +22,62 @@ class EntityManager:
 
     def __init__(self, component_manager: "ComponentManager") -> None:
         self.component_manager = component_manager
-        self._count = 0
-        self._entities: dict[int, Entity] = dict()
+        self._entities: list[Entity | None] = []  # index -> lebendes entity, None wenn frei
+        self._generations = array("L")  # index -> aktuelle generation
+        self._free: list[int] = []  # freie indices
         self._entities_to_remove_next_frame: set[int] = set()
 
-    def __len__(self) -> int: return len(self._entities)
+    def __len__(self) -> int: return len(self._entities) - len(self._free)
 
     def add_entity(self) -> Entity:
-        entity = Entity(self._count)
-        self._entities[hash(entity)] = entity
-        self._count += 1
+        if self._free:
+            index = self._free.pop()
+        else:
+            index = len(self._entities)
+            if index > INDEX_MASK:
+                raise OverflowError(f"More than {INDEX_MASK + 1} entities")
+            self._entities.append(None)
+            self._generations.append(0)
+        entity = Entity(index, self._generations[index])
+        self._entities[index] = entity
         return entity
 
+    def get(self, entity_id: int) -> Entity | None:
+        """The living entity with the id `entity_id` (or handle), None if it was removed."""
+        index = hash(entity_id) & INDEX_MASK
+        if index < len(self._entities):
+            entity = self._entities[index]
+            if entity is not None and entity._id == hash(entity_id):
+                return entity
+        return None
+
+    def is_alive(self, entity: Entity | int) -> bool:
+        return self.get(entity) is not None
+
     def remove_entity(self, entity: Entity) -> None:
+        """Queues the entity, it is removed by `SystemManager.flush_removals` at the start of the next `run_all_systems`."""
         self._entities_to_remove_next_frame.add(hash(entity))
-        self.system_manager._remove_all_entities()
 
     def final_remove(self) -> set[int]:
+        """Frees the queued entities and returns their ids. Stale handles (index already reused) are skipped."""
         if self._entities_to_remove_next_frame:
             # t0 = time.time()
 
-            copy = self._entities_to_remove_next_frame.copy()
-            self._entities_to_remove_next_frame.clear()
-
-            for e in copy:
-                del self._entities[e]
-
-            # print(f"To remove {len(copy)} entities it took: {time.time() - t0} seconds")
-            return copy
+            queued = self._entities_to_remove_next_frame
+            self._entities_to_remove_next_frame = set()
+
+            removed = set()
+            for e in queued:
+                if self.get(e) is None:
+                    continue
+                index = e & INDEX_MASK
+                self._entities[index] = None
+                self._generations[index] = (self._generations[index] + 1) & GENERATION_MASK
+                self._free.append(index)
+                removed.add(e)
+
+            # print(f"To remove {len(removed)} entities it took: {time.time() - t0} seconds")
+            return removed
         return set()
 
 
@@ -48,114 +85,116 @@ ComponentInstanceType = typing.TypeVar("ComponentInstanceType", bound=BaseCompon
 
 
 class ComponentManager:
-    __slots__ = ("_components", "_subclassed_components")
+    """
+    One `{entity: component}` dict per concrete component type. Requested types are resolved to the storages of
+    themselves and their registered subclasses (`Gun` for `Item`, any depth) once by the `ComponentTypeRegistry`,
+    component types are registered on first use, also when they are defined after the manager was created.
+    """
+    __slots__ = ("_components", "_registry", "_storages", "_entity_types", "listeners")
 
     def __init__(self) -> None:
+        self.listeners: list[typing.Callable[[Entity], None]] = []  # werden nach jeder änderung mit dem entity aufgerufen
         self._components: dict[typing.Type[BaseComponent], dict[Entity, ComponentInstanceType]] = dict()  # type: ignore
-        self._subclassed_components: dict[BaseComponent, dict[Entity, BaseComponent]] = {}
+        self._registry = ComponentTypeRegistry()
+        # requested type -> storages aller passenden registrierten types, der type selbst zuerst
+        self._storages: dict[typing.Type[BaseComponent], tuple[dict[Entity, BaseComponent], ...]] = {}
+        self._entity_types: dict[int, set[typing.Type[BaseComponent]]] = {}  # entity id -> types seiner components
 
-        self.__init_components()
+        for component_type in all_subclasses(BaseComponent):
+            self.register(component_type)
 
     def __len__(self) -> int: return len(self._components)
 
-    def __init_components(self) -> None:
-        for subclass in BaseComponent.__subclasses__():
-            # print(subclass, subclass.__subclasses__())
-            self._components[subclass] = dict()
-            for subsubclass in subclass.__subclasses__():
-                self._subclassed_components[subsubclass] = dict()
-        # print(self._components, "------------", self._subclassed_components)
+    def register(self, component_type: typing.Type[BaseComponent]) -> None:
+        """Creates the storage of `component_type`. Called by `add_component` for unknown types."""
+        if self._registry.register(component_type):
+            self._components[component_type] = {}
+            for requested in component_type.__mro__:
+                if requested in self._storages:
+                    self._storages[requested] = tuple(self._components[t] for t in self._registry.resolve(requested))
+
+    def _storages_for(self, component_type: typing.Type[BaseComponent]) -> tuple[dict[Entity, BaseComponent], ...]:
+        storages = self._storages.get(component_type)
+        if storages is None:
+            storages = self._storages[component_type] = tuple(self._components[t] for t in self._registry.resolve(component_type))
+        return storages
 
     def add_component(self, entity: Entity, components: typing.List[BaseComponent]) -> None:
+        entity_types = self._entity_types.get(hash(entity))
+        if entity_types is None:
+            entity_types = self._entity_types[hash(entity)] = set()
         for component in components:
-            # print(component.__class__)
-            t = type(component)
-            # print(2, hash(entity), t)
-            if t in self._components:
-                self._components[t][entity] = component
-            else:
-                self._subclassed_components[t][entity] = component
-            # print(self._subclassed_components)
+            storage = self._components.get(type(component))
+            if storage is None:
+                self.register(type(component))
+                storage = self._components[type(component)]
+            storage[entity] = component
+            entity_types.add(type(component))
+        for listener in self.listeners:
+            listener(entity)
 
     def remove_component(self, entity: Entity, component_type) -> None:
-        raise_ = False
-        try:
-            del self._components[component_type][entity]
-        except KeyError:
-            raise_ = True
-        try:
-            del self._subclassed_components[component_type][entity]
-        except KeyError:
-            raise_ = True
-        # if raise_:
-        #     raise KeyError(f"Entity: {entity} does not have component type: {component_type}")
+        entity_types = self._entity_types.get(hash(entity))
+        if entity_types is not None and component_type in entity_types:
+            entity_types.discard(component_type)
+            self._components[component_type].pop(entity, None)
+        for listener in self.listeners:
+            listener(entity)
 
     def remove_entity(self, entity: Entity) -> None:
-        for component_type in self._components:
-            try:
-                del self._components[component_type][entity]
-            except KeyError:
-                pass
-            try:
-                del self._subclassed_components[component_type][entity]
-            except KeyError:
-                pass
+        entity_types = self._entity_types.pop(hash(entity), None)
+        if entity_types is None:
+            return
+        for t in entity_types:
+            self._components[t].pop(entity, None)
+        for listener in self.listeners:
+            listener(entity)
+
+    def _find(self, entity: Entity, component_type: typing.Type[BaseComponent]) -> BaseComponent | None:
+        for storage in self._storages_for(component_type):
+            component = storage.get(entity)
+            if component is not None:
+                return component
+        return None
 
     def get_all_components(self, entity: Entity, component_types: typing.List[typing.Type[BaseComponent]]) -> dict[typing.Type[BaseComponent], BaseComponent]:
+        # wenn Item gefragt, entity hat aber Gun (subclass von item) dann wird {Item: Gun()} returnt.
         ret = dict()
-
-        # TODO
-        # component_types kommt von Systemmanager.run_all_systems. und zwar von ...required_component types.
-        # Check einbauen, dass falls Entity eine subclass von component hat es auch als "parent" class zurück gegeben wird.
-        # Heißt wenn Item gefragt, entity hat aber Gun (subclass von item) dann wird {Item: Gun()} returnt.
-
-        # print()
-        # print(component_types)
         for t in component_types:
-            # print(t)
-            subclass = None
-            try:
-                self._components[t][entity]
-            except KeyError:
-                # print("abc", self._components[t], entity)
-                for sc in t.__subclasses__():
-                    if sc in self._subclassed_components:
-                        subclass = sc
-
-            # print(f"{subclass=}", f"{t=}")
-            if subclass in self._subclassed_components:
-                # print(True)
-                ret[t] = self._subclassed_components[subclass][entity]
-            else:
-                # print(False)
-                # print(self._components[t])
-                ret[t] = self._components[t][entity]
-        # print(f"{ret=}")
+            component = self._find(entity, t)
+            if component is None:
+                raise KeyError(f"Entity: {entity} does not have component type: {t}")
+            ret[t] = component
         return ret
 
     def get_component(self, entity: Entity, component_type: typing.Type[BaseComponent]) -> BaseComponent:
-        try:
-            return self._components[component_type][entity]
-        except KeyError:
-            for sc in component_type.__subclasses__():
-                try:
-                    return self._subclassed_components[sc][entity]
-                except KeyError:
-                    raise KeyError(f"Entity: {entity} does not have component type: {component_type}")
+        component = self._find(entity, component_type)
+        if component is None:
+            raise KeyError(f"Entity: {entity} does not have component type: {component_type}")
+        return component
 
 
 class SystemManager:
+    """
+    Runs the systems over their entities. Every system has a persistent `QueryView` with the components of its
+    entities. The views are updated when components or system memberships change, running the systems
+    creates no dicts (besides the `**kwargs` of the calls). `dict_allocations` counts the created dicts.
+    Removed entities are flushed together once per frame, at the start of `run_all_systems`.
+    """
     __slots__ = ("entity_manager", "component_manager",
-                 "_systems", "_extended_systems",
-                 "_systems_ran_already", "_extended_systems_ran_already", "ret")
+                 "_systems", "_extended_systems", "_entity_views",
+                 "_systems_ran_already", "_extended_systems_ran_already", "ret",
+                 "_allocations")
 
-    def __init__(self, entity_manager: EntityManager, component_manager: ComponentManager) -> None:
+    def __init__(self, entity_manager: EntityManager, component_manager: "ComponentManager") -> None:
         self.entity_manager = entity_manager
         self.component_manager = component_manager
-        self._systems: dict[BaseSystem, set[int]] = dict()
-        self._extended_systems: dict[ExtendedSystem, set[int]] = dict()
+        self._systems: dict[BaseSystem, QueryView] = dict()
+        self._extended_systems: dict[ExtendedSystem, QueryView] = dict()
+        self._entity_views: dict[int, list[QueryView]] = {}  # entity id -> views der systeme, in denen es ist
         self._systems_ran_already: set[BaseSystem] = set()
         self._extended_systems_ran_already: set[ExtendedSystem] = set()
+        self._allocations = 0  # result dicts, die component dicts zählen die views
 
         self.ret = {}
         for sys in BaseSystem.__subclasses__():
@@ -171,93 +210,118 @@ class SystemManager:
         ExtendedSystem.system_manager = self
 
         EntityManager.system_manager = self
+        component_manager.listeners.append(self._components_changed)
 
     def __len__(self) -> int: return len(self._systems) + len(self._extended_systems)
 
+    @property
+    def dict_allocations(self) -> int:
+        """Number of dicts created by the system manager and its views so far."""
+        return self._allocations + sum(view.allocations for view in chain(self._systems.values(), self._extended_systems.values()))
+
+    def view(self, system: BaseSystem | ExtendedSystem) -> QueryView:
+        return self._systems[system] if system in self._systems else self._extended_systems[system]
+
+    def _new_view(self, system: BaseSystem | ExtendedSystem) -> QueryView:
+        view = QueryView(system.required_component_types)
+        if type(system) not in self.ret:  # system klasse nach dem SystemManager definiert
+            self.ret[type(system)] = {}
+            self._allocations += 1
+        if isinstance(system, BaseSystem):
+            self.ret[type(system)][system] = {}  # wird jeden frame geleert und wieder gefüllt
+            self._allocations += 1
+        return view
+
+    def _join(self, view: QueryView, entity: Entity) -> None:
+        entity_id = hash(entity)
+        if entity_id not in view.members:
+            view.members.add(entity_id)
+            entity_views = self._entity_views.get(entity_id)
+            if entity_views is None:
+                entity_views = self._entity_views[entity_id] = []
+            entity_views.append(view)
+            entity = self.entity_manager.get(entity_id) or entity
+            view.refresh(entity, self.component_manager)
+
     def add_system(self, entity: Entity, system: BaseSystem) -> None:
         if system not in self._systems:
-            self._systems[system] = set()
-        self._systems[system].add(hash(entity))
+            self._systems[system] = self._new_view(system)
+        self._join(self._systems[system], entity)
 
     def add_extended_system(self, entity: Entity, system: ExtendedSystem) -> None:
         if system not in self._extended_systems:
-            self._extended_systems[system] = set()
-        self._extended_systems[system].add(hash(entity))
+            self._extended_systems[system] = self._new_view(system)
+        self._join(self._extended_systems[system], entity)
+
+    def _components_changed(self, entity: Entity) -> None:
+        entity_id = hash(entity)
+        entity = self.entity_manager.get(entity_id)
+        for view in self._entity_views.get(entity_id, ()):
+            if entity is None:  # schon entfernt
+                view.data.pop(entity_id, None)
+            else:
+                view.refresh(entity, self.component_manager)
 
     def run_all_systems(self, /, **kwargs) -> dict[typing.Type[BaseSystem] | typing.Type[ExtendedSystem], dict]:
         # t0 = time.time()
+        self.flush_removals()
 
-        for base_system, entities in self._systems.items():
-            self.ret[type(base_system)][base_system] = {}
+        for base_system, view in self._systems.items():
+            results = self.ret[type(base_system)][base_system]
+            results.clear()
             if base_system in self._systems_ran_already:
                 continue
-            for entity in entities:
-                components = self.component_manager.get_all_components(entity, base_system.required_component_types)
+            update_entity = base_system.update_entity
+            for entity, components in view.data.items():
                 # print(f"{components=}")
-                self.ret[type(base_system)][base_system][entity] = base_system.update_entity(self.entity_manager._entities[entity], components, **kwargs)  # type: ignore
+                results[entity._id] = update_entity(entity, components, **kwargs)  # type: ignore
 
         # t1 = time.time()
 
-        for ext_system, entities in self._extended_systems.items():
+        for ext_system, view in self._extended_systems.items():
             if ext_system in self._extended_systems_ran_already:
                 continue
-            data = {self.entity_manager._entities[entity_]: self.component_manager.get_all_components(self.entity_manager._entities[entity_], ext_system.required_component_types) for entity_ in entities}
-            self.ret[type(ext_system)][ext_system] = ext_system.update_entities(data, **kwargs)
+            self.ret[type(ext_system)][ext_system] = ext_system.update_entities(view.data, **kwargs)
 
         # print(f"To run all systems it took: {time.time() - t0:.4f} seconds. (BaseSystem: {t1 - t0:.7f} sec. ExtendedSystem: {time.time() - t1:.7f})")
 
-        # self._remove_all_entities()
         self._systems_ran_already.clear()
         self._extended_systems_ran_already.clear()
 
         return self.ret
 
     def run_base_system(self, system: BaseSystem, **kwargs) -> dict[int, object]:
-        entities = self._systems[system]
         ret = {}
-        for entity in entities:
-            ret[entity] = system.update_entity(self.entity_manager._entities[entity], self.component_manager.get_all_components(entity, system.required_component_types), **kwargs)  # type: ignore
+        for entity, components in self._systems[system].data.items():
+            ret[entity._id] = system.update_entity(entity, components, **kwargs)  # type: ignore
 
         self._systems_ran_already.add(system)
         return ret
 
     def run_extended_system(self, system: ExtendedSystem, **kwargs) -> object:
-        entities = self._extended_systems[system]
-        data = {self.entity_manager._entities[e]: self.component_manager.get_all_components(self.entity_manager._entities[e], system.required_component_types) for e in entities}
-        ret = system.update_entities(data, **kwargs)
+        ret = system.update_entities(self._extended_systems[system].data, **kwargs)
 
         self._extended_systems_ran_already.add(system)
         return ret
 
-    def _remove_all_entities(self) -> None:
+    def flush_removals(self) -> None:
+        """Removes the entities queued by `EntityManager.remove_entity` from their systems and the component manager."""
         entities = self.entity_manager.final_remove()
         if not entities:
             return
 
         # t0 = time.time()
-        to_remove = {"base": set(), "extended": set()}  # type: ignore
-
         for en in entities:
-            for base_system, ens in self._systems.items():
-                if en in ens:
-                    to_remove["base"].add((base_system, en))
-            for ext_system, ens in self._extended_systems.items():
-                if en in ens:
-                    to_remove["extended"].add((ext_system, en))
-
-        for (s, e) in to_remove["base"]:
-            self._systems[s].remove(e)
-            self.component_manager.remove_entity(e)
-        for (s, e) in to_remove["extended"]:
-            self._extended_systems[s].remove(e)
-            self.component_manager.remove_entity(e)
+            for view in self._entity_views.pop(en, ()):
+                view.discard(en)
+            self.component_manager.remove_entity(en)
 
         # print(f"To execute the final removal of entities it took: {time.time() - t0} seconds")
 
     def debug(self) -> None:
         d = dict()
-        for s, i in self._systems.items():
-            d[s] = len(i)
+        for s, view in self._systems.items():
+            d[s] = len(view.members)
         print(d)
 
 
@@ -0,0 +1,39 @@
+import typing
+from .entity import Entity
+from .components import BaseComponent
+
+if typing.TYPE_CHECKING:
+    from .managers import ComponentManager
+
+
+class QueryView:
+    """
+    Persistent `{entity: {required type: component}}` of one system, the `entites_data` of `update_entities`.
+    Updated by the `SystemManager` when components or system memberships change, not rebuilt per frame.
+    Systems must not change the dicts they get.
+    """
+    __slots__ = ("component_types", "members", "data", "allocations")
+
+    def __init__(self, component_types: typing.List[typing.Type[BaseComponent]]) -> None:
+        self.component_types = component_types
+        self.members: set[int] = set()  # ids der entities im system, auch ohne alle components
+        self.data: dict[Entity, dict[typing.Type[BaseComponent], BaseComponent]] = {}
+        self.allocations = 0  # erstellte component dicts
+
+    def __len__(self) -> int: return len(self.data)
+
+    def refresh(self, entity: Entity, component_manager: "ComponentManager") -> None:
+        """Re-reads the components of `entity` (a member), drops it while it lacks a required component."""
+        try:
+            components = component_manager.get_all_components(entity, self.component_types)
+        except KeyError:
+            components = None
+        if components is None:
+            self.data.pop(entity, None)
+            return
+        self.allocations += 1
+        self.data[entity] = components
+
+    def discard(self, entity: Entity) -> None:
+        self.members.discard(hash(entity))
+        self.data.pop(entity, None)
@@ -0,0 +1,61 @@
+import typing
+from .components import BaseComponent
+
+ComponentType = typing.Type[BaseComponent]
+
+
+def all_subclasses(cls: type) -> list[type]:
+    """Every subclass of `cls`, beliebig tief (nicht nur `__subclasses__()`)."""
+    ret = []
+    stack = list(cls.__subclasses__())
+    while stack:
+        sc = stack.pop()
+        if sc not in ret:
+            ret.append(sc)
+            stack.extend(sc.__subclasses__())
+    return ret
+
+
+class ComponentTypeRegistry:
+    """
+    Registered (concrete) component types and, for every requested type, the registered types that can stand in for it:
+    the type itself and all its subclasses at any depth (`Gun` -> `Item`), closest first.
+    Types can be registered at any time (late registration), resolutions are cached and updated on registration.
+    """
+    __slots__ = ("_types", "_resolved")
+
+    def __init__(self) -> None:
+        self._types: list[ComponentType] = []
+        self._resolved: dict[ComponentType, tuple[ComponentType, ...]] = {}
+
+    def __len__(self) -> int: return len(self._types)
+
+    def __contains__(self, component_type: ComponentType) -> bool: return component_type in self._types
+
+    @property
+    def types(self) -> tuple[ComponentType, ...]:
+        return tuple(self._types)
+
+    def register(self, component_type: ComponentType) -> bool:
+        """Registers `component_type`, returns False if it was known already."""
+        if component_type in self._types:
+            return False
+        self._types.append(component_type)
+        for requested in component_type.__mro__:
+            resolved = self._resolved.get(requested)
+            if resolved is not None:
+                self._resolved[requested] = self._sorted(requested, resolved + (component_type,))
+        return True
+
+    def resolve(self, component_type: ComponentType) -> tuple[ComponentType, ...]:
+        """Registered types that are `component_type` or a subclass of it, the type itself first. Cached."""
+        resolved = self._resolved.get(component_type)
+        if resolved is None:
+            resolved = self._resolved[component_type] = self._sorted(
+                component_type, tuple(t for t in self._types if issubclass(t, component_type)))
+        return resolved
+
+    @staticmethod
+    def _sorted(component_type: ComponentType, types: tuple[ComponentType, ...]) -> tuple[ComponentType, ...]:
+        # nach abstand in der vererbung: Item, Gun, SpecialGun, ...
+        return tuple(sorted(types, key=lambda t: t.__mro__.index(component_type)))
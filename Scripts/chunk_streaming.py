@@ -0,0 +1,168 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Set, Tuple
+
+from Scripts.CONFIG import *
+from Scripts import chunkformat
+from Scripts.tiles import Chunk, TileMap, load_chunk_file, chunk_file_pos, chunk_file_path, write_chunk_file
+
+
+class ChunkStreamer:
+    """
+    Keeps only the chunks of a `saves/...` directory near the camera resident in a `TileMap`.
+
+    Every chunk within `radius` chunks of the camera is loaded (blocking, if the prefetch was too late).
+    The ring right outside of it is loaded ahead of the movement direction on a background thread.
+    Chunks outside of the radius are evicted, farthest first, as long as the pre-rendered
+    surfaces take more than `memory_budget` bytes.
+    Changed chunks are written back to `directory` before they are evicted.
+    Call `require` before editing tiles that may be outside of the radius and save with `save`, not `TileMap.save`.
+    Opt-in, the level editor uses it with `STREAM_CHUNKS = True` instead of loading the whole save.
+    """
+
+    def __init__(self, tilemap: TileMap, directory: str, radius: int = 2, memory_budget: int = 32 * 1024 * 1024) -> None:
+        self.tilemap = tilemap
+        self.directory = directory
+        self.radius = radius
+        self.memory_budget = memory_budget
+
+        # nur die dateinamen, geladen wird erst wenn die kamera in die nähe kommt
+        self.available: Dict[Tuple, str] = {}
+        for file_name in os.listdir(directory):
+            pos = chunk_file_pos(file_name)
+            if pos is not None:
+                self.available[pos] = f"{directory}/{file_name}"
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chunk-prefetch")
+        self._prefetching: Dict[Tuple, Future] = {}
+        self.center: Tuple[float, float] | None = None
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._prefetching.clear()
+
+    def memory_usage(self) -> int:
+        """Bytes used by the pre-rendered surfaces of the resident chunks."""
+        total = 0
+        for chunk in self.tilemap._chunks.values():
+            surf = chunk._pre_renderd_surf
+            if surf is not None:
+                total += surf.get_width() * surf.get_height() * surf.get_bytesize()
+        return total
+
+    def _keys_around(self, center: Tuple[float, float], radius: int) -> Set[Tuple]:
+        cx, cy = center
+        removed = self.tilemap._removed_chunks  # leer geworden, die alte datei nicht wieder laden
+        return {(cx + x, cy + y) for y in range(-radius, radius + 1) for x in range(-radius, radius + 1)
+                if (cx + x, cy + y) in self.available and (cx + x, cy + y) not in removed}
+
+    def _load(self, key: Tuple) -> None:
+        """Loads `key` blocking, from the prefetch if it succeeded."""
+        future = self._prefetching.pop(key, None)
+        if future is None or future.cancelled() or future.exception() is not None:
+            # fehlgeschlagener prefetch: nochmal synchron laden, damit der fehler hier geworfen wird
+            chunk = load_chunk_file(self.available[key])
+        else:
+            chunk = future.result()
+        self._insert(chunk)
+
+    def require(self, positions: Iterable) -> None:
+        """
+        Loads the chunks of the tile `positions` and their neighbours (they can get ghost tiles) now.
+        Editing a chunk that is not resident would replace its file on the next save.
+        """
+        keys = set()
+        for pos in positions:
+            cx, cy = pos[0] // CHUNKSIZE, pos[1] // CHUNKSIZE
+            keys.update((cx + x, cy + y) for y in (-1, 0, 1) for x in (-1, 0, 1))
+        for key in keys:
+            if key in self.available and key not in self.tilemap._chunks and key not in self.tilemap._removed_chunks:
+                self._load(key)
+
+    def save(self) -> int:
+        """`TileMap.save` into `directory`, keeps `available` in sync with the written and deleted files."""
+        tilemap = self.tilemap
+        removed = [key for key in tilemap._removed_chunks if key not in tilemap._chunks]
+        written = [key for key in tilemap._dirty_chunks if key in tilemap._chunks]
+        count = tilemap.save(self.directory)
+        for key in removed:
+            self.available.pop(key, None)
+        for key in written:
+            self.available[key] = chunk_file_path(self.directory, key)
+        return count
+
+    def _insert(self, chunk: Chunk) -> None:
+        chunk.parent = self.tilemap
+        key = tuple(chunk.pos)
+        old = self.tilemap._chunks.get(key)
+        if old is None:
+            self.tilemap.amount_of_chunks += 1
+        else:
+            self._uncount(old)
+        self.tilemap.amount_of_tiles += len(chunk._tiles)
+        self.tilemap.amount_of_tiles_offgrid += len(chunk._tiles_offgrid)
+        self.tilemap._chunks[key] = chunk
+        self.tilemap.chunks_changed()
+        self.tilemap.add_to_pre_render_queue(chunk)
+
+    def _uncount(self, chunk: Chunk) -> None:
+        self.tilemap.amount_of_tiles -= len(chunk._tiles)
+        self.tilemap.amount_of_tiles_offgrid -= len(chunk._tiles_offgrid)
+
+    def _evict(self, key: Tuple) -> None:
+        tilemap = self.tilemap
+        chunk = tilemap._chunks[key]
+        if key in tilemap._dirty_chunks:  # geändert, sonst wäre die änderung weg
+            path = chunk_file_path(self.directory, key)
+            write_chunk_file(path, chunkformat.encode_chunk(chunk))
+            del tilemap._dirty_chunks[key]
+            self.available[key] = path
+        del tilemap._chunks[key]
+        tilemap._pre_render_scheduler.discard(chunk)
+        chunk._pre_renderd_surf = None
+        chunk.parent = None
+        tilemap.amount_of_chunks -= 1
+        self._uncount(chunk)
+        tilemap.chunks_changed()
+
+    def update(self, camera_pos: Vector2, direction: Vector2 = Vector2(0)) -> None:
+        """`camera_pos` in pixel, `direction` is the movement direction of the camera (only the sign is used)."""
+        center = (camera_pos[0] // CHUNKWIDTH, camera_pos[1] // CHUNKWIDTH)
+        chunks = self.tilemap._chunks
+
+        # fertige prefetches übernehmen
+        for key, future in list(self._prefetching.items()):
+            if future.done():
+                del self._prefetching[key]
+                if key not in chunks and key not in self.tilemap._removed_chunks and future.exception() is None:
+                    self._insert(future.result())
+
+        if center != self.center:
+            self.center = center
+            for key in self._keys_around(center, self.radius):
+                if key not in chunks:
+                    self._load(key)
+
+            # den ring außerhalb des radius in bewegungsrichtung im hintergrund laden
+            dx, dy = (direction[0] > 0) - (direction[0] < 0), (direction[1] > 0) - (direction[1] < 0)
+            if dx or dy:
+                for key in self._keys_around(center, self.radius + 1):
+                    ox, oy = key[0] - center[0], key[1] - center[1]
+                    if max(abs(ox), abs(oy)) <= self.radius or ox * dx + oy * dy <= 0:
+                        continue
+                    if key not in chunks and key not in self._prefetching:
+                        self._prefetching[key] = self._executor.submit(load_chunk_file, self.available[key])
+
+        self.tilemap.pre_render_chunks(camera_pos)
+
+        usage = self.memory_usage()
+        if usage > self.memory_budget:
+            far = [key for key in chunks if max(abs(key[0] - center[0]), abs(key[1] - center[1])) > self.radius]
+            far.sort(key=lambda k: (k[0] - center[0]) ** 2 + (k[1] - center[1]) ** 2, reverse=True)
+            for key in far:
+                if usage <= self.memory_budget:
+                    break
+                surf = chunks[key]._pre_renderd_surf
+                if surf is not None:
+                    usage -= surf.get_width() * surf.get_height() * surf.get_bytesize()
+                self._evict(key)
@@ -0,0 +1,257 @@
+"""
+Binary chunk format for the `.data` files of `Scripts.tiles` (replaces pickled `Chunk` objects).
+
+Layout, all little endian:
+    header              CHUNK_HEADER, not compressed
+    body                zlib compressed, `body size` bytes after decompressing:
+        values          u8 kind + payload per value (image indices, height data indices, tile sizes, ...)
+        height tables   u16 length + HEIGHT_ENTRY (pixel column, height) per column, the `height_data` of custom ramps
+        tile records    TILE_RECORD per tile, first `_tiles`, then `_ghost_tiles`, then `_tiles_offgrid`
+
+Tile records reference values and height tables by index.
+Decoding never executes code from the file, malformed files raise ValueError.
+"""
+import math
+import struct
+import zlib
+from typing import Any, Dict, List, Sequence, Tuple
+
+from pygame import Vector2
+
+from Scripts.tiles import Chunk, Tile, CustomTile, Ramp, CustomRamp, GrassBlade, GrassPatch, TileType
+
+CHUNK_MAGIC = b"PGCHK\x00"
+CHUNK_FORMAT_VERSION = 1
+MAX_BODY_SIZE = 16 * 1024 * 1024  # gegen zip bomben
+
+# magic, version, chunk x, chunk y, chunk width, chunk height, value count, height table count,
+# tile count, ghost tile count, offgrid tile count, body size
+CHUNK_HEADER = struct.Struct("<6sHiiBBHHIIII")
+# dict key x, dict key y, pos x, pos y, class id, tile type, image value, size value, elevation,
+# height data value (height table for custom ramps), orientation, grass base image value, grass rotation,
+# grass center offset x, y
+TILE_RECORD = struct.Struct("<ddddBBHHdHBHddd")
+HEIGHT_ENTRY = struct.Struct("<ii")
+U16 = struct.Struct("<H")
+INT_VALUE = struct.Struct("<i")
+SIZE_VALUE = struct.Struct("<dd")
+
+# value kinds
+VALUE_NONE, VALUE_INT, VALUE_STR, VALUE_SIZE = 0, 1, 2, 3
+
+# class id -> klasse, reihenfolge nicht ändern (steht so in den dateien)
+TILE_CLASSES = (Tile, CustomTile, Ramp, CustomRamp, GrassBlade, GrassPatch)
+TILE_CLASS_IDS = {cls: i for i, cls in enumerate(TILE_CLASSES)}
+TILE_TYPES = {t.value: t for t in TileType}
+
+
+def is_chunk_format(data: bytes) -> bool:
+    return data[:len(CHUNK_MAGIC)] == CHUNK_MAGIC
+
+
+def _number(v: float) -> float | int:
+    return int(v) if v.is_integer() else v
+
+
+class _Encoder:
+    def __init__(self) -> None:
+        self.values: List[bytes] = []
+        self.value_ids: Dict[Tuple, int] = {}
+        self.height_tables: List[Sequence[int]] = []
+
+    def _add(self, key: Tuple, data: bytes) -> int:
+        if key not in self.value_ids:
+            if len(self.values) > 0xFFFF:
+                raise ValueError("Too many different values in one chunk")
+            self.value_ids[key] = len(self.values)
+            self.values.append(data)
+        return self.value_ids[key]
+
+    def value(self, value: Any) -> int:
+        if value is None:
+            return self._add((VALUE_NONE,), bytes([VALUE_NONE]))
+        if isinstance(value, str):
+            data = value.encode()
+            if len(data) > 0xFFFF:
+                raise ValueError("String too long for a chunk file")
+            return self._add((VALUE_STR, value), bytes([VALUE_STR]) + U16.pack(len(data)) + data)
+        if isinstance(value, int) and not isinstance(value, bool) and -2 ** 31 <= value < 2 ** 31:
+            return self._add((VALUE_INT, value), bytes([VALUE_INT]) + INT_VALUE.pack(value))
+        raise ValueError(f"Cannot store {value!r} in a chunk file")
+
+    def size(self, size) -> int:
+        w, h = float(size[0]), float(size[1])
+        return self._add((VALUE_SIZE, w, h), bytes([VALUE_SIZE]) + SIZE_VALUE.pack(w, h))
+
+    def height_table(self, height_data: Sequence[int]) -> int:
+        if len(self.height_tables) > 0xFFFF or len(height_data) > 0xFFFF:
+            raise ValueError("Too many custom ramps in one chunk")
+        if isinstance(height_data, dict):  # alte chunks: {x: höhe}
+            height_data = [height_data[x] for x in range(len(height_data))]
+        self.height_tables.append(height_data)
+        return len(self.height_tables) - 1
+
+    def tile(self, key: Tuple, tile: Tile) -> bytes:
+        cls = type(tile)
+        if cls not in TILE_CLASS_IDS:
+            raise ValueError(f"Cannot store {cls.__name__} in a chunk file")
+        none = self.value(None)
+        height, orientation, elevation = none, 0, 0.0
+        base, rot, center = none, 0.0, (0.0, 0.0)
+        if cls is CustomTile:
+            height = self.value(tile.height_data_idx)
+        elif cls is Ramp:
+            elevation = tile.elevation
+        elif cls is CustomRamp:
+            height = self.height_table(tile.height_data)
+            orientation = tile.orientation.value
+        elif cls is GrassBlade:
+            base = self.value(tile.base_img_idx)
+            rot, center = tile.rot, tile.center_blit_offset
+        return TILE_RECORD.pack(key[0], key[1], tile.pos[0], tile.pos[1], TILE_CLASS_IDS[cls], tile.type.value,
+                                self.value(tile.img_idx), self.size(tile.size), elevation, height, orientation,
+                                base, rot, center[0], center[1])
+
+
+def encode_chunk(chunk: Chunk) -> bytes:
+    """Header and uncompressed body of `chunk`. Call `compress_chunk` before writing it to disk."""
+    encoder = _Encoder()
+    records = [encoder.tile(key, tile) for section in (chunk._tiles, chunk._ghost_tiles, chunk._tiles_offgrid)
+               for key, tile in section.items()]
+
+    body = bytearray(b"".join(encoder.values))
+    for table in encoder.height_tables:
+        body += U16.pack(len(table))
+        for x, h in enumerate(table):
+            body += HEIGHT_ENTRY.pack(x, int(h))
+    body += b"".join(records)
+
+    header = CHUNK_HEADER.pack(CHUNK_MAGIC, CHUNK_FORMAT_VERSION, int(chunk.pos.x), int(chunk.pos.y),
+                               chunk.size[0], chunk.size[1], len(encoder.values), len(encoder.height_tables),
+                               len(chunk._tiles), len(chunk._ghost_tiles), len(chunk._tiles_offgrid), len(body))
+    return header + bytes(body)
+
+
+def compress_chunk(data: bytes) -> bytes:
+    """Output of `encode_chunk` -> file content. Can run on any thread, zlib releases the GIL."""
+    return data[:CHUNK_HEADER.size] + zlib.compress(data[CHUNK_HEADER.size:], 9)
+
+
+def _read_header(data: bytes) -> tuple:
+    if len(data) < CHUNK_HEADER.size or not is_chunk_format(data):
+        raise ValueError("Not a chunk file")
+    header = CHUNK_HEADER.unpack_from(data, 0)
+    if header[1] != CHUNK_FORMAT_VERSION:
+        raise ValueError(f"Unsupported chunk format version {header[1]}")
+    if header[-1] > MAX_BODY_SIZE:
+        raise ValueError("Chunk file too large")
+    return header
+
+
+def decompress_chunk(data: bytes) -> bytes:
+    """File content -> input of `decode_chunk`. Can run on any thread."""
+    body_size = _read_header(data)[-1]
+    decompressor = zlib.decompressobj()
+    try:
+        body = decompressor.decompress(data[CHUNK_HEADER.size:], body_size + 1)
+    except zlib.error as e:
+        raise ValueError(f"Corrupt chunk file: {e}")
+    if len(body) != body_size or not decompressor.eof:
+        raise ValueError("Corrupt chunk file: wrong body size")
+    return data[:CHUNK_HEADER.size] + body
+
+
+def _read_values(view: memoryview, offset: int, count: int) -> Tuple[List[Any], int]:
+    values = []
+    for _ in range(count):
+        kind = view[offset]
+        offset += 1
+        if kind == VALUE_NONE:
+            values.append(None)
+        elif kind == VALUE_INT:
+            values.append(INT_VALUE.unpack_from(view, offset)[0])
+            offset += INT_VALUE.size
+        elif kind == VALUE_STR:
+            length, = U16.unpack_from(view, offset)
+            offset += U16.size
+            if offset + length > len(view):
+                raise ValueError("Corrupt chunk file: string out of bounds")
+            values.append(str(view[offset:offset + length], "utf-8"))
+            offset += length
+        elif kind == VALUE_SIZE:
+            w, h = SIZE_VALUE.unpack_from(view, offset)
+            if not math.isfinite(w + h):
+                raise ValueError("Corrupt chunk file: non finite size")
+            values.append((_number(w), _number(h)))
+            offset += SIZE_VALUE.size
+        else:
+            raise ValueError(f"Corrupt chunk file: unknown value kind {kind}")
+    return values, offset
+
+
+def decode_chunk(data: bytes) -> Chunk:
+    """Output of `decompress_chunk` -> `Chunk` without parent."""
+    (_, _, cx, cy, width, height, value_count, table_count,
+     tile_count, ghost_count, offgrid_count, body_size) = _read_header(data)
+    if len(data) != CHUNK_HEADER.size + body_size:
+        raise ValueError("Corrupt chunk file: wrong body size")
+    view = memoryview(data)
+
+    try:
+        values, offset = _read_values(view, CHUNK_HEADER.size, value_count)
+
+        height_tables = []
+        for _ in range(table_count):
+            length, = U16.unpack_from(view, offset)
+            offset += U16.size
+            end = offset + length * HEIGHT_ENTRY.size
+            if end > len(data):
+                raise ValueError("Corrupt chunk file: height table out of bounds")
+            columns = list(HEIGHT_ENTRY.iter_unpack(view[offset:end]))
+            if [x for x, _ in columns] != list(range(length)) or not all(0 <= h <= 0xFFFF for _, h in columns):
+                raise ValueError("Corrupt chunk file: bad height table")
+            height_tables.append(CustomRamp.shared_heightmap([h for _, h in columns]))
+            offset = end
+
+        if len(data) - offset != (tile_count + ghost_count + offgrid_count) * TILE_RECORD.size:
+            raise ValueError("Corrupt chunk file: wrong number of tile records")
+
+        chunk = Chunk(None, (cx, cy), (width, height))
+        # lokale namen, die schleife läuft einmal pro tile
+        new, isfinite, classes, tile_types = object.__new__, math.isfinite, TILE_CLASSES, TILE_TYPES
+        for section, count in ((chunk._tiles, tile_count), (chunk._ghost_tiles, ghost_count), (chunk._tiles_offgrid, offgrid_count)):
+            end = offset + count * TILE_RECORD.size
+            for (kx, ky, px, py, class_id, type_value, img, size, elevation, height_ref, orientation,
+                 base, rot, center_x, center_y) in TILE_RECORD.iter_unpack(view[offset:end]):
+                # die summe ist nur endlich, wenn alle werte endlich sind
+                if not isfinite(kx + ky + px + py + elevation + rot + center_x + center_y):
+                    raise ValueError("Corrupt chunk file: non finite number")
+                cls = classes[class_id]
+                # ohne __init__, wie pickle (Ramp und GrassBlade würden sonst bilder laden)
+                tile = new(cls)
+                tile.pos = Vector2(px, py)
+                tile.type = tile_types[type_value]
+                tile.img_idx = values[img]
+                tile.size = values[size]
+                if type(tile.size) is not tuple:
+                    raise ValueError("Corrupt chunk file: bad tile size")
+                if cls is Tile:
+                    pass
+                elif cls is CustomTile:
+                    tile.height_data_idx = values[height_ref]
+                elif cls is GrassBlade:
+                    tile.base_img_idx = values[base]
+                    tile.rot = rot
+                    tile.offset = (0, 0)
+                    tile.center_blit_offset = Vector2(center_x, center_y)
+                elif cls is Ramp:
+                    tile.elevation = _number(elevation)
+                elif cls is CustomRamp:
+                    tile.height_data = height_tables[height_ref]
+                    tile.orientation = tile_types[orientation]
+                    tile.size = Vector2(tile.size)
+                section[(kx, ky)] = tile
+            offset = end
+    except (struct.error, IndexError, KeyError) as e:
+        raise ValueError(f"Corrupt chunk file: {e!r}")
+    return chunk
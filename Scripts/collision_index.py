@@ -0,0 +1,284 @@
+import numpy as np
+import pygame
+
+from Scripts.tilegrid import TileGrid, GridChunk, GRID_CHUNK_SHIFT
+
+
+def greedy_meshing(mask: list[list[bool]], merge_vertical: bool = True) -> list[tuple[int, int, int, int]]:
+    """
+    Merges the set cells of `mask` into maximal rectangles `(x, y, w, h)`.
+    Same algorithm as in "standalone tests/greedy-meshing.py".
+    """
+    rects = []
+    height = len(mask)
+    width = len(mask[0])
+    visited = [[False] * width for _ in range(height)]
+
+    for y in range(height):
+        for x in range(width):
+            if mask[y][x] and not visited[y][x]:
+                # Find the width of the rectangle
+                rect_width = 0
+                while x + rect_width < width and mask[y][x + rect_width] and not visited[y][x + rect_width]:
+                    rect_width += 1
+
+                # Find the height of the rectangle
+                rect_height = 1
+                while merge_vertical and y + rect_height < height:
+                    row, row_visited = mask[y + rect_height], visited[y + rect_height]
+                    if not all(row[x + k] and not row_visited[x + k] for k in range(rect_width)):
+                        break
+                    rect_height += 1
+
+                # Mark the visited cells
+                for dy in range(rect_height):
+                    for dx in range(rect_width):
+                        visited[y + dy][x + dx] = True
+
+                rects.append((x, y, rect_width, rect_height))
+
+    return rects
+
+
+class BroadphaseResult:
+    """
+    Result of `CollisionIndex.query_many`.
+
+    `indices[offsets[i]:offsets[i + 1]]` are the rows of the shared rect table
+    (`rects`, `rect_array`, `falltrough`) that touch AABB `i`.
+    """
+    __slots__ = ("rects", "rect_array", "falltrough", "offsets", "indices", "_index_list", "_offset_list")
+
+    def __init__(self, rects: list[pygame.FRect], rect_array: np.ndarray, falltrough: np.ndarray,
+                 offsets: np.ndarray, indices: np.ndarray) -> None:
+        self.rects = rects
+        self.rect_array = rect_array
+        self.falltrough = falltrough
+        self.offsets = offsets
+        self.indices = indices
+        self._index_list: list[int] = indices.tolist()
+        self._offset_list: list[int] = offsets.tolist()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def rect_indices(self, i: int) -> list[int]:
+        return self._index_list[self._offset_list[i]:self._offset_list[i + 1]]
+
+    def rects_for(self, i: int) -> list[pygame.FRect]:
+        rects = self.rects
+        return [rects[j] for j in self._index_list[self._offset_list[i]:self._offset_list[i + 1]]]
+
+
+class CollisionIndex:
+    """
+    Static collision rects of one tile layer.
+
+    Solid cells are greedy-meshed per grid chunk, so a changed tile only re-meshes its own chunk.
+    Chunks are meshed on the first query that touches them, so pending grid chunks stay undecoded.
+    The grid chunks double as the buckets of the spatial hash. Queries return cached tuples,
+    entries are `(rect, falltrough)` pairs. The rects are shared, don't modify them.
+    """
+
+    def __init__(self, grid: TileGrid, tile_size: int, solid_ids: frozenset[int], falltrough_ids: frozenset[int]) -> None:
+        self.grid = grid
+        self.tile_size = tile_size
+        self.solid_ids = np.array(sorted(solid_ids), dtype=np.uint8)
+        self.falltrough_ids = np.array(sorted(falltrough_ids), dtype=np.uint8)
+
+        self._rects: dict[tuple[int, int], tuple[pygame.FRect, ...]] = {}
+        self._entries: dict[tuple[int, int], tuple[tuple[pygame.FRect, bool], ...]] = {}
+        # zusammengefügte ergebnisse für queries über mehrere chunks, key = (cx0, cy0, cx1, cy1)
+        self._union_rects: dict[tuple[int, int, int, int], tuple[pygame.FRect, ...]] = {}
+        self._union_entries: dict[tuple[int, int, int, int], tuple[tuple[pygame.FRect, bool], ...]] = {}
+        self._dirty: set[tuple[int, int]] = set()
+        self._unmeshed: set[tuple[int, int]] = set()
+        # geteilte rect tabelle für query_many, wird lazy neu gebaut
+        self._table: tuple[list[pygame.FRect], np.ndarray, np.ndarray, dict[tuple[int, int], np.ndarray]] | None = None
+
+    def __len__(self) -> int:
+        self._dirty |= self._unmeshed
+        if self._dirty:
+            self._flush()
+        return sum(len(r) for r in self._rects.values())
+
+    def build(self) -> None:
+        self._rects.clear()
+        self._entries.clear()
+        self._dirty.clear()
+        self._unmeshed = self.grid.keys()
+        self._flush()
+
+    def mark_dirty(self, x: int, y: int) -> None:
+        """Call after the tile at tile position (x, y) changed its collision type."""
+        self._dirty.add((x >> GRID_CHUNK_SHIFT, y >> GRID_CHUNK_SHIFT))
+
+    def _flush(self) -> None:
+        self._unmeshed -= self._dirty
+        for key in self._dirty:
+            chunk = self.grid.chunk(key)
+            entries = self._mesh_chunk(key, chunk) if chunk is not None else ()
+            if entries:
+                self._entries[key] = entries
+                self._rects[key] = tuple(rect for rect, _ in entries)
+            else:
+                self._entries.pop(key, None)
+                self._rects.pop(key, None)
+        self._dirty.clear()
+        self._union_rects.clear()
+        self._union_entries.clear()
+        self._table = None
+
+    def _build_table(self) -> None:
+        rects: list[pygame.FRect] = []
+        falltrough: list[bool] = []
+        buckets: dict[tuple[int, int], np.ndarray] = {}
+        for key, entries in self._entries.items():
+            buckets[key] = np.arange(len(rects), len(rects) + len(entries), dtype=np.intp)
+            for rect, flag in entries:
+                rects.append(rect)
+                falltrough.append(flag)
+        rect_array = np.array([tuple(r) for r in rects], dtype=np.float64).reshape(-1, 4)
+        self._table = (rects, rect_array, np.array(falltrough, dtype=bool), buckets)
+
+    def _mesh_chunk(self, key: tuple[int, int], chunk: GridChunk) -> tuple[tuple[pygame.FRect, bool], ...]:
+        ts = self.tile_size
+        ox, oy = key[0] << GRID_CHUNK_SHIFT, key[1] << GRID_CHUNK_SHIFT
+        entries = []
+        # falltrough tiles nur horizontal mergen, die oberkante jeder reihe zählt einzeln
+        for ids, falltrough in ((self.solid_ids, False), (self.falltrough_ids, True)):
+            mask = np.isin(chunk.types, ids)
+            if not mask.any():
+                continue
+            for x, y, w, h in greedy_meshing(mask.tolist(), merge_vertical=not falltrough):
+                entries.append((pygame.FRect((ox + x) * ts, (oy + y) * ts, w * ts, h * ts), falltrough))
+        return tuple(entries)
+
+    def _mesh_range(self, cx0: int, cy0: int, cx1: int, cy1: int) -> None:
+        unmeshed = self._unmeshed
+        keys = [(cx, cy) for cy in range(cy0, cy1 + 1) for cx in range(cx0, cx1 + 1) if (cx, cy) in unmeshed]
+        if keys:
+            self._dirty.update(keys)
+            self._flush()
+
+    def _chunk_range(self, pos, size) -> tuple[int, int, int, int]:
+        # ein tile rand um die AABB, wie NEIGHBOR_OFFSETS
+        ts = self.tile_size
+        return (
+            (int(pos[0] // ts) - 1) >> GRID_CHUNK_SHIFT,
+            (int(pos[1] // ts) - 1) >> GRID_CHUNK_SHIFT,
+            (int((pos[0] + size[0]) // ts) + 1) >> GRID_CHUNK_SHIFT,
+            (int((pos[1] + size[1]) // ts) + 1) >> GRID_CHUNK_SHIFT,
+        )
+
+    def query(self, pos, size=(16, 16)) -> tuple[pygame.FRect, ...]:
+        if self._dirty:
+            self._flush()
+        cx0, cy0, cx1, cy1 = key = self._chunk_range(pos, size)
+        if self._unmeshed:
+            self._mesh_range(*key)
+        if cx0 == cx1 and cy0 == cy1:
+            return self._rects.get((cx0, cy0), ())
+        rects = self._union_rects.get(key)
+        if rects is None:
+            rects = self._union_rects[key] = tuple(r for e in self._union(key) for r, _ in e)
+        return rects
+
+    def query_entries(self, pos, size=(16, 16)) -> tuple[tuple[pygame.FRect, bool], ...]:
+        if self._dirty:
+            self._flush()
+        cx0, cy0, cx1, cy1 = key = self._chunk_range(pos, size)
+        if self._unmeshed:
+            self._mesh_range(*key)
+        if cx0 == cx1 and cy0 == cy1:
+            return self._entries.get((cx0, cy0), ())
+        entries = self._union_entries.get(key)
+        if entries is None:
+            entries = self._union_entries[key] = tuple(entry for e in self._union(key) for entry in e)
+        return entries
+
+    def _union(self, key: tuple[int, int, int, int]) -> list[tuple[tuple[pygame.FRect, bool], ...]]:
+        cx0, cy0, cx1, cy1 = key
+        return [self._entries[(cx, cy)]
+                for cy in range(cy0, cy1 + 1)
+                for cx in range(cx0, cx1 + 1)
+                if (cx, cy) in self._entries]
+
+    def query_many(self, positions, sizes=None, margin: float = 0.0) -> BroadphaseResult:
+        """
+        Batched broadphase for many AABBs in one call.
+
+        `positions` is an (N, 2) array of top-left corners and `sizes` an (N, 2) array,
+        or `positions` is an (N, 4) array of `(x, y, w, h)` and `sizes` is None.
+        Every AABB is grown by `margin` px. Rects that only touch an AABB count as hits.
+        """
+        if self._dirty:
+            self._flush()
+
+        boxes = np.asarray(positions, dtype=np.float64)
+        if sizes is None:
+            boxes = boxes.reshape(-1, 4)
+        else:
+            boxes = np.concatenate((boxes.reshape(-1, 2), np.asarray(sizes, dtype=np.float64).reshape(-1, 2)), axis=1)
+        n = len(boxes)
+        x0 = boxes[:, 0] - margin
+        y0 = boxes[:, 1] - margin
+        x1 = boxes[:, 0] + boxes[:, 2] + margin
+        y1 = boxes[:, 1] + boxes[:, 3] + margin
+
+        # AABBs mit demselben chunk bereich teilen sich die kandidaten
+        ts = self.tile_size
+        chunk_ranges = np.stack((
+            np.floor_divide(x0, ts).astype(np.int64) >> GRID_CHUNK_SHIFT,
+            np.floor_divide(y0, ts).astype(np.int64) >> GRID_CHUNK_SHIFT,
+            np.floor_divide(x1, ts).astype(np.int64) >> GRID_CHUNK_SHIFT,
+            np.floor_divide(y1, ts).astype(np.int64) >> GRID_CHUNK_SHIFT,
+        ), axis=1)
+        groups, inverse = np.unique(chunk_ranges, axis=0, return_inverse=True)
+        groups = groups.tolist()
+        if self._unmeshed:
+            for group in groups:
+                self._mesh_range(*group)
+
+        if self._table is None:
+            self._build_table()
+        rects, rect_array, falltrough, buckets = self._table
+        if not n or not rects:
+            return BroadphaseResult(rects, rect_array, falltrough, np.zeros(n + 1, dtype=np.intp), np.zeros(0, dtype=np.intp))
+
+        inverse = inverse.reshape(-1)
+        order = np.argsort(inverse, kind="stable")
+        group_starts = np.searchsorted(inverse[order], np.arange(len(groups) + 1))
+
+        hit_boxes = []
+        hit_rects = []
+        for g, (cx0, cy0, cx1, cy1) in enumerate(groups):
+            candidates = [buckets[(cx, cy)]
+                          for cy in range(cy0, cy1 + 1)
+                          for cx in range(cx0, cx1 + 1)
+                          if (cx, cy) in buckets]
+            if not candidates:
+                continue
+            candidates = np.concatenate(candidates)
+            members = order[group_starts[g]:group_starts[g + 1]]
+            r = rect_array[candidates]
+            hits = ((x0[members, None] <= r[None, :, 0] + r[None, :, 2]) &
+                    (x1[members, None] >= r[None, :, 0]) &
+                    (y0[members, None] <= r[None, :, 1] + r[None, :, 3]) &
+                    (y1[members, None] >= r[None, :, 1]))
+            box_idx, rect_idx = np.nonzero(hits)
+            hit_boxes.append(members[box_idx])
+            hit_rects.append(candidates[rect_idx])
+
+        if hit_boxes:
+            box_idx = np.concatenate(hit_boxes)
+            rect_idx = np.concatenate(hit_rects)
+            sort = np.argsort(box_idx, kind="stable")
+            indices = rect_idx[sort]
+            counts = np.bincount(box_idx, minlength=n)
+        else:
+            indices = np.zeros(0, dtype=np.intp)
+            counts = np.zeros(n, dtype=np.intp)
+        offsets = np.zeros(n + 1, dtype=np.intp)
+        np.cumsum(counts, out=offsets[1:])
+        return BroadphaseResult(rects, rect_array, falltrough, offsets, indices)
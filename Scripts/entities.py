@@ -5,7 +5,7 @@ from Scripts.Ecs.entity import Entity
 from Scripts.sprites import Animation, cut_spritesheet_row, cut_from_spritesheet
 from Scripts.timer import Timer
 from typing import List, Type, Tuple
-from Scripts.tilemap import TileMap, FALLTRHOGH_TILES
+from Scripts.tilemap import TileMap
 from Scripts.utils import load_images
 from . import Ecs
 import json
@@ -302,20 +302,20 @@ class CollisionResolver(Ecs.BaseSystem):
         if frame_movement[0]:
             transform.x += frame_movement[0]
             entity_rect = transform.frect
-            for rect, tile in zip(tilemap.physics_rects_around(transform.pos), tilemap.get_around(transform.pos, ignore={"decor"})):
+            for rect, falltrough in tilemap.physics_entries_around(transform.pos, transform.size):
                 if entity_rect.colliderect(rect):
-                    return_data["coll_tiles"].append(tile)
-                    if tile["type"] in FALLTRHOGH_TILES:  # wenn spieler nicht mehr mit fallthrough collided, dann kann man aus machen.
+                    return_data["coll_tiles"].append(rect)
+                    if falltrough:  # wenn spieler nicht mehr mit fallthrough collided, dann kann man aus machen.
                         collided_with_fall_trough = True
                     if frame_movement[0] > 0:  # right
-                        if tile["type"] in FALLTRHOGH_TILES:
+                        if falltrough:
                             # transform.falling_through = True
                             pass
                         else:
                             entity_rect.right = rect.left
                             collisions['right'] = True
                     if frame_movement[0] < 0:  # left
-                        if tile["type"] in FALLTRHOGH_TILES:
+                        if falltrough:
                             # transform.falling_through = True
                             pass
                         else:
@@ -326,19 +326,19 @@ class CollisionResolver(Ecs.BaseSystem):
         if frame_movement[1]:
             transform.y += frame_movement[1]
             entity_rect = transform.frect
-            for rect, tile in zip(tilemap.physics_rects_around(transform.pos), tilemap.get_around(transform.pos, ignore={"decor"})):
+            for rect, falltrough in tilemap.physics_entries_around(transform.pos, transform.size):
                 if entity_rect.colliderect(rect):
-                    return_data["coll_tiles"].append(tile)
-                    if tile["type"] in FALLTRHOGH_TILES:  # wenn spieler nicht mehr mit fallthrough collided, dann kann man aus machen.
+                    return_data["coll_tiles"].append(rect)
+                    if falltrough:  # wenn spieler nicht mehr mit fallthrough collided, dann kann man aus machen.
                         collided_with_fall_trough = True
                     if frame_movement[1] > 0:  # downards
-                        if tile["type"] in FALLTRHOGH_TILES and transform.falling_through or (tile["type"] in FALLTRHOGH_TILES and (rect.y - rect.h / 2) - transform.pos[1] < 1):  # durch droppen mit key input
+                        if falltrough and transform.falling_through or (falltrough and (rect.y - rect.h / 2) - transform.pos[1] < 1):  # durch droppen mit key input
                             pass
                         else:
                             entity_rect.bottom = rect.top
                             collisions['down'] = True
                     if frame_movement[1] < 0:  # upwards
-                        if tile["type"] in FALLTRHOGH_TILES:
+                        if falltrough:
                             pass
                         else:
                             entity_rect.top = rect.bottom
@@ -388,18 +388,18 @@ class EnemyCollisionResolver(Ecs.BaseSystem):
         if frame_movement[0]:
             transform.x += frame_movement[0]
             entity_rect = transform.frect
-            for rect, tile in zip(tilemap.physics_rects_around(transform.pos), tilemap.get_around(transform.pos)):
+            for rect, falltrough in tilemap.physics_entries_around(transform.pos, transform.size):
                 if entity_rect.colliderect(rect):
-                    return_data["coll_tiles"].append(tile)
+                    return_data["coll_tiles"].append(rect)
                     if frame_movement[0] > 0:  # right
-                        if tile["type"] in FALLTRHOGH_TILES:
+                        if falltrough:
                             # transform.falling_through = True
                             pass
                         else:
                             entity_rect.right = rect.left
                             collisions['right'] = True
                     if frame_movement[0] < 0:  # left
-                        if tile["type"] in FALLTRHOGH_TILES:
+                        if falltrough:
                             # transform.falling_through = True
                             pass
                         else:
@@ -409,17 +409,17 @@ class EnemyCollisionResolver(Ecs.BaseSystem):
         if frame_movement[1]:
             transform.y += frame_movement[1]
             entity_rect = transform.frect
-            for rect, tile in zip(tilemap.physics_rects_around(transform.pos), tilemap.get_around(transform.pos)):
+            for rect, falltrough in tilemap.physics_entries_around(transform.pos, transform.size):
                 if entity_rect.colliderect(rect):
-                    return_data["coll_tiles"].append(tile)
+                    return_data["coll_tiles"].append(rect)
                     if frame_movement[1] > 0:  # downards
-                        if tile["type"] in FALLTRHOGH_TILES and transform.falling_through or (tile["type"] in FALLTRHOGH_TILES and (rect.y - rect.h / 2) - transform.pos[1] < 1):  # durch droppen mit key input
+                        if falltrough and transform.falling_through or (falltrough and (rect.y - rect.h / 2) - transform.pos[1] < 1):  # durch droppen mit key input
                             pass
                         else:
                             entity_rect.bottom = rect.top
                             collisions['down'] = True
                     if frame_movement[1] < 0:  # upwards
-                        if tile["type"] in FALLTRHOGH_TILES:
+                        if falltrough:
                             pass
                         else:
                             entity_rect.top = rect.bottom
@@ -442,6 +442,38 @@ class EnemyCollisionResolver(Ecs.BaseSystem):
         return return_data
 
 
+class SlopeResolver(Ecs.BaseSystem):
+    """
+    Puts the feet (bottom center) of entities onto ramps, run it after the AABB resolver.
+    Only for the chunk map (`Scripts.tiles.TileMap`), the surface height comes from its precomputed ramp tables
+    (`ground_at`). The grid map of the game (`Scripts.tilemap.TileMap`) has no ramps and no `ground_at`.
+    Entities less than `snap` pixel above a ramp are pulled down onto it, so they don't hop down slopes.
+    """
+
+    def __init__(self, snap: float = TILESIZE / 2) -> None:
+        super().__init__([Transform, Velocity])
+        self.snap = snap
+
+    def update_entity(self, entity: Entity, entity_components: dict[type[BaseComponent], BaseComponent], **kwargs) -> None:
+        transform: Transform = entity_components[Transform]
+        velocity: Velocity = entity_components[Velocity]
+        tilemap = kwargs["tilemap"]
+
+        return_data = {"on_slope": False}
+        if kwargs.get("noclip") or velocity.y < 0:  # beim springen nicht festhalten
+            return return_data
+
+        feet_y = transform.y + transform.h
+        ground = tilemap.ground_at(transform.x + transform.w / 2, feet_y, self.snap)
+        if ground is None or feet_y < ground - self.snap:
+            return return_data
+
+        transform.y = ground - transform.h
+        velocity.y = 0
+        return_data["on_slope"] = True
+        return return_data
+
+
 class Ray:
     def __init__(self, origin, direction) -> None:
         self.origin = origin
@@ -576,75 +608,70 @@ class ItemPhysics(Ecs.ExtendedSystem):
         scroll = kwargs["scroll"]
         friction = 0.2
 
-        entity_map = collections.defaultdict(list)  # https://docs.python.org/3/library/collections.html#collections.defaultdict
-        for entity, entity_components in entites_data.items():
+        # ein broadphase query für alle items, die AABBs sind um die bewegung in diesem frame erweitert
+        swept_rects = []
+        for entity_components in entites_data.values():
+            velocity: Velocity = entity_components[Velocity]
+            transform: Transform = entity_components[Transform]
+            dx, dy = velocity.x * dt, velocity.y * dt
+            swept_rects.append((transform.x + min(dx, 0), transform.y + min(dy, 0), transform.w + abs(dx), transform.h + abs(dy)))
+        # ein tile rand wie bei physics_rects_around, falls ein item in einem tile startet und rausgeschoben wird
+        broadphase = tilemap.query_many(swept_rects, margin=tilemap.tile_size)
+
+        for i, entity_components in enumerate(entites_data.values()):
+            item_component: Item = entity_components[Item]
+            if item_component.ignore_physics:
+                continue
+
+            velocity: Velocity = entity_components[Velocity]
             transform: Transform = entity_components[Transform]
-            tp = transform.tile_pos()
-            tp = (tp[0] * 16, tp[1] * 16)
-            size = transform.size_int
-            entity_map[(tp, size)].append((entity, entity_components))
-
-        for (tile_pos, group_size), entity_group in entity_map.items():
-            nearby_rects = tilemap.physics_rects_around(tile_pos, size=group_size)
-            nearby_tiles = tilemap.get_around(tile_pos, size=group_size, ignore={"decor"})
-
-            for entity, entity_components in entity_group:
-                item_component: Item = entity_components[Item]
-                if item_component.ignore_physics:
-                    continue
-
-                velocity: Velocity = entity_components[Velocity]
-                transform: Transform = entity_components[Transform]
-
-                frame_movement = (velocity.x * dt, velocity.y * dt)
-                collisions = {'up': False, 'down': False, 'right': False, 'left': False}
-
-                if frame_movement[0]:
-                    transform.x += frame_movement[0]
-                    if frame_movement[0]:
-                        entity_rect = transform.frect
-                        for rect, tile in zip(nearby_rects, nearby_tiles):
-                            if entity_rect.colliderect(rect):
-                                if frame_movement[0] > 0:  # right
-                                    entity_rect.right = rect.left
-                                    collisions['right'] = True
-                                if frame_movement[0] < 0:  # left
-                                    entity_rect.left = rect.right
-                                    collisions['left'] = True
-                                transform.x = entity_rect.x
-                                break  # TODO sich vergewissern, dass das nicht das Ding zerstört.
-                if frame_movement[1]:
-                    transform.y += frame_movement[1]
-                    if frame_movement[1]:
-                        entity_rect = transform.frect
-                        for rect, tile in zip(nearby_rects, nearby_tiles):
-                            if entity_rect.colliderect(rect):
-                                if frame_movement[1] > 0:  # downards
-                                    entity_rect.bottom = rect.top
-                                    collisions['down'] = True
-                                if frame_movement[1] < 0:  # upwards
-                                    entity_rect.top = rect.bottom
-                                    collisions['up'] = True
-                                transform.y = entity_rect.y
-                                break  # TODO sich vergewissern, dass das nicht das Ding zerstört.
-
-                velocity[1] = min(max_gravity/1, velocity[1] + gravity)
-
-                if collisions['down'] or collisions['up']:
-                    velocity.y *= -friction
-                    velocity.x *= friction
-                if abs(velocity.y) <= 4:
-                    velocity.y = 0
-
-                if collisions['right'] or collisions['left']:
-                    velocity.x *= -friction
-                if abs(velocity.x) <= 4:
-                    velocity.x = 0
+            nearby_rects = broadphase.rects_for(i)
+
+            frame_movement = (velocity.x * dt, velocity.y * dt)
+            collisions = {'up': False, 'down': False, 'right': False, 'left': False}
+
+            if frame_movement[0]:
+                transform.x += frame_movement[0]
+                entity_rect = transform.frect
+                for rect in nearby_rects:
+                    if entity_rect.colliderect(rect):
+                        if frame_movement[0] > 0:  # right
+                            entity_rect.right = rect.left
+                            collisions['right'] = True
+                        if frame_movement[0] < 0:  # left
+                            entity_rect.left = rect.right
+                            collisions['left'] = True
+                        transform.x = entity_rect.x
+                        break  # TODO sich vergewissern, dass das nicht das Ding zerstört.
+            if frame_movement[1]:
+                transform.y += frame_movement[1]
+                entity_rect = transform.frect
+                for rect in nearby_rects:
+                    if entity_rect.colliderect(rect):
+                        if frame_movement[1] > 0:  # downards
+                            entity_rect.bottom = rect.top
+                            collisions['down'] = True
+                        if frame_movement[1] < 0:  # upwards
+                            entity_rect.top = rect.bottom
+                            collisions['up'] = True
+                        transform.y = entity_rect.y
+                        break  # TODO sich vergewissern, dass das nicht das Ding zerstört.
+
+            velocity[1] = min(max_gravity/1, velocity[1] + gravity)
+
+            if collisions['down'] or collisions['up']:
+                velocity.y *= -friction
+                velocity.x *= friction
+            if abs(velocity.y) <= 4:
+                velocity.y = 0
+
+            if collisions['right'] or collisions['left']:
+                velocity.x *= -friction
+            if abs(velocity.x) <= 4:
+                velocity.x = 0
 
             if "debug_tiles" in kwargs:
-                # Kann sein das selbst aufgehobene Items trotzdem hier angezeigt werden,
-                # da sie gruppiert sind und das hier läuft nicht pro Item sondern pro Gruppe.
-                debug_tiles |= {tuple(r) for r in tilemap.physics_rects_around(transform.pos, size=group_size)}
+                debug_tiles |= {tuple(r) for r in nearby_rects}
 
         if "debug_tiles" in kwargs:
             color = kwargs["debug_tiles"]
@@ -958,42 +985,67 @@ class ParticleSystemUpdater(Ecs.ExtendedSystem):
 
     def update_entities(self, entites_data: dict[Entity, dict[type[BaseComponent], BaseComponent]], **kwargs) -> list[Ecs.Entity]:
         to_remove: List[Ecs.Entity] = []
-        for entity, entity_components in entites_data.items():
-            velocity: Velocity = entity_components[Velocity]
-            transform: Transform = entity_components[Transform]
-            anim: Animation = entity_components[Animation]
+        tilemap: TileMap = kwargs["tilemap"]
+        dt = kwargs["dt"]
 
-            tilemap = kwargs["tilemap"]
-            dt = kwargs["dt"]
-            frame_movement = (velocity.x * dt, velocity.y * dt)
+        gravity = kwargs["gravity"]
+        max_gravity = kwargs["max_gravity"]
+        margin = tilemap.tile_size  # ein tile rand wie bei physics_rects_around
+        entities = list(entites_data.items())
+        all_collisions = [{'up': False, 'down': False, 'right': False, 'left': False} for _ in entities]
+
+        # x und y achse jeweils mit einem broadphase query für alle partikel,
+        # die AABBs sind um die bewegung auf der achse erweitert
+        swept_rects = []
+        for entity, entity_components in entities:
+            transform: Transform = entity_components[Transform]
+            dx = entity_components[Velocity].x * dt
+            swept_rects.append((transform.x + min(dx, 0), transform.y, transform.w + abs(dx), transform.h))
+        broadphase = tilemap.query_many(swept_rects, margin=margin)
 
-            collisions = {'up': False, 'down': False, 'right': False, 'left': False}
+        for i, (entity, entity_components) in enumerate(entities):
+            transform: Transform = entity_components[Transform]
+            dx = entity_components[Velocity].x * dt
+            collisions = all_collisions[i]
 
-            transform.x += frame_movement[0]
+            transform.x += dx
             entity_rect = transform.frect
-            for rect, tile in zip(tilemap.physics_rects_around(transform.pos), tilemap.get_around(transform.pos, ignore={"decor"})):
+            for rect in broadphase.rects_for(i):
                 if entity_rect.colliderect(rect):
-                    if frame_movement[0] > 0:  # right
+                    if dx > 0:  # right
                         entity_rect.right = rect.left
                         collisions['right'] = True
-                    if frame_movement[0] < 0:  # left
+                    if dx < 0:  # left
                         entity_rect.left = rect.right
                         collisions['left'] = True
                     transform.x = entity_rect.x
-            transform.y += frame_movement[1]
+
+        swept_rects = []
+        for entity, entity_components in entities:
+            transform: Transform = entity_components[Transform]
+            dy = entity_components[Velocity].y * dt
+            swept_rects.append((transform.x, transform.y + min(dy, 0), transform.w, transform.h + abs(dy)))
+        broadphase = tilemap.query_many(swept_rects, margin=margin)
+
+        for i, (entity, entity_components) in enumerate(entities):
+            velocity: Velocity = entity_components[Velocity]
+            transform: Transform = entity_components[Transform]
+            anim: Animation = entity_components[Animation]
+            dy = velocity.y * dt
+            collisions = all_collisions[i]
+
+            transform.y += dy
             entity_rect = transform.frect
-            for rect, tile in zip(tilemap.physics_rects_around(transform.pos), tilemap.get_around(transform.pos, ignore={"decor"})):
+            for rect in broadphase.rects_for(i):
                 if entity_rect.colliderect(rect):
-                    if frame_movement[1] > 0:  # downards
+                    if dy > 0:  # downards
                         entity_rect.bottom = rect.top
                         collisions['down'] = True
-                    if frame_movement[1] < 0:  # upwards
+                    if dy < 0:  # upwards
                         entity_rect.top = rect.bottom
                         collisions['up'] = True
                     transform.y = entity_rect.y
 
-            gravity = kwargs["gravity"]
-            max_gravity = kwargs["max_gravity"]
             velocity[1] = min(max_gravity/1, velocity[1] + gravity)
 
             if collisions["down"]:
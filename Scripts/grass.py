@@ -0,0 +1,121 @@
+from typing import Callable
+
+import numpy as np
+import pygame
+
+
+class GrassField:
+    """
+    All grass blades of a map as NumPy arrays (structure of arrays).
+
+    The blades are sorted by x, so the blades of a horizontal slice of the map are one
+    contiguous range found with `searchsorted`. `rest` is the angle from the wind,
+    `angle` is the drawn angle after entities pushed the blades.
+    """
+
+    def __init__(self, tile_size: int, angle_step: float, max_angle: float = 90) -> None:
+        self.tile_size = tile_size
+        self.angle_step = angle_step
+        self.max_angle = max_angle
+        self.set_blades([], [], [], [])
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def set_blades(self, x, y, variant, patch) -> None:
+        """Replaces all blades. `patch` is the tile position of the grass patch of each blade, shape (N, 2)."""
+        x = np.asarray(x, dtype=np.float64)
+        order = np.argsort(x, kind="stable")
+        self.x = x[order]
+        self.y = np.asarray(y, dtype=np.float64)[order]
+        self.variant = np.asarray(variant, dtype=np.int32)[order]
+        patch = np.asarray(patch, dtype=np.int64).reshape(-1, 2)[order]
+        self.patch_x = np.ascontiguousarray(patch[:, 0])
+        self.patch_y = np.ascontiguousarray(patch[:, 1])
+        self.angle = np.zeros(len(self.x), dtype=np.float64)
+        self.rest = np.zeros(len(self.x), dtype=np.float64)
+
+    def quantize(self, angles: np.ndarray) -> np.ndarray:
+        """Same as `clamp_number_to_range_steps` for arrays."""
+        return np.round(np.clip(angles, -self.max_angle, self.max_angle) / self.angle_step) * self.angle_step
+
+    def visible(self, rect, margin: float = 0) -> np.ndarray:
+        """Indices of the blades whose position lies in `rect` = (x, y, w, h) grown by `margin`."""
+        x0, y0 = rect[0] - margin, rect[1] - margin
+        x1, y1 = rect[0] + rect[2] + margin, rect[1] + rect[3] + margin
+        start, stop = np.searchsorted(self.x, (x0, x1), side="left")
+        ys = self.y[start:stop]
+        return np.nonzero((ys >= y0) & (ys <= y1))[0] + start
+
+    def apply_wind(self, wind: Callable[[np.ndarray], np.ndarray], indices: np.ndarray) -> None:
+        """`wind` gets an array of x positions and returns the rest angles."""
+        rest = self.quantize(np.asarray(wind(self.x[indices]), dtype=np.float64))
+        self.rest[indices] = rest
+        self.angle[indices] = rest
+
+    def push(self, pos, force_radius: float, force_dropoff: float, indices: np.ndarray) -> np.ndarray:
+        """
+        Bends the blades in the 3x3 tiles around `pos` away from it, only blades in `indices` are considered.
+        Returns the indices of the blades that got bend and are closer than 5px.
+        """
+        ts = self.tile_size
+        tx, ty = int(pos[0] // ts), int(pos[1] // ts)
+        near = indices[(np.abs(self.patch_x[indices] - tx) <= 1) & (np.abs(self.patch_y[indices] - ty) <= 1)]
+        if not len(near):
+            return near
+
+        bx, by, angle = self.x[near], self.y[near], self.angle[near]
+        dis = np.hypot(bx - pos[0], by - pos[1])
+        inside = dis < force_radius
+        dis = np.where(inside, dis, np.maximum(dis - force_radius, 0))
+        force = np.where(inside, 2, 1 - np.minimum(dis / force_dropoff, 1))
+        direction = np.where(pos[0] < bx, -1, 1)
+        # nur updaten wenn die kraft stärker ist
+        bend = np.abs(angle) < force * 90
+        self.angle[near[bend]] = self.quantize(direction[bend] * force[bend] * 90 + angle[bend] * 0.5)
+        return near[bend & (dis < 5)]
+
+
+class GrassAtlas:
+    """
+    Every blade variant pre-rotated to every angle `GrassField.quantize` can return,
+    packed into one surface. `surfaces[variant * angle_count + k]` are subsurfaces of the atlas.
+    """
+
+    def __init__(self, images: list[pygame.Surface], angle_step: float, max_angle: float = 90) -> None:
+        self.angle_step = angle_step
+        self.max_steps = int(round(max_angle / angle_step))
+        self.angle_count = 2 * self.max_steps + 1
+
+        rotated = [[pygame.transform.rotate(img, (k - self.max_steps) * angle_step) for k in range(self.angle_count)]
+                   for img in images]
+        width = max((sum(r.get_width() for r in row) for row in rotated), default=0)
+        height = sum(max(r.get_height() for r in row) for row in rotated)
+        # schwarz ist wie bei den assets der colorkey
+        self.atlas = pygame.Surface((max(width, 1), max(height, 1)))
+        self.atlas.set_colorkey((0, 0, 0))
+
+        self.surfaces: list[pygame.Surface] = []
+        offsets = []
+        y = 0
+        for img, row in zip(images, rotated):
+            x = 0
+            for r in row:
+                self.atlas.blit(r, (x, y))
+                sub = self.atlas.subsurface((x, y, r.get_width(), r.get_height()))
+                sub.set_colorkey((0, 0, 0))
+                self.surfaces.append(sub)
+                # rotiert um die mitte des originalbilds
+                offsets.append((img.get_width() / 2 - r.get_width() / 2, img.get_height() / 2 - r.get_height() / 2))
+                x += r.get_width()
+            y += max(r.get_height() for r in row)
+        self.offsets = np.array(offsets, dtype=np.float64).reshape(-1, 2)
+
+    def blits(self, grass: GrassField, indices: np.ndarray, offset=(0, 0)) -> list[tuple[pygame.Surface, tuple[float, float]]]:
+        """`(surface, pos)` pairs for `fblits` for the blades in `indices`."""
+        steps = np.rint(grass.angle[indices] / self.angle_step).astype(np.intp)
+        flat = grass.variant[indices] * self.angle_count + np.clip(steps, -self.max_steps, self.max_steps) + self.max_steps
+        xs = grass.x[indices] + self.offsets[flat, 0] - offset[0]
+        ys = grass.y[indices] + self.offsets[flat, 1] - offset[1]
+        surfaces = self.surfaces
+        return [(surfaces[i], pos) for i, pos in zip(flat.tolist(), zip(xs.tolist(), ys.tolist()))]
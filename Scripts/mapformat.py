@@ -0,0 +1,156 @@
+"""
+Binary map format (`.map`).
+
+Layout, all little endian:
+    header              MAP_HEADER
+    type names          u8 length + utf-8 name per type, file type id = index + 1
+    chunk directory     DIRECTORY_ENTRY per chunk, with a bitset of the file type ids in the chunk
+    tile records        TILE_RECORD per tile, grouped by chunk
+    offgrid records     OFFGRID_RECORD per off-grid tile
+
+Chunks are only decoded when `MapFile.decode_chunk` is called, the file is memory-mapped.
+The type bitsets tell which chunks contain a tile type without decoding them. Version 1 files (no bitsets) are still read.
+"""
+import mmap
+import struct
+from typing import Iterable
+
+import numpy as np
+
+from Scripts.tilegrid import GridChunk, GRID_CHUNK_SHIFT, GRID_CHUNK_MASK
+
+MAP_MAGIC = b"PGMAP\x00"
+MAP_FORMAT_VERSION = 2
+
+# magic, version, tile size, type count, chunk count, offgrid count, types offset, directory offset, offgrid offset
+MAP_HEADER = struct.Struct("<6sHHHIIQQQ")
+# layer, chunk x, chunk y, offset of the tile records, tile count, type bitset (bit i = file type id i im chunk)
+DIRECTORY_ENTRY = struct.Struct("<biiQH32s")
+DIRECTORY_ENTRY_V1 = struct.Struct("<biiQH")
+# position im chunk, file type id, variant
+TILE_RECORD = np.dtype([("x", "u1"), ("y", "u1"), ("type", "u1"), ("variant", "u1")])
+OFFGRID_RECORD = np.dtype([("type", "u1"), ("variant", "u1"), ("x", "<f8"), ("y", "<f8")])
+
+
+def is_binary_map(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAP_MAGIC)) == MAP_MAGIC
+
+
+def write_map(path: str, tile_size: int, layers: dict[str, Iterable[tuple[int, int, str, int]]], offgrid: list[dict]) -> None:
+    """`layers` maps the layer name to `(x, y, type, variant)` tuples in tile space."""
+    names: list[str] = []
+    ids: dict[str, int] = {}
+
+    def type_id(name: str) -> int:
+        if name not in ids:
+            names.append(name)
+            ids[name] = len(names)
+            if ids[name] > 255:
+                raise ValueError(f"Too many tile types, cannot write {name!r}")
+        return ids[name]
+
+    chunks: dict[tuple[int, int, int], list[tuple[int, int, int, int]]] = {}
+    for layer, tiles in layers.items():
+        for x, y, name, variant in tiles:
+            key = (int(layer), x >> GRID_CHUNK_SHIFT, y >> GRID_CHUNK_SHIFT)
+            chunks.setdefault(key, []).append((x & GRID_CHUNK_MASK, y & GRID_CHUNK_MASK, type_id(name), variant))
+    offgrid_records = np.array([(type_id(t["type"]), t["variant"], t["pos"][0], t["pos"][1]) for t in offgrid], dtype=OFFGRID_RECORD)
+
+    type_table = b"".join(bytes([len(n.encode())]) + n.encode() for n in names)
+    types_offset = MAP_HEADER.size
+    directory_offset = types_offset + len(type_table)
+    data_offset = directory_offset + DIRECTORY_ENTRY.size * len(chunks)
+
+    directory = []
+    records = []
+    for (layer, cx, cy), tiles in chunks.items():
+        present = 0
+        for _, _, t, _ in tiles:
+            present |= 1 << t
+        directory.append(DIRECTORY_ENTRY.pack(layer, cx, cy, data_offset, len(tiles), present.to_bytes(32, "little")))
+        data = np.array(tiles, dtype=TILE_RECORD).tobytes()
+        records.append(data)
+        data_offset += len(data)
+
+    with open(path, "wb") as f:
+        f.write(MAP_HEADER.pack(MAP_MAGIC, MAP_FORMAT_VERSION, tile_size, len(names), len(chunks), len(offgrid_records),
+                                types_offset, directory_offset, data_offset))
+        f.write(type_table)
+        f.writelines(directory)
+        f.writelines(records)
+        f.write(offgrid_records.tobytes())
+
+
+class MapFile:
+    """A memory-mapped binary map, only the header and the chunk directory are read when opening."""
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # leere datei
+            self._file.close()
+            raise ValueError(f"{path} is not a binary map")
+
+        if len(self._mmap) < MAP_HEADER.size:
+            self.close()
+            raise ValueError(f"{path} is not a binary map")
+        (magic, version, self.tile_size, type_count, chunk_count, self._offgrid_count,
+         types_offset, directory_offset, self._offgrid_offset) = MAP_HEADER.unpack_from(self._mmap, 0)
+        if magic != MAP_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a binary map")
+        if version not in (1, MAP_FORMAT_VERSION):
+            self.close()
+            raise ValueError(f"Unsupported map format version {version} in {path}")
+
+        self.type_names: list[str] = []
+        offset = types_offset
+        for _ in range(type_count):
+            length = self._mmap[offset]
+            self.type_names.append(self._mmap[offset + 1:offset + 1 + length].decode())
+            offset += 1 + length
+
+        # layer -> {(cx, cy): (offset, tile count)}
+        self.chunks: dict[str, dict[tuple[int, int], tuple[int, int]]] = {}
+        # layer -> {(cx, cy): file type ids im chunk}, leer bei version 1 (unbekannt)
+        self.chunk_types: dict[str, dict[tuple[int, int], frozenset[int]]] = {}
+        entry = DIRECTORY_ENTRY if version >= 2 else DIRECTORY_ENTRY_V1
+        for i in range(chunk_count):
+            layer, cx, cy, data_offset, count, *bitset = entry.unpack_from(self._mmap, directory_offset + i * entry.size)
+            self.chunks.setdefault(str(layer), {})[(cx, cy)] = (data_offset, count)
+            if bitset:
+                bits = int.from_bytes(bitset[0], "little")
+                self.chunk_types.setdefault(str(layer), {})[(cx, cy)] = frozenset(
+                    t for t in range(1, type_count + 1) if bits >> t & 1)
+
+    def close(self) -> None:
+        self._mmap.close()
+        self._file.close()
+
+    def records(self, offset: int, count: int) -> np.ndarray:
+        # kopie des bereichs, damit keine views auf die mmap offen bleiben und close() immer geht
+        return np.frombuffer(self._mmap[offset:offset + count * TILE_RECORD.itemsize], dtype=TILE_RECORD)
+
+    def decode_chunk(self, offset: int, count: int, type_ids: np.ndarray) -> GridChunk:
+        """`type_ids` maps the file type ids to the ids of the tilemap's `TileTypeRegistry`."""
+        records = self.records(offset, count)
+        chunk = GridChunk()
+        ys, xs = records["y"] & GRID_CHUNK_MASK, records["x"] & GRID_CHUNK_MASK
+        chunk.types[ys, xs] = type_ids[records["type"]]
+        chunk.variants[ys, xs] = records["variant"]
+        chunk.count = np.count_nonzero(chunk.types)
+        return chunk
+
+    def tiles(self, layer: str) -> Iterable[tuple[int, int, str, int]]:
+        """Yields `(x, y, type, variant)` for every tile of `layer`."""
+        for (cx, cy), (offset, count) in self.chunks.get(layer, {}).items():
+            ox, oy = cx << GRID_CHUNK_SHIFT, cy << GRID_CHUNK_SHIFT
+            for x, y, type_id, variant in self.records(offset, count).tolist():
+                yield (ox + x, oy + y, self.type_names[type_id - 1], variant)
+
+    def offgrid(self) -> list[dict]:
+        size = self._offgrid_count * OFFGRID_RECORD.itemsize
+        records = np.frombuffer(self._mmap[self._offgrid_offset:self._offgrid_offset + size], dtype=OFFGRID_RECORD)
+        return [{"type": self.type_names[t - 1], "variant": v, "pos": [x, y]} for t, v, x, y in records.tolist()]
@@ -0,0 +1,130 @@
+from typing import Callable, Iterator
+
+import pygame
+
+OFFGRID_BUCKET_SIZE = 128  # pixel pro bucket seite
+
+
+class OffgridIndex:
+    """
+    Bucketed spatial index for off-grid tiles (`{"type", "variant", "pos"}` dicts with pixel positions).
+
+    Every tile gets an increasing handle, results are sorted by handle so they keep the
+    order in which the tiles were added (= render order). Removal by handle is O(1).
+
+    Tiles added without a size are sized lazily with `size_of` on the next query. While `size_of`
+    returns None for a tile (no image for its type yet) the tile is not found by queries.
+    """
+
+    def __init__(self, bucket_size: int = OFFGRID_BUCKET_SIZE, size_of: Callable[[dict], tuple[int, int] | None] | None = None) -> None:
+        self.bucket_size = bucket_size
+        self.size_of = size_of
+        self._tiles: dict[int, dict] = {}
+        self._bounds: dict[int, pygame.FRect] = {}
+        self._buckets: dict[tuple[int, int], set[int]] = {}
+        self._unsized: dict[int, None] = {}  # handles ohne bounds, dict wegen der reihenfolge
+        self._next_handle = 0
+
+    def __len__(self) -> int:
+        return len(self._tiles)
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(list(self._tiles.values()))
+
+    def items(self) -> list[tuple[int, dict]]:
+        return list(self._tiles.items())
+
+    def clear(self) -> None:
+        self._tiles.clear()
+        self._bounds.clear()
+        self._buckets.clear()
+        self._unsized.clear()
+
+    def _bucket_range(self, rect: pygame.FRect) -> tuple[int, int, int, int]:
+        bs = self.bucket_size
+        return (int(rect.left // bs), int(rect.top // bs), int(rect.right // bs), int(rect.bottom // bs))
+
+    def add(self, tile: dict, size: tuple[int, int] | None = None) -> int:
+        """Adds `tile`, `size` is the size of its image in pixel (None: later via `size_of`). Returns the handle."""
+        handle = self._next_handle
+        self._next_handle += 1
+        self._tiles[handle] = tile
+        if size is None:
+            self._unsized[handle] = None
+        else:
+            self._insert(handle, size)
+        return handle
+
+    def _insert(self, handle: int, size: tuple[int, int]) -> None:
+        tile = self._tiles[handle]
+        bounds = pygame.FRect(tile["pos"][0], tile["pos"][1], size[0], size[1])
+        self._bounds[handle] = bounds
+        bx0, by0, bx1, by1 = self._bucket_range(bounds)
+        for by in range(by0, by1 + 1):
+            for bx in range(bx0, bx1 + 1):
+                bucket = self._buckets.get((bx, by))
+                if bucket is None:
+                    bucket = self._buckets[(bx, by)] = set()
+                bucket.add(handle)
+
+    def _size_pending(self) -> None:
+        if not self._unsized or self.size_of is None:
+            return
+        for handle in list(self._unsized):
+            size = self.size_of(self._tiles[handle])
+            if size is not None:
+                del self._unsized[handle]
+                self._insert(handle, size)
+
+    def remove(self, handle: int) -> dict:
+        tile = self._tiles.pop(handle)
+        if handle in self._unsized:
+            del self._unsized[handle]
+            return tile
+        bx0, by0, bx1, by1 = self._bucket_range(self._bounds.pop(handle))
+        for by in range(by0, by1 + 1):
+            for bx in range(bx0, bx1 + 1):
+                bucket = self._buckets[(bx, by)]
+                bucket.discard(handle)
+                if not bucket:
+                    del self._buckets[(bx, by)]
+        return tile
+
+    def get(self, handle: int) -> dict | None:
+        return self._tiles.get(handle)
+
+    def bounds(self, handle: int) -> pygame.FRect | None:
+        """Bounds of the tile image, None while its size is unknown."""
+        self._size_pending()
+        return self._bounds.get(handle)
+
+    def handles_in_rect(self, rect) -> list[int]:
+        """Handles of all tiles whose image overlaps `rect` (pixel, world space), in add order."""
+        self._size_pending()
+        rect = pygame.FRect(rect)
+        bx0, by0, bx1, by1 = self._bucket_range(rect)
+        candidates = set()
+        for by in range(by0, by1 + 1):
+            for bx in range(bx0, bx1 + 1):
+                bucket = self._buckets.get((bx, by))
+                if bucket:
+                    candidates |= bucket
+        bounds = self._bounds
+        return sorted(h for h in candidates if rect.colliderect(bounds[h]))
+
+    def handles_at(self, pos) -> list[int]:
+        """Handles of all tiles whose image contains the point `pos` (pixel, world space), in add order."""
+        self._size_pending()
+        bucket = self._buckets.get((int(pos[0] // self.bucket_size), int(pos[1] // self.bucket_size)))
+        if not bucket:
+            return []
+        bounds = self._bounds
+        return sorted(h for h in bucket if bounds[h].collidepoint(pos))
+
+    def in_rect(self, rect) -> list[dict]:
+        tiles = self._tiles
+        return [tiles[h] for h in self.handles_in_rect(rect)]
+
+    def at(self, pos) -> list[dict]:
+        tiles = self._tiles
+        return [tiles[h] for h in self.handles_at(pos)]
@@ -0,0 +1,249 @@
+import collections.abc
+from typing import Callable, Iterator
+
+import numpy as np
+
+GRID_CHUNK_SIZE = 16  # tiles pro chunk seite, muss eine zweierpotenz sein
+GRID_CHUNK_SHIFT = GRID_CHUNK_SIZE.bit_length() - 1
+GRID_CHUNK_MASK = GRID_CHUNK_SIZE - 1
+
+EMPTY = 0  # type id 0 = kein tile
+
+
+class TileTypeRegistry:
+    """Maps tile type names (e.g. "grass") to small integer ids and back."""
+    max_types = 255  # ids werden als uint8 gespeichert
+
+    def __init__(self) -> None:
+        self.names: list[str | None] = [None]
+        self.ids: dict[str, int] = {}
+
+    def __len__(self) -> int: return len(self.names) - 1
+
+    def id_of(self, name: str) -> int:
+        """Returns the id of `name` and registers it if it is unknown."""
+        type_id = self.ids.get(name)
+        if type_id is None:
+            if len(self.names) > self.max_types:
+                raise ValueError(f"Too many tile types, cannot register {name!r}")
+            type_id = len(self.names)
+            self.names.append(name)
+            self.ids[name] = type_id
+        return type_id
+
+    def get_id(self, name: str) -> int:
+        """Like `id_of` but returns `EMPTY` for unknown names instead of registering them."""
+        return self.ids.get(name, EMPTY)
+
+    def name_of(self, type_id: int) -> str | None:
+        return self.names[type_id]
+
+
+class GridChunk:
+    __slots__ = ("types", "variants", "count")
+
+    def __init__(self) -> None:
+        # indexiert mit [y, x] (lokale tile koordinaten)
+        self.types = np.zeros((GRID_CHUNK_SIZE, GRID_CHUNK_SIZE), dtype=np.uint8)
+        self.variants = np.zeros((GRID_CHUNK_SIZE, GRID_CHUNK_SIZE), dtype=np.uint8)
+        self.count = 0
+
+
+class TileGrid:
+    """
+    Sparse tile storage for one layer.
+
+    Tiles live in fixed-size NumPy chunks of type/variant ids, so every lookup
+    is two shifts, one dict lookup with an int tuple and one array read.
+    Chunks can also be pending (see `set_pending`), they are decoded on first access.
+    Use `chunk`/`keys` instead of `chunks` if the grid could have pending chunks.
+    """
+    __slots__ = ("chunks", "_pending", "_pending_count")
+
+    def __init__(self) -> None:
+        self.chunks: dict[tuple[int, int], GridChunk] = {}
+        # key -> (loader, tile count, type ids im chunk oder None wenn unbekannt)
+        self._pending: dict[tuple[int, int], tuple[Callable[[], GridChunk], int, frozenset[int] | None]] = {}
+        self._pending_count = 0
+
+    def __len__(self) -> int:
+        return sum(c.count for c in self.chunks.values()) + self._pending_count
+
+    def __bool__(self) -> bool:
+        return bool(self.chunks) or bool(self._pending)
+
+    def __contains__(self, pos) -> bool:
+        return self.type_at(pos[0], pos[1]) != EMPTY
+
+    def clear(self) -> None:
+        self.chunks.clear()
+        self._pending.clear()
+        self._pending_count = 0
+
+    def set_pending(self, key: tuple[int, int], loader: Callable[[], GridChunk], count: int,
+                    types: frozenset[int] | None = None) -> None:
+        """
+        Registers a chunk with `count` tiles that is decoded by `loader` on first access.
+        `types` are the type ids in the chunk if known, `cells(type_ids)` skips chunks without them.
+        """
+        self.chunks.pop(key, None)
+        if key in self._pending:
+            self._pending_count -= self._pending[key][1]
+        self._pending[key] = (loader, count, types)
+        self._pending_count += count
+
+    def _decode(self, key: tuple[int, int]) -> GridChunk | None:
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return None
+        loader, count, _ = pending
+        self._pending_count -= count
+        chunk = self.chunks[key] = loader()
+        return chunk
+
+    def load_all(self) -> None:
+        for key in list(self._pending):
+            self._decode(key)
+
+    def keys(self) -> set[tuple[int, int]]:
+        """Keys of all chunks, pending chunks are not decoded."""
+        return set(self.chunks) | set(self._pending)
+
+    def chunk(self, key: tuple[int, int]) -> GridChunk | None:
+        chunk = self.chunks.get(key)
+        if chunk is None and self._pending:
+            return self._decode(key)
+        return chunk
+
+    def chunk_at(self, x: int, y: int) -> GridChunk | None:
+        return self.chunk((x >> GRID_CHUNK_SHIFT, y >> GRID_CHUNK_SHIFT))
+
+    def type_at(self, x: int, y: int) -> int:
+        chunk = self.chunks.get((x >> GRID_CHUNK_SHIFT, y >> GRID_CHUNK_SHIFT))
+        if chunk is None:
+            if not self._pending:
+                return EMPTY
+            chunk = self._decode((x >> GRID_CHUNK_SHIFT, y >> GRID_CHUNK_SHIFT))
+            if chunk is None:
+                return EMPTY
+        return chunk.types.item(y & GRID_CHUNK_MASK, x & GRID_CHUNK_MASK)
+
+    def get(self, x: int, y: int) -> tuple[int, int] | None:
+        """Returns `(type_id, variant)` or None for an empty cell."""
+        chunk = self.chunks.get((x >> GRID_CHUNK_SHIFT, y >> GRID_CHUNK_SHIFT))
+        if chunk is None:
+            if not self._pending:
+                return None
+            chunk = self._decode((x >> GRID_CHUNK_SHIFT, y >> GRID_CHUNK_SHIFT))
+            if chunk is None:
+                return None
+        ly, lx = y & GRID_CHUNK_MASK, x & GRID_CHUNK_MASK
+        type_id = chunk.types.item(ly, lx)
+        if type_id == EMPTY:
+            return None
+        return (type_id, chunk.variants.item(ly, lx))
+
+    def set(self, x: int, y: int, type_id: int, variant: int) -> None:
+        key = (x >> GRID_CHUNK_SHIFT, y >> GRID_CHUNK_SHIFT)
+        chunk = self.chunk(key)
+        if chunk is None:
+            chunk = self.chunks[key] = GridChunk()
+        ly, lx = y & GRID_CHUNK_MASK, x & GRID_CHUNK_MASK
+        if chunk.types[ly, lx] == EMPTY:
+            chunk.count += 1
+        chunk.types[ly, lx] = type_id
+        chunk.variants[ly, lx] = variant
+
+    def remove(self, x: int, y: int) -> bool:
+        key = (x >> GRID_CHUNK_SHIFT, y >> GRID_CHUNK_SHIFT)
+        chunk = self.chunk(key)
+        if chunk is None:
+            return False
+        ly, lx = y & GRID_CHUNK_MASK, x & GRID_CHUNK_MASK
+        if chunk.types[ly, lx] == EMPTY:
+            return False
+        chunk.types[ly, lx] = EMPTY
+        chunk.variants[ly, lx] = 0
+        chunk.count -= 1
+        if not chunk.count:
+            del self.chunks[key]
+        return True
+
+    def cells(self, type_ids: collections.abc.Set[int] | None = None) -> Iterator[tuple[int, int, int, int]]:
+        """
+        Yields `(x, y, type_id, variant)` for every tile, or only for tiles with one of `type_ids`.
+        With `type_ids` only the pending chunks that (may) contain these types are decoded.
+        Do not modify the grid while iterating.
+        """
+        if type_ids is None:
+            self.load_all()
+        else:
+            for key, (_, _, types) in list(self._pending.items()):
+                if types is None or not types.isdisjoint(type_ids):
+                    self._decode(key)
+            wanted = np.array([t for t in type_ids if t != EMPTY], dtype=np.uint8)
+        for (cx, cy), chunk in self.chunks.items():
+            ox, oy = cx << GRID_CHUNK_SHIFT, cy << GRID_CHUNK_SHIFT
+            ys, xs = np.nonzero(chunk.types if type_ids is None else np.isin(chunk.types, wanted))
+            for ly, lx in zip(ys.tolist(), xs.tolist()):
+                yield (ox + lx, oy + ly, chunk.types.item(ly, lx), chunk.variants.item(ly, lx))
+
+
+def parse_loc(loc: str) -> tuple[int, int]:
+    x, y = loc.split(";")
+    return (int(x), int(y))
+
+
+class LayerView(collections.abc.MutableMapping):
+    """
+    Compatibility view of one layer as the old `{"x;y": {"type", "variant", "pos"}}` dict.
+
+    The returned tile dicts are snapshots, changing them does not change the map.
+    Writes go through `TileMap.set_tile`/`TileMap.remove_tile`.
+    """
+
+    def __init__(self, tilemap, layer: str) -> None:
+        self._tilemap = tilemap
+        self._layer = layer
+
+    def __getitem__(self, loc: str) -> dict:
+        x, y = parse_loc(loc)
+        tile = self._tilemap.get_tile((x, y), layer=self._layer)
+        if tile is None:
+            raise KeyError(loc)
+        return tile
+
+    def __setitem__(self, loc: str, tile: dict) -> None:
+        self._tilemap.set_tile(parse_loc(loc), tile["type"], tile["variant"], layer=self._layer)
+
+    def __delitem__(self, loc: str) -> None:
+        if not self._tilemap.remove_tile(parse_loc(loc), layer=self._layer):
+            raise KeyError(loc)
+
+    def __contains__(self, loc) -> bool:
+        if not isinstance(loc, str):
+            return False
+        return parse_loc(loc) in self._tilemap.grids[self._layer]
+
+    def __iter__(self) -> Iterator[str]:
+        # liste, damit man beim iterieren löschen kann
+        return iter([f"{x};{y}" for x, y, _, _ in self._tilemap.grids[self._layer].cells()])
+
+    def __len__(self) -> int:
+        return len(self._tilemap.grids[self._layer])
+
+
+class TilemapView(collections.abc.Mapping):
+    """Compatibility view of all layers as the old `{layer: {"x;y": tile}}` dict."""
+
+    def __init__(self, tilemap) -> None:
+        self._views = {layer: LayerView(tilemap, layer) for layer in tilemap.grids}
+
+    def __getitem__(self, layer: str) -> LayerView:
+        return self._views[layer]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._views)
+
+    def __len__(self) -> int:
+        return len(self._views)
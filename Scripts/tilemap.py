@@ -1,10 +1,16 @@
 import functools
 import json
+import math
 
+import numpy as np
 import pygame
 import random
 
-from Scripts.utils_math import clamp_number_to_range_steps, dist
+from Scripts.tilegrid import TileGrid, GridChunk, TileTypeRegistry, TilemapView, GRID_CHUNK_SHIFT, GRID_CHUNK_SIZE, GRID_CHUNK_MASK
+from Scripts.collision_index import CollisionIndex, BroadphaseResult
+from Scripts.offgrid_index import OffgridIndex
+from Scripts.grass import GrassField, GrassAtlas
+from Scripts.mapformat import MapFile, is_binary_map, write_map
 from Scripts.timer import Timer
 
 AUTOTILE_MAP = {
@@ -23,114 +29,164 @@ NEIGHBOR_OFFSETS = [(-1, 0), (-1, -1), (0, -1), (1, -1), (1, 0), (0, 0), (-1, 1)
 PHYSICS_TILES = {'grass', 'stone', "bridge"}
 AUTOTILE_TYPES = {'grass', 'stone'}
 FALLTRHOGH_TILES = {"bridge"}
+LAYERS = ("-3", "-2", "-1", "0", "1", "2", "3")
+
+# ein bit pro nachbar mit dem gleichen tile typ: rechts, links, oben, unten
+AUTOTILE_BITS = {(1, 0): 1, (-1, 0): 2, (0, -1): 4, (0, 1): 8}
+
+
+def _make_autotile_lut() -> np.ndarray:
+    lut = np.full(16, -1, dtype=np.int16)  # -1 = variante nicht ändern
+    for neighbors, variant in AUTOTILE_MAP.items():
+        lut[sum(AUTOTILE_BITS[n] for n in neighbors)] = variant
+    return lut
+
+
+AUTOTILE_LUT = _make_autotile_lut()
 
 
 class TileMap:
     def __init__(self, game, tile_size=16):
         self.game = game
         self.tile_size = tile_size
-        self.tilemap = {"-3": {}, "-2": {}, "-1": {}, "0": {}, "1": {}, "2": {}, "3": {}}
-        self.offgrid_tiles = []
-        self.grass_blades = {}
+        self.types = TileTypeRegistry()
+        self._physics_ids = frozenset(self.types.id_of(t) for t in sorted(PHYSICS_TILES))
+        self._autotile_ids = frozenset(self.types.id_of(t) for t in sorted(AUTOTILE_TYPES))
+        self.grids: dict[str, TileGrid] = {layer: TileGrid() for layer in LAYERS}
+        self.tilemap = TilemapView(self)  # nur noch zur kompatibilität, siehe Scripts/tilegrid.py
+        falltrough_ids = frozenset(self.types.id_of(t) for t in sorted(FALLTRHOGH_TILES))
+        self.collision = CollisionIndex(self.grids["0"], tile_size, self._physics_ids - falltrough_ids, falltrough_ids)
+        # gebackene chunk surfaces pro layer, werden bei tile änderungen im chunk verworfen
+        self._baked: dict[str, dict[tuple[int, int], pygame.Surface]] = {layer: {} for layer in LAYERS}
+        self._bake_reach: tuple[int, int] | None = None  # (anzahl tile typen, reach in chunks)
+        # geänderte tiles pro layer, deren nachbarschaft beim nächsten update_autotile neu berechnet wird
+        self._autotile_dirty: dict[str, set[tuple[int, int]]] = {layer: set() for layer in LAYERS}
+        self.offgrid = OffgridIndex(size_of=self._offgrid_size)
+        self._map_file: MapFile | None = None  # offen solange chunks noch nicht dekodiert sind
+        self.grass = GrassField(tile_size, 180/MAX_GRASS_STEPS)
+        self.grass_atlas: GrassAtlas | None = None
+
+    def _tile_dict(self, x: int, y: int, cell: tuple[int, int]) -> dict:
+        return {"type": self.types.name_of(cell[0]), "variant": cell[1], "pos": [x, y]}
+
+    def set_tile(self, pos, tile_type: str, variant: int, layer="0") -> None:
+        x, y = int(pos[0]), int(pos[1])
+        grid = self.grids[layer]
+        type_id = self.types.id_of(tile_type)
+        if layer == "0":
+            old_type_id = grid.type_at(x, y)
+            if old_type_id != type_id and (old_type_id in self._physics_ids or type_id in self._physics_ids):
+                self.collision.mark_dirty(x, y)
+        grid.set(x, y, type_id, variant)
+        self._baked[layer].pop((x >> GRID_CHUNK_SHIFT, y >> GRID_CHUNK_SHIFT), None)
+        self._autotile_dirty[layer].add((x, y))
+
+    def remove_tile(self, pos, layer="0") -> bool:
+        x, y = int(pos[0]), int(pos[1])
+        grid = self.grids[layer]
+        if layer == "0" and grid.type_at(x, y) in self._physics_ids:
+            self.collision.mark_dirty(x, y)
+        if not grid.remove(x, y):
+            return False
+        self._baked[layer].pop((x >> GRID_CHUNK_SHIFT, y >> GRID_CHUNK_SHIFT), None)
+        self._autotile_dirty[layer].add((x, y))
+        return True
+
+    @property
+    def offgrid_tiles(self) -> list[dict]:
+        """Snapshot of all off-grid tiles, use `add_offgrid`/`remove_offgrid` to change them."""
+        return list(self.offgrid)
+
+    def _offgrid_size(self, tile: dict) -> tuple[int, int] | None:
+        # assets gibt es beim laden evtl. noch nicht, typen ohne bilder (z.b. spawners im spiel) werden nicht gerendert
+        imgs = getattr(self.game, "assets", {}).get(tile['type'])
+        if not isinstance(imgs, list) or not 0 <= tile['variant'] < len(imgs):
+            return None
+        return imgs[tile['variant']].get_size()
+
+    def add_offgrid(self, tile_type: str, variant: int, pos) -> int:
+        """Adds an off-grid tile at pixel position `pos` and returns its handle. Its size is looked up when it is first queried."""
+        return self.offgrid.add({'type': tile_type, 'variant': variant, 'pos': pos})
+
+    def remove_offgrid(self, handle: int) -> dict:
+        return self.offgrid.remove(handle)
+
+    def offgrid_at(self, pos) -> list[int]:
+        """Handles of the off-grid tiles under the pixel position `pos`."""
+        return self.offgrid.handles_at(pos)
 
     def extract(self, id_pairs, keep=False):
         layer = "0"
         matches = []
-        for tile in self.offgrid_tiles.copy():
+        for handle, tile in self.offgrid.items():
             if (tile['type'], tile['variant']) in id_pairs:
                 matches.append(tile.copy())
                 if not keep:
-                    self.offgrid_tiles.remove(tile)
+                    self.offgrid.remove(handle)
 
-        for loc in self.tilemap[layer]:
-            tile = self.tilemap[layer][loc]
-            if (tile['type'], tile['variant']) in id_pairs:
-                matches.append(tile.copy())
-                matches[-1]['pos'] = matches[-1]['pos'].copy()
+        # nur chunks mit den gesuchten typen dekodieren
+        type_ids = {self.types.get_id(name) for name, _ in id_pairs}
+        for x, y, type_id, variant in list(self.grids[layer].cells(type_ids)):
+            if (self.types.name_of(type_id), variant) in id_pairs:
+                matches.append(self._tile_dict(x, y, (type_id, variant)))
                 matches[-1]['pos'][0] *= self.tile_size
                 matches[-1]['pos'][1] *= self.tile_size
                 if not keep:
-                    del self.tilemap[layer][loc]
+                    self.remove_tile((x, y), layer)
 
         return matches
 
     def init_grass(self):
         grass = []
         layer = "0"
-        for loc in self.tilemap[layer]:
-            tile = self.tilemap[layer][loc]
-            if tile["type"] == "grass_blades_cover":
-                grass.append(tile)
+        cover_id = self.types.get_id("grass_blades_cover")
+        for x, y, _, _ in self.grids[layer].cells({cover_id}):
+            grass.append((x, y))
 
         # anstatt manuell zu definieren → offsets = {0: 4, 1: 11, 2: 5, 3: 4, 4: 8, 5: 7, 6: 6}
         offsets = {i: 19 - img.get_height() // 2 for i, img in enumerate(self.game.assets["grass_blades"])}
-        widths = {i: img.get_width() for i, img in enumerate(self.game.assets["grass_blades"])}
         print(offsets)
-        for grass_tile in grass:
-            pos = tuple(grass_tile["pos"])
-            del self.tilemap[layer][f"{pos[0]};{pos[1]}"]
+        xs, ys, variants, patches = [], [], [], []
+        for pos in grass:
+            self.remove_tile(pos, layer)
 
-            blades = []
             for n in range(int(self.tile_size/4)):
                 variant = random.randint(0, len(self.game.assets["grass_blades"])-1)
                 ox = n * int(self.tile_size/4)
-                p = (
-                    pos[0] * self.tile_size + ox,
-                    pos[1] * self.tile_size + offsets[variant]
-                )
-                blades.append((p, variant))
-
-            grass_patch = {"pos": grass_tile["pos"], "type": "grass_patch", "blades": []}
-            for bpos in blades:
-                grass_patch["blades"].append({"type": "grass_blades",
-                                              "variant": bpos[1],
-                                              "pos": list(bpos[0]),
-                                              "angle": 0.0,
-                                              "width": widths[bpos[1]]})
-
-            self.grass_blades[f"{pos[0]};{pos[1]}"] = grass_patch
-
-    def update_grass(self, entity_rects: list[pygame.FRect], force_radius, force_dropoff, particle_method=None):
-        # TODO
-        # einzelne blades müssen zusammen gepackt werden, damit lookup times nicht durch die Decke gehen.
-        # Am besten alle blades in einem Tile gruppieren.
-        # Dann vllt auch die mögliche state vom tile cachen??
-        layer = "0"
-        patches = []
+                xs.append(pos[0] * self.tile_size + ox)
+                ys.append(pos[1] * self.tile_size + offsets[variant])
+                variants.append(variant)
+                patches.append(pos)
+
+        self.grass.tile_size = self.tile_size
+        self.grass.set_blades(xs, ys, variants, patches)
+        if self.grass_atlas is None:
+            self.grass_atlas = GrassAtlas(self.game.assets["grass_blades"], 180/MAX_GRASS_STEPS)
+
+    def _grass_indices(self, view_rect) -> np.ndarray:
+        if view_rect is None:
+            return np.arange(len(self.grass))
+        # rand von zwei tiles, da die blades höher als ein tile sind
+        return self.grass.visible(view_rect, margin=self.tile_size * 2)
+
+    def update_grass(self, entity_rects: list[pygame.FRect], force_radius, force_dropoff, particle_method=None, view_rect=None):
+        """Pushes the grass away from the entities. With `view_rect` only blades near it are updated."""
+        indices = self._grass_indices(view_rect)
+        if not len(indices):
+            return
         processed: set[tuple] = set()
         for pos in [rect.center for rect in entity_rects]:
-            # pos = entity_rects[0].center
             tile_loc = (int(pos[0] // self.tile_size), int(pos[1] // self.tile_size))
             if tile_loc in processed:
                 continue
             processed.add(tile_loc)
-            for offset in NEIGHBOR_OFFSETS:
-                check_loc = str(tile_loc[0] + offset[0]) + ';' + str(tile_loc[1] + offset[1])
-                if check_loc in self.grass_blades:
-                    patches.append(self.grass_blades[check_loc])
-
-            hit_blades = []
-            for patch in patches:
-                for blade in patch["blades"]:
-                    org_rot = blade["angle"]
-                    dis = dist(blade["pos"], pos)
-                    if dis < force_radius:
-                        force = 2
-                    else:
-                        dis = max(0, dis - force_radius)
-                        force = 1 - min(dis / force_dropoff, 1)
-                    dir = -1 if pos[0] < blade["pos"][0] else 1
-                    # dont update unless force is stronger
-                    if abs(blade["angle"]) < force * 90:
-                        blade["angle"] = min(max(dir * force * 90 + org_rot * 0.5, -90), 90)
-                        blade["angle"] = clamp_number_to_range_steps(blade["angle"], -90, 90, 180/MAX_GRASS_STEPS)
-                        if dis < 5:
-                            hit_blades.append(blade)
-
-            if particle_method and hit_blades:
+
+            hit_blades = self.grass.push(pos, force_radius, force_dropoff, indices)
+
+            if particle_method and len(hit_blades):
                 if random.random() * 100 > 99:
-                    for blade in hit_blades:
-                        particle_method("leaf", pygame.Rect(*blade["pos"], 4, 4), (random.random()*100-50, -100))
+                    for i in hit_blades.tolist():
+                        particle_method("leaf", pygame.Rect(self.grass.x.item(i), self.grass.y.item(i), 4, 4), (random.random()*100-50, -100))
 
     def caculate_tile_span(self, size: int):
         if size <= self.tile_size:
@@ -138,8 +194,10 @@ class TileMap:
         return (size + self.tile_size - 1) // self.tile_size - 1
 
     def get_around(self, pos, size=(16, 16), ignore: set[str] = set()):
-        layer = "0"
+        grid = self.grids["0"]
+        ignore_ids = {self.types.get_id(t) for t in ignore}
         tiles = []
+        seen: set[tuple[int, int]] = set()
         topleft_tile = (
             int(pos[0] // self.tile_size),
             int(pos[1] // self.tile_size)
@@ -151,118 +209,230 @@ class TileMap:
         for x in range(topleft_tile[0], bottomright_tile[0]+1):
             for y in range(topleft_tile[1], bottomright_tile[1]+1):
                 for offset in NEIGHBOR_OFFSETS:
-                    check_loc = str(x + offset[0]) + ';' + str(y + offset[1])
-                    if check_loc in self.tilemap[layer]:
-                        t = self.tilemap[layer][check_loc]
-                        if t["type"] not in ignore and t not in tiles:
-                            tiles.append(t)
+                    check_loc = (x + offset[0], y + offset[1])
+                    cell = grid.get(*check_loc)
+                    if cell is not None and cell[0] not in ignore_ids and check_loc not in seen:
+                        seen.add(check_loc)
+                        tiles.append(self._tile_dict(check_loc[0], check_loc[1], cell))
         return tiles
 
-    def get_tile(self, pos, convert_to_tilespace=False):
-        layer = "0"
+    def get_tile(self, pos, convert_to_tilespace=False, layer="0"):
         if convert_to_tilespace:
             tile_loc = (int(pos[0] // self.tile_size), int(pos[1] // self.tile_size))
         else:
-            tile_loc = pos
-        check_loc = str(tile_loc[0]) + ';' + str(tile_loc[1])
-        if check_loc in self.tilemap[layer]:
-            return self.tilemap[layer][check_loc]
+            tile_loc = (int(pos[0]), int(pos[1]))
+        cell = self.grids[layer].get(*tile_loc)
+        if cell is not None:
+            return self._tile_dict(tile_loc[0], tile_loc[1], cell)
 
     def save(self, path):
+        tilemap = {layer: dict(view.items()) for layer, view in self.tilemap.items()}
         f = open(path, 'w')
-        json.dump({'tilemap': self.tilemap, 'tile_size': self.tile_size, 'offgrid': self.offgrid_tiles}, f)
+        json.dump({'tilemap': tilemap, 'tile_size': self.tile_size, 'offgrid': self.offgrid_tiles}, f)
         f.close()
 
+    def save_binary(self, path):
+        """Saves in the binary map format, see Scripts/mapformat.py."""
+        layers = {layer: [(x, y, self.types.name_of(type_id), variant) for x, y, type_id, variant in grid.cells()]
+                  for layer, grid in self.grids.items()}
+        write_map(path, self.tile_size, layers, self.offgrid_tiles)
+
+    def _clear(self):
+        if self._map_file is not None:
+            self._map_file.close()
+            self._map_file = None
+        for grid in self.grids.values():
+            grid.clear()
+        for baked in self._baked.values():
+            baked.clear()
+        for dirty in self._autotile_dirty.values():
+            dirty.clear()
+        self.offgrid.clear()
+
     def load(self, path):
+        if is_binary_map(path):
+            self.load_binary(path)
+            return
+
         f = open(path, 'r')
         map_data = json.load(f)
         f.close()
 
-        self.tilemap = map_data['tilemap']
+        self._clear()
+        for layer, tiles in map_data['tilemap'].items():
+            grid = self.grids[layer]
+            for tile in tiles.values():
+                grid.set(int(tile['pos'][0]), int(tile['pos'][1]), self.types.id_of(tile['type']), tile['variant'])
         self.tile_size = map_data['tile_size']
-        self.offgrid_tiles = map_data['offgrid']
+        for tile in map_data['offgrid']:
+            self.add_offgrid(tile['type'], tile['variant'], tile['pos'])
+
+        self.collision.tile_size = self.tile_size
+        self.collision.build()
+
+    def load_binary(self, path):
+        """Opens a binary map. Only the chunk directory is read, chunks are decoded on first access."""
+        map_file = MapFile(path)
+        self._clear()
+        self._map_file = map_file
+        type_ids = np.array([0] + [self.types.id_of(name) for name in map_file.type_names], dtype=np.uint8)
+        for layer, chunks in map_file.chunks.items():
+            grid = self.grids[layer]
+            chunk_types = map_file.chunk_types.get(layer)
+            for key, (offset, count) in chunks.items():
+                types = frozenset(int(type_ids[t]) for t in chunk_types[key]) if chunk_types is not None else None
+                grid.set_pending(key, functools.partial(map_file.decode_chunk, offset, count, type_ids), count, types)
+        self.tile_size = map_file.tile_size
+        for tile in map_file.offgrid():
+            self.add_offgrid(tile['type'], tile['variant'], tile['pos'])
+
+        self.collision.tile_size = self.tile_size
+        self.collision.build()
 
     def solid_check(self, pos):
-        layer = "0"
-        tile_loc = str(int(pos[0] // self.tile_size)) + ';' + str(int(pos[1] // self.tile_size))
-        if tile_loc in self.tilemap[layer]:
-            if self.tilemap[layer][tile_loc]['type'] in PHYSICS_TILES:
-                return self.tilemap[layer][tile_loc]
-
-    def physics_rects_around(self, pos, size=(16, 16)):
-        rects = []
-        # r = []
-        for tile in self.get_around(pos, size=size):
-            if tile["type"] in PHYSICS_TILES:
-                rects.append(pygame.FRect(tile['pos'][0] * self.tile_size, tile['pos'][1] * self.tile_size, self.tile_size, self.tile_size))
-                # r.append(tile)
-        # print(r)
-        return rects
+        tile_loc = (int(pos[0] // self.tile_size), int(pos[1] // self.tile_size))
+        cell = self.grids["0"].get(*tile_loc)
+        if cell is not None and cell[0] in self._physics_ids:
+            return self._tile_dict(tile_loc[0], tile_loc[1], cell)
+
+    def physics_rects_around(self, pos, size=(16, 16)) -> tuple[pygame.FRect, ...]:
+        """Merged collision rects near the AABB `pos`/`size`. Cached, don't modify them."""
+        return self.collision.query(pos, size)
+
+    def physics_entries_around(self, pos, size=(16, 16)) -> tuple[tuple[pygame.FRect, bool], ...]:
+        """Like `physics_rects_around` but as `(rect, falltrough)` pairs."""
+        return self.collision.query_entries(pos, size)
+
+    def query_many(self, positions, sizes=None, margin: float = 0.0) -> BroadphaseResult:
+        """Batched `physics_rects_around` for many AABBs at once, see `CollisionIndex.query_many`."""
+        return self.collision.query_many(positions, sizes, margin)
 
     def make_rect_from_tile(self, tile) -> pygame.FRect:
         return pygame.FRect(tile['pos'][0] * self.tile_size, tile['pos'][1] * self.tile_size, self.tile_size, self.tile_size)
 
     def autotile(self, layer="0"):
-        for loc in self.tilemap[layer]:
-            tile = self.tilemap[layer][loc]
-            neighbors = set()
-            for shift in [(1, 0), (-1, 0), (0, -1), (0, 1)]:
-                check_loc = str(tile['pos'][0] + shift[0]) + ';' + str(tile['pos'][1] + shift[1])
-                if check_loc in self.tilemap[layer]:
-                    if self.tilemap[layer][check_loc]['type'] == tile['type']:
-                        neighbors.add(shift)
-            neighbors = tuple(sorted(neighbors))
-            if (tile['type'] in AUTOTILE_TYPES) and (neighbors in AUTOTILE_MAP):
-                tile['variant'] = AUTOTILE_MAP[neighbors]
-
-    def rotate_grass(self, rot_function):
-        for _, patch in self.grass_blades.items():
-            for tile in patch["blades"]:
-                tile["angle"] = rot_function(tile["pos"][0])
-                tile["angle"] = clamp_number_to_range_steps(tile["angle"], -90, 90, 180/MAX_GRASS_STEPS)
-                # print(tile["angle"], make_rot.cache_info())
+        """Autotiles the whole layer, vectorized per chunk."""
+        grid = self.grids[layer]
+        autotile_ids = np.array(sorted(self._autotile_ids), dtype=np.uint8)
+        grid.load_all()
+        for (cx, cy), chunk in grid.chunks.items():
+            types = chunk.types
+            # chunk mit dem rand der nachbar chunks
+            padded = np.zeros((GRID_CHUNK_SIZE + 2, GRID_CHUNK_SIZE + 2), dtype=np.uint8)
+            padded[1:-1, 1:-1] = types
+            if (n := grid.chunks.get((cx + 1, cy))) is not None:
+                padded[1:-1, -1] = n.types[:, 0]
+            if (n := grid.chunks.get((cx - 1, cy))) is not None:
+                padded[1:-1, 0] = n.types[:, -1]
+            if (n := grid.chunks.get((cx, cy - 1))) is not None:
+                padded[0, 1:-1] = n.types[-1, :]
+            if (n := grid.chunks.get((cx, cy + 1))) is not None:
+                padded[-1, 1:-1] = n.types[0, :]
+
+            mask = ((padded[1:-1, 2:] == types) * AUTOTILE_BITS[(1, 0)] |
+                    (padded[1:-1, :-2] == types) * AUTOTILE_BITS[(-1, 0)] |
+                    (padded[:-2, 1:-1] == types) * AUTOTILE_BITS[(0, -1)] |
+                    (padded[2:, 1:-1] == types) * AUTOTILE_BITS[(0, 1)])
+            variants = AUTOTILE_LUT[mask]
+            changed = np.isin(types, autotile_ids) & (variants >= 0) & (variants != chunk.variants)
+            if changed.any():
+                chunk.variants[changed] = variants[changed]
+                self._baked[layer].pop((cx, cy), None)
+        self._autotile_dirty[layer].clear()
+
+    def update_autotile(self, layer="0"):
+        """Autotiles only the tiles changed since the last call and their direct neighbours."""
+        dirty = self._autotile_dirty[layer]
+        if not dirty:
+            return
+        grid = self.grids[layer]
+        cells = {(x + dx, y + dy) for x, y in dirty for dx, dy in ((0, 0), (1, 0), (-1, 0), (0, -1), (0, 1))}
+        dirty.clear()
+        for x, y in cells:
+            cell = grid.get(x, y)
+            if cell is None or cell[0] not in self._autotile_ids:
+                continue
+            type_id = cell[0]
+            mask = 0
+            for (dx, dy), bit in AUTOTILE_BITS.items():
+                if grid.type_at(x + dx, y + dy) == type_id:
+                    mask |= bit
+            variant = AUTOTILE_LUT.item(mask)
+            if variant >= 0 and variant != cell[1]:
+                grid.chunk_at(x, y).variants[y & GRID_CHUNK_MASK, x & GRID_CHUNK_MASK] = variant
+                self._baked[layer].pop((x >> GRID_CHUNK_SHIFT, y >> GRID_CHUNK_SHIFT), None)
+
+    def rotate_grass(self, rot_function, view_rect=None):
+        """`rot_function` gets a NumPy array of blade x positions and returns their wind angles."""
+        indices = self._grass_indices(view_rect)
+        if len(indices):
+            self.grass.apply_wind(rot_function, indices)
+
+    def _bake_chunk(self, chunk: GridChunk) -> pygame.Surface:
+        names = self.types.names
+        ts = self.tile_size
+        blits = []
+        w = h = 0
+        ys, xs = np.nonzero(chunk.types)
+        for ly, lx in zip(ys.tolist(), xs.tolist()):
+            img = self.game.assets[names[chunk.types.item(ly, lx)]][chunk.variants.item(ly, lx)]
+            blits.append((img, (lx * ts, ly * ts)))
+            w = max(w, lx * ts + img.get_width())
+            h = max(h, ly * ts + img.get_height())
+        # schwarz ist wie bei den assets der colorkey
+        chunk_surf = pygame.Surface((w, h))
+        chunk_surf.set_colorkey((0, 0, 0))
+        chunk_surf.fblits(blits)
+        return chunk_surf
+
+    def _chunk_reach(self) -> int:
+        """How many chunks the images of the registered tile types reach out of their chunk."""
+        if self._bake_reach is None or self._bake_reach[0] != len(self.types):
+            # große bilder (z.b. large_decor) ragen nach rechts/unten aus ihrem chunk heraus
+            assets = self.game.assets
+            max_size = max((max(img.get_size()) for name in self.types.names[1:] if isinstance(assets.get(name), list)
+                            for img in assets[name]), default=0)
+            self._bake_reach = (len(self.types), -(-max(max_size - self.tile_size, 0) // (self.tile_size * GRID_CHUNK_SIZE)))
+        return self._bake_reach[1]
 
     def render(self, surf: pygame.Surface, offset=(0, 0), render_only=None):
-        for tile in self.offgrid_tiles:
-            surf.blit(self.game.assets[tile['type']][tile['variant']], (tile['pos'][0] - offset[0], tile['pos'][1] - offset[1]))
-
-        # layer = "0"
-        for layer_ in range(-3, 3+1):
-            layer = str(layer_)
+        assets = self.game.assets
+        surf.fblits([(assets[tile['type']][tile['variant']], (tile['pos'][0] - offset[0], tile['pos'][1] - offset[1]))
+                     for tile in self.offgrid.in_rect((offset[0], offset[1], surf.get_width(), surf.get_height()))])
+
+        reach = self._chunk_reach()
+        chunk_px = self.tile_size * GRID_CHUNK_SIZE
+        # blit positionen werden abgerundet: pygame schneidet floats ab, ein tile bei (x - offset) landet
+        # auf dem bildschirm also bei floor(x - offset) = x - ceil(offset), wie entities und off-grid tiles
+        ox, oy = math.ceil(offset[0]), math.ceil(offset[1])
+        cx0 = int(offset[0] // chunk_px) - reach
+        cy0 = int(offset[1] // chunk_px) - reach
+        cx1 = int((offset[0] + surf.get_width()) // chunk_px)
+        cy1 = int((offset[1] + surf.get_height()) // chunk_px)
+        screen_rect = pygame.Rect(0, 0, surf.get_width(), surf.get_height())
+        blits = []
+        for layer, grid in self.grids.items():
             if render_only:
                 if layer != render_only:
                     continue
-            # shading = 255 - abs(layer_) * 50
-            # tsurf = pygame.Surface(surf.get_size())
-            for x in range(int(offset[0] // self.tile_size), int((offset[0] + surf.get_width()) // self.tile_size + 1)):
-                for y in range(int(offset[1] // self.tile_size), int((offset[1] + surf.get_height()) // self.tile_size + 1)):
-                    loc = str(x) + ';' + str(y)
-                    if loc in self.tilemap[layer]:
-                        tile = self.tilemap[layer][loc]
-                        surf.blit(self.game.assets[tile['type']][tile['variant']], (tile['pos'][0] * self.tile_size - offset[0], tile['pos'][1] * self.tile_size - offset[1]))
-            # tsurf.set_alpha(shading)
-            # surf.blit(tsurf, (0, 0))
-        for _, grass_patch in self.grass_blades.items():
-            for tile in grass_patch["blades"]:
-                img, rect = make_rot(self.game, tile["variant"], tile["angle"], tuple(tile["pos"]))
-                surf.blit(img, (rect.x - offset[0], rect.y - offset[1]))
+            if not grid:  # leere layer kosten nichts
+                continue
+            baked = self._baked[layer]
+            for cy in range(cy0, cy1 + 1):
+                for cx in range(cx0, cx1 + 1):
+                    chunk_surf = baked.get((cx, cy))
+                    if chunk_surf is None:
+                        chunk = grid.chunk((cx, cy))
+                        if chunk is None:
+                            continue
+                        chunk_surf = baked[(cx, cy)] = self._bake_chunk(chunk)
+                    pos = (cx * chunk_px - ox, cy * chunk_px - oy)
+                    if screen_rect.colliderect(pos, chunk_surf.get_size()):
+                        blits.append((chunk_surf, pos))
+        surf.fblits(blits)
+        if self.grass_atlas is not None:
+            visible = self.grass.visible((offset[0], offset[1], surf.get_width(), surf.get_height()), margin=self.tile_size * 2)
+            surf.fblits(self.grass_atlas.blits(self.grass, visible, offset))
 
 
 MAX_GRASS_STEPS = 25
-
-
-def make_rot(game, variant, angle, b_pos) -> tuple[pygame.Surface, pygame.FRect]:
-    org_image: pygame.Surface = game.assets["grass_blades"][variant]
-    org_rect = org_image.get_frect()
-    org_rect.topleft = b_pos
-    rot_image = make_rot_image(game, variant, angle)
-    rot_rect = rot_image.get_frect(center=org_rect.center)
-
-    return (rot_image, rot_rect)
-
-
-@ functools.lru_cache(maxsize=256)
-def make_rot_image(game, variant, angle) -> pygame.Surface:
-    org_image: pygame.Surface = game.assets["grass_blades"][variant]
-    rot_image = pygame.transform.rotate(org_image, angle)
-    return rot_image
@@ -1,30 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from copy import deepcopy
 from itertools import chain
+import gzip
+import hashlib
 import os
+import pickle
+import time
 from Scripts.CONFIG import *
-from typing import Literal, Any, List, Dict, Tuple, List
+from typing import Literal, Any, List, Dict, Tuple, List, Iterator
 import math
+import numpy as np
 from Scripts.utils_math import clamp_number_to_range_steps
 
 
-class Queue:
-    def __init__(self) -> None:
-        self._content: List[object] = []
-
-    def empty(self) -> bool:  # True if empty
-        return bool(len(self._content))
+class PreRenderScheduler:
+    """
+    Dirty set of chunks that need a new pre-render.
 
-    def put(self, obj: object) -> None:
-        if obj not in self._content:
-            self._content.append(obj)
+    `run` pre-renders chunks until `time_budget` seconds are used up, chunks without any surface
+    first, then by distance to the camera. Stale chunks keep drawing their last surface meanwhile.
+    """
 
-    def get(self) -> object:
-        if self.empty():
-            return self._content.pop(0)
-        return None
+    def __init__(self, time_budget: float = 0.002) -> None:
+        self.time_budget = time_budget
+        self._dirty: Dict["Chunk", None] = {}  # dict als geordnetes set
 
     def __len__(self) -> int:
-        return len(self._content)
+        return len(self._dirty)
+
+    def __bool__(self) -> bool:
+        return bool(self._dirty)
+
+    def __contains__(self, chunk: "Chunk") -> bool:
+        return chunk in self._dirty
+
+    def put(self, chunk: "Chunk") -> None:
+        self._dirty[chunk] = None
+
+    def discard(self, chunk: "Chunk") -> None:
+        self._dirty.pop(chunk, None)
+
+    def run(self, camera_pos: Vector2 | None = None, time_budget: float | None = None) -> int:
+        """`camera_pos` in pixel. At least one chunk is pre-rendered per call. Returns the number of pre-rendered chunks."""
+        if not self._dirty:
+            return 0
+        if time_budget is None:
+            time_budget = self.time_budget
+
+        chunks = list(self._dirty)
+        if camera_pos is not None:
+            cx, cy = camera_pos[0] / CHUNKWIDTH, camera_pos[1] / CHUNKWIDTH
+            chunks.sort(key=lambda c: (c._pre_renderd_surf is not None, (c.pos.x + 0.5 - cx) ** 2 + (c.pos.y + 0.5 - cy) ** 2))
+        else:
+            chunks.sort(key=lambda c: c._pre_renderd_surf is not None)
+
+        end = time.perf_counter() + time_budget
+        done = 0
+        for chunk in chunks:
+            del self._dirty[chunk]
+            chunk.pre_render()
+            done += 1
+            if time.perf_counter() >= end:
+                break
+        return done
+
+
+class _Batch:
+    """State of an open `TileMap.batch()`."""
+    __slots__ = ("depth", "chunks", "ghosts", "removed")
+
+    def __init__(self) -> None:
+        self.depth = 0
+        self.chunks: Dict["Chunk", None] = {}  # geänderte chunks, werden am ende einmal gequeued
+        self.ghosts: List[Tuple["Chunk", "Tile"]] = []  # hohe tiles am rand, ghost tiles kommen am ende
+        self.removed: Dict[Tuple, None] = {}  # chunk positionen, die am ende leer sein könnten
 
 
 NEIGHBOR_OFFSETS = [
@@ -127,31 +177,44 @@ class CustomRamp(Tile):
         self.img_idx = img_idx
         self.size = Vector2(hitbox.get_size())
 
-    @staticmethod
-    def parse_data(hitbox: Surface) -> Dict[int, int]:
-        ret: Dict[int, int] = {}
-        # ret ist ein dict wo, die x position als key
-        # und die höhe der ramp an der x position als value gespeichert wird
-        # Bsp: {1: 2, 2: 3, 3: 5, ...}
-        # Dann ist beim ersten pixel die Rampe 2 hoch,
-        # beim zweiten 3, beim dritten 5.
+    # inhalt -> heightmap, gleiche hitboxen teilen sich ein array
+    _heightmaps: Dict[bytes, np.ndarray] = {}
+    _WHITE = np.frombuffer(bytes((255, 255, 255, 255)), dtype=np.uint32)[0]
+    _BLACK = np.frombuffer(bytes((0, 0, 0, 255)), dtype=np.uint32)[0]
 
+    @staticmethod
+    def parse_data(hitbox: Surface) -> np.ndarray:
+        """
+        Height of the ramp for every pixel column, shape (w,), uint16, read only. Shared between ramps with the same hitbox.
+        Counts the white pixels from the bottom of the column up to the first black one, other colors are skipped.
+        Bsp: [2, 3, 5, ...] -> beim ersten pixel ist die Rampe 2 hoch, beim zweiten 3, beim dritten 5.
+        """
         w, h = hitbox.get_size()
-        white = Color(255, 255, 255, 255)
-        black = Color(0, 0, 0, 255)
-        for x in range(w):
-            v = 0
-            for y in range(h):
-                y = h - y - 1
-                col = hitbox.get_at((x, y))
-                # print((x, y), col)
-                if col == white:
-                    v += 1
-                elif col == black:
-                    break
-            ret[x] = v
-        # print(ret)
-        return ret
+        pixels = pygame.image.tobytes(hitbox, "RGBA")
+        key = hashlib.blake2b(pixels, digest_size=16, salt=w.to_bytes(8, "little")).digest()
+        heightmap = CustomRamp._heightmaps.get(key)
+        if heightmap is not None:
+            return heightmap
+
+        # ein uint32 pro pixel, (w, h) von unten nach oben
+        columns = np.frombuffer(pixels, dtype=np.uint32).reshape(h, w)[::-1].T
+        white = columns == CustomRamp._WHITE
+        # alles ab dem ersten schwarzen pixel zählt nicht
+        above_black = np.logical_or.accumulate(columns == CustomRamp._BLACK, axis=1)
+        heights = CustomRamp.shared_heightmap(np.count_nonzero(white & ~above_black, axis=1))
+        CustomRamp._heightmaps[key] = heights
+        return heights
+
+    @staticmethod
+    def shared_heightmap(heights: Iterable[int]) -> np.ndarray:
+        """Same as `parse_data` for already parsed heights (e.g. from a chunk file)."""
+        heights = np.array(heights, dtype=np.uint16)
+        key = hashlib.blake2b(heights.tobytes(), digest_size=16, person=b"columns").digest()
+        heightmap = CustomRamp._heightmaps.get(key)
+        if heightmap is None:
+            heights.flags.writeable = False
+            heightmap = CustomRamp._heightmaps[key] = heights
+        return heightmap
 
     def __repr__(self) -> str:
         return f"<{self.pos=}, {self.type=}, {self.img_idx=}, {self.size=}>"
@@ -161,6 +224,7 @@ class GrassBlade(Tile):  # representiert nur einen grashalm
     img_cache: Dict[str, Surface] = {}
     offset_cache: Dict[str, Vector2] = {}
     img_half_size_cache: Dict[str, Tuple] = {}
+    blit_offset_cache: Dict[str, Tuple[float, float]] = {}  # img_idx -> verschiebung beim blitten
     def rot_function(x) -> float: return 35 * math.sin(0.5 * x)
     max_rotations = 20
     rotation_angle = 35
@@ -193,6 +257,19 @@ class GrassBlade(Tile):  # representiert nur einen grashalm
             GrassBlade.offset_cache[self.img_idx] = offset
             GrassBlade.img_half_size_cache[self.img_idx] = tuple(Vector2(s.get_size()) // 2)
 
+    @staticmethod
+    def blit_offset(img_idx: str) -> Tuple[float, float]:
+        """How far the (rotated) image `img_idx` is moved up/left when it is drawn. Cached."""
+        offset = GrassBlade.blit_offset_cache.get(img_idx)
+        if offset is None:
+            x, y = GrassBlade.offset_cache[img_idx]
+            if y == 0:
+                y = GrassBlade.img_half_size_cache[img_idx][1] / 1.6
+            if x < 0:
+                x *= -2
+            offset = GrassBlade.blit_offset_cache[img_idx] = (x, y)
+        return offset
+
 
 class GrassPatch(Tile):  # representiert alle Grashalme in einem tile
     def __init__(self, pos: Vector2, tile_type: TileType = TileType.GRASS_PATCH) -> None:
@@ -201,9 +278,9 @@ class GrassPatch(Tile):  # representiert alle Grashalme in einem tile
 
 class Chunk:
     __slots__ = ("parent", "pos", "size", "_tiles", "_ghost_tiles", "_pre_renderd_surf",
-                 "_pre_renderd_surf_size", "pre_render_offset",
+                 "_pre_renderd_surf_size", "pre_render_offset", "_blit_pos",
                  "_last_pre_render_data", "_pre_render_data",
-                 "_tiles_offgrid")
+                 "_tiles_offgrid", "_ramp_cells", "_grass_layer", "_masks")
     default_pre_renderd_surf_size = Vector2(CHUNKSIZE * TILESIZE, CHUNKSIZE * TILESIZE)
 
     def __init__(self, parent: "TileMap", pos: Vector2, size) -> None:
@@ -217,10 +294,26 @@ class Chunk:
         self._pre_renderd_surf: Surface = None
         self._pre_renderd_surf_size: Vector2 = None
         self.pre_render_offset = Vector2(0)
+        self._blit_pos = (self.pos.x * size[0] * TILESIZE, self.pos.y * size[1] * TILESIZE)  # welt position der surface
         self._last_pre_render_data = ...  # sollte unterschiedlich zu "_pre_render_data" sein
         self._pre_render_data = None
+        self._ramp_cells: Dict[Tuple[int, int], Tuple[int, int, Tuple[float, ...]]] | None = None
+        self._grass_layer: List[Tuple[GrassBlade, float, float]] | None = None
+        self._masks: Tuple[int, int, int] | None = None
+
+    def __getstate__(self) -> Tuple[None, Dict[str, Any]]:
+        # abgekoppelter zustand für pickle und deepcopy: ohne parent (sonst kommt die ganze tilemap mit)
+        # und ohne surface (pickle kann pygame.Surface nicht bearbeiten). gleiches format wie die alten .data dateien
+        state = {name: getattr(self, name) for name in self.__slots__ if hasattr(self, name)}
+        state["parent"] = None
+        state["_pre_renderd_surf"] = None
+        state["_ramp_cells"] = None
+        state["_grass_layer"] = None
+        state["_masks"] = None
+        return (None, state)
 
     def copy(self) -> "Chunk":
+        """Deep copy without parent and pre-rendered surface."""
         return deepcopy(self)
 
     def get(self, pos: Tuple) -> Tile | None:
@@ -234,65 +327,112 @@ class Chunk:
     def get_all_offgrid(self) -> List[Tile]:
         return list(self._tiles_offgrid.values())
 
-    def get_around(self, pos: Vector2, size: Vector2 | None = None) -> List[Tile | Ramp]:
+    def masks(self) -> Tuple[int, int, int]:
+        """
+        (occupied, solid, ghost) bit masks of the cells, bit `y * width + x` is the local cell (x, y) (64 bit for 8x8).
+        Occupied includes the ghost cells, solid are only full tiles (`Tile`, `CustomTile`), no ramps and no grass.
+        Built once after every change.
+        """
+        if self._masks is None:
+            w, h = self.size
+            occupied = solid = ghost = 0
+            for (x, y), tile in self._tiles.items():
+                if 0 <= x < w and 0 <= y < h and x == int(x) and y == int(y):
+                    bit = 1 << int(y * w + x)
+                    occupied |= bit
+                    if tile.type == TileType.TILE or tile.type == TileType.TILE_CUSTOM:
+                        solid |= bit
+            for x, y in self._ghost_tiles:
+                if 0 <= x < w and 0 <= y < h and x == int(x) and y == int(y):
+                    ghost |= 1 << int(y * w + x)
+            self._masks = (occupied | ghost, solid, ghost)
+        return self._masks
+
+    def cell_mask(self, x0: int, y0: int, x1: int, y1: int) -> int:
+        """Mask of the local cells x0..x1, y0..y1 (inclusive), clipped to the chunk."""
+        w, h = self.size
+        x0, y0, x1, y1 = max(x0, 0), max(y0, 0), min(x1, w - 1), min(y1, h - 1)
+        if x0 > x1 or y0 > y1:
+            return 0
+        row = ((1 << (x1 - x0 + 1)) - 1) << x0
+        # 1 + 2^w + 2^2w + ... wiederholt die zeile (y1 - y0 + 1) mal
+        rows = ((1 << (w * (y1 - y0 + 1))) - 1) // ((1 << w) - 1)
+        return (row * rows) << (y0 * w)
+
+    def tiles_in_mask(self, mask: int) -> List[Tile | Ramp]:
+        """Tiles and ghost tiles of the cells in `mask`."""
         ret: List[Tile | Ramp] = []
+        tiles, ghost_tiles, w = self._tiles, self._ghost_tiles, self.size[0]
+        while mask:
+            low = mask & -mask
+            i = low.bit_length() - 1
+            p = (i % w, i // w)  # (3, 4) == (3.0, 4.0), gleicher hash
+            tile = tiles.get(p)
+            if tile is not None:
+                ret.append(tile)
+            tile = ghost_tiles.get(p)
+            if tile is not None:
+                ret.append(tile)
+            mask ^= low
+        return ret
 
-        x, y = pos.x // TILESIZE, pos.y // TILESIZE
-        x, y = x % CHUNKSIZE, y % CHUNKSIZE
-        chunk_global_pos = self.pos * CHUNKWIDTH
-        if pos.x < chunk_global_pos.x:
-            ...  # pos ist links vom chunk
-            x = 0
-        elif pos.x > chunk_global_pos.x + CHUNKWIDTH:
-            x = CHUNKSIZE - 1
-            ...  # pos ist rechts vom chunk
-        if pos.y < chunk_global_pos.y:
-            ...  # pos ist über chunk
-            y = 0
-        elif pos.y > chunk_global_pos.y + CHUNKWIDTH:
-            y = CHUNKSIZE - 1
-            ...  # pos ist unter chunk
-
-        en_size = Vector2(1, 1)
-        if size:
-            en_size += Vector2(size.x // TILESIZE, size.y // TILESIZE)
-
-        # print(en_size)
-        x_off = 0  # -int(en_size.x // 2)
-        y_off = 0  # -int(en_size.y // 2)
-        for x__ in range(int(en_size[0])):
-            for y__ in range(int(en_size[1])):
-                for x_, y_ in NEIGHBOR_OFFSETS:
-                    p = (x_off + x + x_ + x__, y_off + y + y_ + y__)
-                    if p in self._tiles:
-                        ret.append(self._tiles[p])
-                    if p in self._ghost_tiles:
-                        ret.append(self._ghost_tiles[p])
-
-        # x, y = pos.x // TILESIZE % CHUNKSIZE, pos.y // TILESIZE % CHUNKSIZE
-        # for x_, y_ in NEIGHBOR_OFFSETS:
-        #     p = (x+x_, y+y_)
-        #     if p in self._tiles:
-        #         ret.append(self._tiles[p])
+    def get_around(self, pos: Vector2, size: Vector2 | None = None) -> List[Tile | Ramp]:
+        """Tiles of this chunk in the cells of the AABB at `pos` (pixel) with `size` plus one cell around it."""
+        x0, y0, x1, y1 = aabb_cells(pos, size)
+        ox, oy = int(self.pos[0]) * self.size[0], int(self.pos[1]) * self.size[1]
+        return self.tiles_in_mask(self.masks()[0] & self.cell_mask(x0 - ox, y0 - oy, x1 - ox, y1 - oy))
 
-        return ret
+    def ramp_cells(self) -> Dict[Tuple[int, int], Tuple[int, int, Tuple[float, ...]]]:
+        """
+        Global tile position -> (left x, bottom y, surface heights) of the ramp covering that cell, in pixel.
+        Covers every cell of the ramps in this chunk, also cells above the chunk. Built once after every change.
+        """
+        if self._ramp_cells is None:
+            cells = {}
+            for tile in self._tiles.values():
+                if not isinstance(tile, (Ramp, CustomRamp)):
+                    continue
+                heights = ramp_surface(tile)
+                x, y = int(tile.pos[0]), int(tile.pos[1])
+                entry = (x * TILESIZE, (y + 1) * TILESIZE, heights)
+                for i in range(math.ceil(len(heights) / TILESIZE)):
+                    for j in range(max(1, math.ceil(max(heights) / TILESIZE))):
+                        cells[(x + i, y - j)] = entry
+            self._ramp_cells = cells
+        return self._ramp_cells
 
     def is_empty(self) -> bool:
         return len(self._tiles) + len(self._tiles_offgrid)
 
+    def _begin_edit(self) -> None:
+        self.parent._mark_dirty(self.pos)
+        self._ramp_cells = None
+        self._grass_layer = None
+        self._masks = None
+        batch = self.parent._batch
+        if batch is None:
+            self._last_pre_render_data = self._calc_pre_render_data()
+        elif self not in batch.chunks:  # in einem batch nur vor der ersten änderung
+            self._last_pre_render_data = self._calc_pre_render_data()
+            batch.chunks[self] = None
+
+    def _end_edit(self) -> None:
+        if self.parent._batch is None:
+            self._pre_render_data = self._calc_pre_render_data()
+
     def remove(self, pos: Vector2) -> None:
-        self._last_pre_render_data = self._calc_pre_render_data()
         ret = False
         pos = (pos[0] % CHUNKSIZE, pos[1] % CHUNKSIZE)
         if pos in self._tiles:
+            self._begin_edit()
             del self._tiles[pos]
             self.parent.add_to_pre_render_queue(self)
             ret = True
-            self._pre_render_data = self._calc_pre_render_data()
+            self._end_edit()
         return ret
 
     def add(self, tile: Tile) -> bool:
-        self._last_pre_render_data = self._calc_pre_render_data()
+        self._begin_edit()
         ret = False
         pos = tuple(tile.pos)
         pos = (pos[0] % CHUNKSIZE, pos[1] % CHUNKSIZE)
@@ -307,21 +447,30 @@ class Chunk:
                 return
             # print(tile.size[1] > TILESIZE, tile)
 
-            # Iterate over each possible neighbor and its conditions
-            for pos_, conditions in zip(neighbor_positions, neighbor_conditions):
-                if all(on_edge[c] for c in conditions):  # Check if all conditions are met
-                    rel_chunk_pos = tuple(self.pos + Vector2(pos_))
-                    self.parent._create_empty_chunk(rel_chunk_pos)
-                    rel_chunk = self.parent.get_chunk(rel_chunk_pos)
-                    for i in range(int(tile.size[1] / TILESIZE)):
-                        ghost_pos = tile.pos - Vector2(0, i)
-                        if ghost_pos[1] < self.pos.y * CHUNKSIZE:
-                            rel_chunk.add_ghost_tile(tile, ghost_pos)
-                            self.parent.add_to_pre_render_queue(rel_chunk)
-        self._pre_render_data = self._calc_pre_render_data()
+            batch = self.parent._batch
+            if batch is not None:
+                batch.ghosts.append((self, tile))
+            else:
+                self._add_ghosts(tile, on_edge)
+        self._end_edit()
         return ret
 
+    def _add_ghosts(self, tile: Tile, on_edge: List[bool]) -> None:
+        # Iterate over each possible neighbor and its conditions
+        for pos_, conditions in zip(neighbor_positions, neighbor_conditions):
+            if all(on_edge[c] for c in conditions):  # Check if all conditions are met
+                rel_chunk_pos = tuple(self.pos + Vector2(pos_))
+                self.parent._create_empty_chunk(rel_chunk_pos)
+                rel_chunk = self.parent.get_chunk(rel_chunk_pos)
+                for i in range(int(tile.size[1] / TILESIZE)):
+                    ghost_pos = tile.pos - Vector2(0, i)
+                    if ghost_pos[1] < self.pos.y * CHUNKSIZE:
+                        rel_chunk.add_ghost_tile(tile, ghost_pos)
+                        self.parent.add_to_pre_render_queue(rel_chunk)
+
     def add_offgrid(self, tile: Tile) -> bool:
+        self.parent._mark_dirty(self.pos)
+        self._grass_layer = None
         ret = True
         pos = tuple(tile.pos)
         if pos in self._tiles_offgrid:
@@ -335,16 +484,18 @@ class Chunk:
         if pos in self._tiles_offgrid:
             del self._tiles_offgrid[pos]
             ret = True
-            self._pre_render_data = self._calc_pre_render_data()
+            self._grass_layer = None
+            self.parent._mark_dirty(self.pos)
+            self._end_edit()
         return ret
 
     def extend(self, tiles: List[Tile]) -> None:
-        self._last_pre_render_data = self._calc_pre_render_data()
+        self._begin_edit()
         for tile in tiles:
             pos = tuple(tile.pos)
             pos = (pos[0] % CHUNKSIZE, pos[1] % CHUNKSIZE)
             self._tiles[pos] = tile
-        self._pre_render_data = self._calc_pre_render_data()
+        self._end_edit()
 
     def _calc_pre_render_data(self) -> List[Iterable]:
         return list(chain(self._tiles.items(), self._ghost_tiles.items()))
@@ -353,6 +504,8 @@ class Chunk:
         return not hash(self._last_pre_render_data) == hash(self._pre_render_data)
 
     def add_ghost_tile(self, tile: Tile, pos: Vector2, raw_pos: bool = False):
+        self.parent._mark_dirty(self.pos)
+        self._masks = None
         pos_ = None
         if raw_pos:
             self._ghost_tiles[tuple(pos)] = tile
@@ -396,7 +549,6 @@ class Chunk:
         custom_ramps: List[CustomRamp] = []
         tiles: List[Tile] = []
         custom_tiles: List[CustomTile] = []
-        grass_blades: List[GrassBlade] = []
 
         for _, tile in self._tiles.items():
             if tile.type in [TileType.RAMP_LEFT, TileType.RAMP_RIGHT]:
@@ -406,14 +558,10 @@ class Chunk:
             elif tile.type == TileType.TILE_CUSTOM:
                 custom_tiles.append(tile)
             elif tile.type == TileType.GRASS_BLADE:
-                grass_blades.append(tile)
+                pass  # dynamische ebene, siehe grass_layer()
             else:
                 tiles.append(tile)
 
-        for _, tile in self._tiles_offgrid.items():  # muss eigentlich oben eingebaut werden.
-            if tile.type == TileType.GRASS_BLADE:
-                grass_blades.append(tile)
-
         for c_ramp in sorted(custom_ramps, key=lambda r: r.size.y, reverse=True):
             on_edge = self._tile_is_on_edge(c_ramp)
             if sum(on_edge) and c_ramp.size.y > TILESIZE:
@@ -447,24 +595,6 @@ class Chunk:
             l.append((IMGS[c_ramp.img_idx], local_pos))
             # print(local_pos)
 
-        for blade in grass_blades:
-            local_pos = (blade.pos.x % CHUNKSIZE, blade.pos.y % CHUNKSIZE)
-            local_pos = (local_pos[0] * TILESIZE, local_pos[1] * TILESIZE + global_tile_offset.y)
-
-            local_pos = (local_pos[0] - blade.center_blit_offset.x, local_pos[1] - blade.center_blit_offset.x)
-
-            local_offset = GrassBlade.offset_cache[blade.img_idx]
-            if local_offset.y == 0:
-                local_offset.y = GrassBlade.img_half_size_cache[blade.img_idx][1] / 1.6
-            # print(local_offset, blade.img_idx)
-            if local_offset.x < 0:
-                local_offset.x *= -2
-            local_pos = (local_pos[0] - local_offset[0], local_pos[1] - local_offset[1])
-
-            # local_pos = (local_pos[0] + GrassBlade.img_half_size_cache[blade.img_idx][0], local_pos[1] + GrassBlade.img_half_size_cache[blade.img_idx][1])
-
-            l.append((GrassBlade.img_cache[blade.img_idx], local_pos))
-
         w, h = self.size[0] * TILESIZE, self.size[1] * TILESIZE
         surf = Surface((w + global_tile_offset.x, h + global_tile_offset.y))
         surf.set_colorkey("black")
@@ -475,12 +605,28 @@ class Chunk:
         self._pre_renderd_surf = surf
         self._pre_renderd_surf_size = Vector2(surf.get_size())
         self.pre_render_offset = global_tile_offset
+        self._blit_pos = (self.pos.x * self.size[0] * TILESIZE - global_tile_offset.x, self.pos.y * self.size[1] * TILESIZE - global_tile_offset.y)
+
+    def grass_layer(self) -> List[Tuple[GrassBlade, float, float]]:
+        """
+        (blade, x, y) for every grass blade of the chunk, x and y in world pixel before the rotation offset.
+        Grass is not part of the pre-rendered surface, it is drawn every frame by `TileMap.render`.
+        """
+        if self._grass_layer is None:
+            self._grass_layer = [(blade, blade.pos.x * TILESIZE - blade.center_blit_offset.x, blade.pos.y * TILESIZE - blade.center_blit_offset.x)
+                                 for blade in chain(self._tiles.values(), self._tiles_offgrid.values())
+                                 if blade.type == TileType.GRASS_BLADE]
+        return self._grass_layer
 
     def get_pre_render(self, offset: Vector2 = Vector2(0)) -> tuple[Surface, tuple]:
-        global_pos = tuple(self.pos)
-        global_pos = (global_pos[0] * self.size[0] * TILESIZE - offset[0], global_pos[1] * self.size[1] * TILESIZE - offset[1])
-        # print(self._pre_renderd_surf)
-        return (self._pre_renderd_surf, global_pos - self.pre_render_offset)
+        return (self._pre_renderd_surf, (self._blit_pos[0] - offset[0], self._blit_pos[1] - offset[1]))
+
+
+def aabb_cells(pos: Vector2, size: Vector2 | None = None, margin: int = 1) -> Tuple[int, int, int, int]:
+    """Global cells x0, y0, x1, y1 (inclusive) touched by the AABB at `pos` with `size` (pixel), plus `margin` cells."""
+    w, h = (size[0], size[1]) if size else (0, 0)
+    return (int(pos[0] // TILESIZE) - margin, int(pos[1] // TILESIZE) - margin,
+            int((pos[0] + w) // TILESIZE) + margin, int((pos[1] + h) // TILESIZE) + margin)
 
 
 def on_edge_of_chunk(pos: Vector2) -> List[bool]:
@@ -514,7 +660,8 @@ def on_edge_of_chunk(pos: Vector2) -> List[bool]:
 
 class TileMap:
     __slots__ = ("_chunks", "chunk_size", "amount_of_tiles", "amount_of_tiles_offgrid",
-                 "amount_of_chunks", "culling_offset", "_pre_render_queue")
+                 "amount_of_chunks", "culling_offset", "_pre_render_scheduler", "_batch",
+                 "_dirty_chunks", "_removed_chunks", "_visible_window", "_visible")
 
     def __init__(self, chunk_size=(CHUNKSIZE, CHUNKSIZE)) -> None:
         # self._tiles: Dict[Tuple, Tile] = {}
@@ -525,28 +672,69 @@ class TileMap:
         self.amount_of_tiles = 0
         self.amount_of_tiles_offgrid = 0
         self.amount_of_chunks = 0
-        self._pre_render_queue: Queue[Chunk] = Queue()
+        self._pre_render_scheduler = PreRenderScheduler()
+        self._batch: _Batch | None = None
+        self._dirty_chunks: Dict[Tuple, None] = {}  # chunk positionen, die seit dem laden/speichern geändert wurden
+        self._removed_chunks: Dict[Tuple, None] = {}  # positionen leer gewordener chunks, deren datei beim speichern gelöscht wird
+        self._visible_window: Tuple[int, int, int, int] | None = None
+        self._visible: List[Chunk] | None = None  # chunks im culling fenster, None nach änderungen an _chunks
 
         self.culling_offset = Vector2(
             RES.x // TILESIZE / 5,
             RES.y // TILESIZE / 5
         )
 
-    def pre_render_chunks(self) -> None:
-        # TODO einen weg finden nur zu prerendern, falls sich was verändert hat. vllt hash von _tiles in _chunks nehmen und das vergleichen?
-        # Chunk.pre_render_needed() ist eine Idee, funktioniert in der Praxis aber nicht gut.
-        # vllt kann man eine Liste oder Queue haben, wo man die Chunks, die neu sind und noch nicht geprerenderd wurden
-        # reinpackt und erst entfernt, wenn diese Funktion durch diese Liste durchgegangen ist.
+    def pre_render_chunks(self, camera_pos: Vector2 | None = None, time_budget: float | None = None) -> int:
+        """
+        Pre-renders queued chunks within the time budget of the scheduler (or `time_budget` seconds),
+        nearest to `camera_pos` first. Call once per frame. Pass `math.inf` to pre-render all.
+        """
+        return self._pre_render_scheduler.run(camera_pos, time_budget)
 
-        # New approach
-        # print(len(self._pre_render_queue))
-        while self._pre_render_queue.empty():
-            c = self._pre_render_queue.get()
-            # print(22222, c)
-            c.pre_render()
+    @contextmanager
+    def batch(self) -> Iterator["TileMap"]:
+        """
+        Groups many `add`/`remove`/`add_offgrid`/`remove_offgrid` calls.
+        Ghost tiles of tall tiles are added, empty chunks are removed and every changed chunk is
+        queued for pre-rendering once, when the outermost batch ends.
 
-        # Old approach
-        # [c.pre_render() for c in self._chunks.values()]  # if c.pre_render_needed()]
+            with tilemap.batch():
+                for tile in tiles:
+                    tilemap.add(tile)
+        """
+        if self._batch is None:
+            self._batch = _Batch()
+        batch = self._batch
+        batch.depth += 1
+        try:
+            yield self
+        finally:
+            batch.depth -= 1
+            if not batch.depth:
+                self._batch = None
+                self._flush_batch(batch)
+
+    def _flush_batch(self, batch: _Batch) -> None:
+        for chunk, tile in batch.ghosts:
+            local_pos = (tile.pos[0] % CHUNKSIZE, tile.pos[1] % CHUNKSIZE)
+            if chunk._tiles.get(local_pos) is tile:  # nicht wieder entfernt oder ersetzt
+                chunk._add_ghosts(tile, chunk._tile_is_on_edge(tile))
+        for related_chunk_pos in batch.removed:
+            self._remove_if_empty(related_chunk_pos)
+        for chunk in batch.chunks:
+            if chunk.parent is self and self._chunks.get(tuple(chunk.pos)) is chunk:
+                chunk._pre_render_data = chunk._calc_pre_render_data()
+                self._pre_render_scheduler.put(chunk)
+
+    def _remove_if_empty(self, related_chunk_pos: Tuple) -> None:
+        chunk = self._chunks.get(related_chunk_pos)
+        if chunk is not None and not chunk.is_empty():
+            self._dirty_chunks.pop(related_chunk_pos, None)
+            self._removed_chunks[related_chunk_pos] = None  # datei wird beim speichern gelöscht
+            self._pre_render_scheduler.discard(chunk)
+            del self._chunks[related_chunk_pos]
+            self.amount_of_chunks -= 1
+            self._visible = None
 
     def remove(self, pos: Vector2) -> None:
         related_chunk_pos = (pos.x // self.chunk_size[0], pos.y // self.chunk_size[1])
@@ -554,10 +742,11 @@ class TileMap:
             chunk = self._chunks[related_chunk_pos]
             if chunk.remove(pos):
                 self.amount_of_tiles -= 1
-                self.add_to_pre_render_queue(chunk)  # TODO checken ob das keinen fehler aufwirft, weil der chunk später auch entfernt werden kann!
-            if not self._chunks[related_chunk_pos].is_empty():
-                del self._chunks[related_chunk_pos]
-                self.amount_of_chunks -= 1
+                self.add_to_pre_render_queue(chunk)
+            if self._batch is not None:
+                self._batch.removed[related_chunk_pos] = None
+            else:
+                self._remove_if_empty(related_chunk_pos)
 
     def remove_offgrid(self, pos: Vector2) -> None:
         related_chunk_pos = (pos.x // self.chunk_size[0], pos.y // self.chunk_size[1])
@@ -565,13 +754,19 @@ class TileMap:
             chunk = self._chunks[related_chunk_pos]
             if chunk.remove_offgrid(pos):
                 self.amount_of_tiles_offgrid -= 1
-                self.add_to_pre_render_queue(chunk)  # TODO checken ob das keinen fehler aufwirft, weil der chunk später auch entfernt werden kann!
-            if not self._chunks[related_chunk_pos].is_empty():
-                del self._chunks[related_chunk_pos]
-                self.amount_of_chunks -= 1
+            if self._batch is not None:
+                self._batch.removed[related_chunk_pos] = None
+            else:
+                self._remove_if_empty(related_chunk_pos)
+
+    def _mark_dirty(self, chunk_pos) -> None:
+        self._dirty_chunks[(chunk_pos[0], chunk_pos[1])] = None
 
     def add_to_pre_render_queue(self, chunk: Chunk) -> None:
-        self._pre_render_queue.put(chunk)
+        if self._batch is not None:
+            self._batch.chunks[chunk] = None
+        else:
+            self._pre_render_scheduler.put(chunk)
 
     def add(self, tile: Tile) -> None:
         related_chunk_pos = (tile.pos.x // self.chunk_size[0], tile.pos.y // self.chunk_size[1])
@@ -581,6 +776,7 @@ class TileMap:
             c = Chunk(self, related_chunk_pos, size=self.chunk_size)
             self._chunks[related_chunk_pos] = c
             self.amount_of_chunks += 1
+            self._visible = None
             self.add_to_pre_render_queue(c)
 
         chunk = self._chunks[related_chunk_pos]
@@ -596,27 +792,23 @@ class TileMap:
             c = Chunk(self, related_chunk_pos, size=self.chunk_size)
             self._chunks[related_chunk_pos] = c
             self.amount_of_chunks += 1
+            self._visible = None
+            self.add_to_pre_render_queue(c)
 
         chunk = self._chunks[related_chunk_pos]
+        # offgrid tiles (grashalme) sind nicht in der pre-rendered surface
         if chunk.add_offgrid(tile):
             self.amount_of_tiles_offgrid += 1
-        self.add_to_pre_render_queue(chunk)
 
     def extend(self, tiles: List[Tile]) -> None:
-        for tile in tiles:
-            # self._tiles[tuple(tile.pos)] = tile
-
-            related_chunk_pos = (tile.pos.x // self.chunk_size[0], tile.pos.y // self.chunk_size[1])
-            # print(related_chunk_pos)
+        with self.batch():
+            for tile in tiles:
+                self.add(tile)
 
-            if related_chunk_pos not in self._chunks:
-                # chunk_pos = (related_chunk_pos[0] * TILESIZE, related_chunk_pos[1] * TILESIZE)
-                self._chunks[related_chunk_pos] = Chunk(self, related_chunk_pos, size=self.chunk_size)
-
-            chunk = self._chunks[related_chunk_pos]
-            if chunk.add(tile):
-                self.amount_of_tiles += 1
-                self.add_to_pre_render_queue(chunk)
+    def remove_many(self, positions: Iterable[Vector2]) -> None:
+        with self.batch():
+            for pos in positions:
+                self.remove(pos)
 
     def get(self, pos: Tuple) -> Tile:
         if not isinstance(pos, tuple):
@@ -637,31 +829,74 @@ class TileMap:
         if pos not in self._chunks:
             c = Chunk(self, pos, self.chunk_size)
             self._chunks[pos] = c
+            self._visible = None
             return c
         return None
 
-    def get_around(self, pos: Vector2) -> List[Tile]:
-        related_chunk_pos = Vector2(pos.x // TILESIZE // self.chunk_size[0], pos.y // TILESIZE // self.chunk_size[1])
-        # print("related chunk position:", related_chunk_pos, pos)
+    def _cells_around(self, pos: Vector2, size: Vector2 | None, margin: int, which: int) -> Iterator[Tuple[Chunk, int]]:
+        # (chunk, maske der zellen in dem bereich) für jeden chunk, der die AABB berührt
+        x0, y0, x1, y1 = aabb_cells(pos, size, margin)
+        w, h = self.chunk_size
+        for cy in range(y0 // h, y1 // h + 1):
+            for cx in range(x0 // w, x1 // w + 1):
+                chunk = self._chunks.get((cx, cy))
+                if chunk is not None:
+                    ox, oy = cx * w, cy * h
+                    mask = chunk.masks()[which] & chunk.cell_mask(x0 - ox, y0 - oy, x1 - ox, y1 - oy)
+                    if mask:
+                        yield chunk, mask
+
+    def get_around(self, pos: Vector2, size: Vector2 | None = None) -> List[Tile]:
+        """Tiles (and ghost tiles) in the cells of the AABB at `pos` (pixel) with `size` plus one cell around it."""
         ret = []
+        for chunk, mask in self._cells_around(pos, size, 1, 0):
+            ret += chunk.tiles_in_mask(mask)
+        return ret
 
-        pos_on_edge = on_edge_of_chunk(pos)
-
-        processed_chunks = set()  # to keep track of processed chunks
-
-        if tuple(related_chunk_pos) in self._chunks:
-            ret += self._chunks[tuple(related_chunk_pos)].get_around(pos)  # , size=Vector2(TILESIZE * 2, TILESIZE * 2))
+    def solid_around(self, pos: Vector2, size: Vector2 | None = None, margin: int = 1) -> List[Tuple[int, int]]:
+        """Global positions of the solid cells touched by the AABB at `pos` (pixel) with `size`, plus `margin` cells."""
+        ret = []
+        w = self.chunk_size[0]
+        for chunk, mask in self._cells_around(pos, size, margin, 1):
+            ox, oy = int(chunk.pos[0]) * w, int(chunk.pos[1]) * self.chunk_size[1]
+            while mask:
+                low = mask & -mask
+                i = low.bit_length() - 1
+                ret.append((ox + i % w, oy + i // w))
+                mask ^= low
+        return ret
 
-        # Iterate over each possible neighbor and its conditions
-        for pos_, conditions in zip(neighbor_positions, neighbor_conditions):
-            if all(pos_on_edge[c] for c in conditions):  # Check if all conditions are met
-                rel_chunk = tuple(related_chunk_pos + Vector2(*pos_))
-                if rel_chunk not in processed_chunks:  # Check if chunk has not been processed
-                    if rel_chunk in self._chunks:
-                        ret += self._chunks[rel_chunk].get_around(pos)
-                    processed_chunks.add(rel_chunk)  # Mark chunk as processed
+    def solid_check(self, pos: Vector2) -> bool:
+        """Is there a solid tile at `pos` (pixel)?"""
+        x, y = int(pos[0] // TILESIZE), int(pos[1] // TILESIZE)
+        w, h = self.chunk_size
+        chunk = self._chunks.get((x // w, y // h))
+        return chunk is not None and bool(chunk.masks()[1] >> ((y % h) * w + x % w) & 1)
 
-        return ret
+    def ground_at(self, x: float, y: float, snap: float = 0) -> float | None:
+        """
+        y of the ramp surface in pixel column `x`, for feet at `y` (world pixel).
+        Looks at the cell of the feet and the cell `snap` pixel below it (to stay on ramps going down).
+        None if there is no ramp. A few dict lookups per cell, ramps can be up to one chunk tall and wide.
+        """
+        cx = int(x // TILESIZE)
+        chunk_x = cx // self.chunk_size[0]
+        column = int(x // 1)
+        rows = (int(y // TILESIZE), int((y + snap) // TILESIZE))
+        for row in rows[:1] if rows[0] == rows[1] else rows:
+            chunk_y = row // self.chunk_size[1]
+            # die rampe liegt im chunk der zelle oder, wenn sie über den rand ragt, im chunk darunter / links davon
+            for chunk_pos in ((chunk_x, chunk_y), (chunk_x, chunk_y + 1), (chunk_x - 1, chunk_y), (chunk_x - 1, chunk_y + 1)):
+                chunk = self._chunks.get(chunk_pos)
+                if chunk is None:
+                    continue
+                entry = chunk.ramp_cells().get((cx, row))
+                if entry is not None:
+                    left, bottom, heights = entry
+                    i = column - left
+                    if 0 <= i < len(heights):
+                        return bottom - heights[i]
+        return None
 
     def get_all(self) -> List[Tile]:
         r = []
@@ -672,73 +907,113 @@ class TileMap:
     def get_all_offgrid(self) -> List[Tile]:
         r = []
         for _, chunk in self._chunks.items():
-            rr = chunk.get_all_offgrid()
-            if rr:
-                self.add_to_pre_render_queue(chunk)
-                r += rr
+            r += chunk.get_all_offgrid()
         return r
 
-    def render(self, surf: Surface, target_pos: Vector2, offset: Vector2 = Vector2(0)) -> None:
-        target_pos = (target_pos[0] / TILESIZE // self.chunk_size[0], target_pos[1] / TILESIZE // self.chunk_size[1])
-
-        p1 = (
-            int(target_pos[0] - self.culling_offset.x),
-            int(target_pos[1] - self.culling_offset.y)
-        )
-        p2 = (
-            int(target_pos[0] + self.culling_offset.x),
-            int(target_pos[1] + self.culling_offset.y)
-        )
-        # print(p1, p2)
-
+    def chunks_changed(self) -> None:
+        """Call after adding or removing chunks in `_chunks` directly (e.g. chunk streaming)."""
+        self._visible = None
+
+    def _visible_chunks(self, target_pos: Vector2) -> List[Chunk]:
+        # nur neu, wenn die kamera in einen anderen chunk kommt oder sich die chunks ändern
+        cx, cy = target_pos[0] / TILESIZE // self.chunk_size[0], target_pos[1] / TILESIZE // self.chunk_size[1]
+        window = (int(cx - self.culling_offset.x), int(cy - self.culling_offset.y),
+                  int(cx + self.culling_offset.x), int(cy + self.culling_offset.y))
+        if self._visible is None or window != self._visible_window:
+            x1, y1, x2, y2 = window
+            self._visible = [self._chunks[(x, y)] for y in range(y1, y2 + 1) for x in range(x1, x2 + 1) if (x, y) in self._chunks]
+            self._visible_window = window
+        return self._visible
+
+    def update_grass(self, time: float, target_pos: Vector2) -> None:
+        """Rotates the grass blades of the visible chunks (wind). Nothing gets pre-rendered again."""
+        for chunk in self._visible_chunks(target_pos):
+            for blade, _, _ in chunk.grass_layer():
+                blade.update(time)
+
+    def render(self, surf: Surface, target_pos: Vector2, offset: Vector2 = Vector2(0), debug: bool = False) -> None:
+        """Draws the visible chunks around `target_pos`. `debug` draws the chunk borders (red) and enlarged surfaces (blue)."""
+        chunks = self._visible_chunks(target_pos)
+        ox, oy = offset[0], offset[1]
+
+        # statische ebene: die pre-rendered chunk surfaces, sonst noch nie pre-rendered
+        surf.fblits([(chunk._pre_renderd_surf, (chunk._blit_pos[0] - ox, chunk._blit_pos[1] - oy))
+                     for chunk in chunks if chunk._pre_renderd_surf is not None])
+
+        # dynamische ebene: grashalme jeden frame aus dem rotations cache
+        img_cache, blit_offset = GrassBlade.img_cache, GrassBlade.blit_offset
         l = []
-        for y in range(p1[1], p2[1] + 1):
-            for x in range(p1[0], p2[0] + 1):
-                if (x, y) in self._chunks:
-                    l.append(self._chunks[(x, y)].get_pre_render(offset))
-
-        # print(l)
+        for chunk in chunks:
+            for blade, x, y in chunk.grass_layer():
+                bx, by = blit_offset(blade.img_idx)
+                l.append((img_cache[blade.img_idx], (x - bx - ox, y - by - oy)))
         surf.fblits(l)
 
-        for y in range(p1[1], p2[1] + 1):
-            for x in range(p1[0], p2[0] + 1):
-                if (x, y) in self._chunks:
-                    chunk = self._chunks[(x, y)]
-                    if chunk._pre_renderd_surf_size != Chunk.default_pre_renderd_surf_size:
-                        pygame.draw.rect(surf, "blue", Rect(x * CHUNKWIDTH - offset[0] - chunk.pre_render_offset.x, y * CHUNKWIDTH - offset[1] - chunk.pre_render_offset.y, TILESIZE * CHUNKSIZE + chunk.pre_render_offset.x, TILESIZE * CHUNKSIZE + chunk.pre_render_offset.y), 4)
-                    pygame.draw.rect(surf, "red", Rect(x * CHUNKWIDTH - offset[0], y * CHUNKWIDTH - offset[1], TILESIZE * CHUNKSIZE, TILESIZE * CHUNKSIZE), 2)
-
-    def serialize(self, directory: str) -> None:
-        for chunk in self._chunks.values():
-            serialize_chunk(chunk.copy(), directory)
+        if debug:
+            self._render_debug(surf, chunks, offset)
+
+    def _render_debug(self, surf: Surface, chunks: List[Chunk], offset: Vector2) -> None:
+        for chunk in chunks:
+            x, y = chunk.pos
+            if chunk._pre_renderd_surf_size != Chunk.default_pre_renderd_surf_size:
+                pygame.draw.rect(surf, "blue", Rect(x * CHUNKWIDTH - offset[0] - chunk.pre_render_offset.x, y * CHUNKWIDTH - offset[1] - chunk.pre_render_offset.y, TILESIZE * CHUNKSIZE + chunk.pre_render_offset.x, TILESIZE * CHUNKSIZE + chunk.pre_render_offset.y), 4)
+            pygame.draw.rect(surf, "red", Rect(x * CHUNKWIDTH - offset[0], y * CHUNKWIDTH - offset[1], TILESIZE * CHUNKSIZE, TILESIZE * CHUNKSIZE), 2)
+
+    def serialize(self, directory: str, workers: int | None = None) -> None:
+        """The chunks are encoded on this thread, compressing and writing the files happens on `workers` threads."""
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chunk-save") as executor:
+            futures = [executor.submit(write_chunk_file, chunk_file_path(directory, chunk.pos), chunkformat.encode_chunk(chunk))
+                       for chunk in self._chunks.values()]
+            for future in futures:
+                future.result()
+        self._dirty_chunks.clear()
+        self._removed_chunks.clear()
+
+    def save(self, directory: str, workers: int | None = None) -> int:
+        """
+        Incremental `serialize`: writes only the chunks changed since the tilemap was loaded from (or last saved to)
+        `directory` and deletes the files of chunks that were removed for being empty. Every file is replaced atomically.
+        Dirty positions without a chunk (e.g. evicted by a `ChunkStreamer`, which saves them itself) are skipped.
+        Returns the number of written and deleted files.
+        """
+        dirty, self._dirty_chunks = self._dirty_chunks, {}
+        removed, self._removed_chunks = self._removed_chunks, {}
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chunk-save") as executor:
+                futures = []
+                for pos in removed:
+                    if pos not in self._chunks:  # nicht wieder neu angelegt
+                        futures.append(executor.submit(remove_chunk_file, chunk_file_path(directory, pos)))
+                for pos in dirty:
+                    chunk = self._chunks.get(pos)
+                    if chunk is not None:
+                        futures.append(executor.submit(write_chunk_file, chunk_file_path(directory, pos), chunkformat.encode_chunk(chunk)))
+                for future in futures:
+                    future.result()
+        except BaseException:
+            # beim nächsten save nochmal, schon geschriebene dateien sind trotzdem vollständig
+            dirty.update(self._dirty_chunks)
+            self._dirty_chunks = dirty
+            removed.update(self._removed_chunks)
+            self._removed_chunks = removed
+            raise
+        return len(futures)
 
     @ staticmethod
-    def deserialize(directory: str) -> "TileMap":
-        # load ...
+    def deserialize(directory: str, workers: int | None = None) -> "TileMap":
         chunks: Dict[Tuple, Chunk] = {}
         tilemap = TileMap()
 
-        files = [f for f in os.listdir(directory) if f.endswith(".data")]
-        # print(files)
-        for file_path in files:
-            c: Chunk = None
-            with open(f"{directory}/{file_path}", "rb") as f:
-                data = f.read()
-                c = load_compressed_pickle(data)
-            if c:
-                c.parent = tilemap
+        files = [f"{directory}/{f}" for f in os.listdir(directory) if f.endswith(".data")]
+        for c in load_chunk_files(files, workers):
+            c.parent = tilemap
             chunks[tuple(c.pos)] = c
-            # print(c._tiles)
-
-            if not hasattr(c, "_tiles_offgrid"):
-                setattr(c, "_tiles_offgrid", {})
-            else:
-                if isinstance(c._tiles_offgrid, list):
-                    c._tiles_offgrid = {}
         tilemap._chunks = chunks
-        print(000000, chunks)
+        tilemap.amount_of_chunks = len(chunks)
+        tilemap.amount_of_tiles = sum(len(c._tiles) for c in chunks.values())
+        tilemap.amount_of_tiles_offgrid = sum(len(c._tiles_offgrid) for c in chunks.values())
+        # werden über mehrere frames mit pre_render_chunks() gerendert, nächste zur kamera zuerst
         [tilemap.add_to_pre_render_queue(c) for c in chunks.values()]
-        tilemap.pre_render_chunks()
         return tilemap
 
 
@@ -770,6 +1045,30 @@ def tile_rect(t: Tile | Ramp, offset: Vector2 = Vector2(0)) -> FRect:
         return FRect(t.pos.x * TILESIZE - offset.x, t.pos.y * TILESIZE - offset.y, TILESIZE, TILESIZE)
 
 
+# (klasse, art, elevation / heightmap bytes, ...) -> höhen
+_ramp_surfaces: Dict[Tuple, Tuple[float, ...]] = {}
+
+
+def ramp_surface(t: Ramp | CustomRamp) -> Tuple[float, ...]:
+    """
+    Height of the ramp surface above the bottom of its tile for every pixel column from the left, in pixel.
+    Straight ramps are TILESIZE wide, custom ramps as wide as their hitbox (like their image).
+    RAMP_RIGHT goes up to the right, RAMP_LEFT is mirrored. Cached, equal ramps share one tuple.
+    """
+    if isinstance(t, CustomRamp):
+        # die hitbox ist schon so gezeichnet, wie die rampe steht (wie das bild), orientation ändert nichts
+        key = (CustomRamp, t.height_data.tobytes())
+        if key not in _ramp_surfaces:
+            _ramp_surfaces[key] = tuple(float(h) for h in t.height_data)
+    else:
+        key = (Ramp, t.type, t.elevation)
+        if key not in _ramp_surfaces:
+            # über TILESIZE spalten steigt die rampe um TILESIZE * elevation
+            heights = tuple((x + 1) * t.elevation for x in range(TILESIZE))
+            _ramp_surfaces[key] = heights[::-1] if t.type == TileType.RAMP_LEFT else heights
+    return _ramp_surfaces[key]
+
+
 def render_collision_mesh(surf: Surface, color: Color, t: Tile | Ramp, width: int = 1, offset: Vector2 = Vector2(0)) -> None:
     if isinstance(t, Ramp):
         r = tile_rect(t, offset=offset)
@@ -790,16 +1089,99 @@ def render_collision_mesh(surf: Surface, color: Color, t: Tile | Ramp, width: in
         pygame.draw.rect(surf, color, r, width)
 
 
-def serialize_chunk(chunk: Chunk, directory: str) -> None:
-    chunk.__setattr__("_pre_renderd_surf", None)  # sonst Fehler, pickle kann pygame.Surface nicht bearbeiten
-    chunk.__setattr__("parent", None)
+GZIP_MAGIC = b"\x1f\x8b"  # alte .data dateien: gzip komprimierte pickles
 
-    # for p, t in chunk._tiles.items():
-    #     if t.type == TileType.TILE_CUSTOM:
-    #         print(p, t.pos, p == tuple(t.pos))
 
-    data = save_compressed_pickle(chunk)
+def read_chunk_file(path: str, allow_pickle: bool = False) -> bytes:
+    """
+    Reads and decompresses one `.data` chunk file. Can run on any thread, zlib releases the GIL.
+    Old pickled chunk files are only accepted with `allow_pickle` (unpickling can run arbitrary code).
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if chunkformat.is_chunk_format(data):
+        return chunkformat.decompress_chunk(data)
+    if data[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+        if not allow_pickle:
+            raise ValueError(f"{path} is an old pickled chunk file, convert it with tools/migrate_chunks.py")
+        return gzip.decompress(data)
+    raise ValueError(f"{path} is not a chunk file")
+
+
+def decode_chunk(data: bytes, allow_pickle: bool = False) -> Chunk:
+    """Decodes the output of `read_chunk_file`. `parent` of the returned chunk is None."""
+    if chunkformat.is_chunk_format(data):
+        return chunkformat.decode_chunk(data)
+    if not allow_pickle:
+        raise ValueError("Old pickled chunk data, convert it with tools/migrate_chunks.py")
+    c: Chunk = pickle.loads(data)
+
+    if not hasattr(c, "_tiles_offgrid"):
+        setattr(c, "_tiles_offgrid", {})
+    else:
+        if isinstance(c._tiles_offgrid, list):
+            c._tiles_offgrid = {}
+    c._ramp_cells = None
+    c._grass_layer = None
+    c._masks = None
+    c._blit_pos = (c.pos.x * c.size[0] * TILESIZE - c.pre_render_offset.x, c.pos.y * c.size[1] * TILESIZE - c.pre_render_offset.y)
+    for tile in chain(c._tiles.values(), c._ghost_tiles.values()):
+        if isinstance(tile, CustomRamp) and isinstance(tile.height_data, dict):  # alt: {x: höhe}
+            tile.height_data = CustomRamp.shared_heightmap([tile.height_data[x] for x in range(len(tile.height_data))])
+    return c
+
+
+def load_chunk_file(path: str, allow_pickle: bool = False) -> Chunk:
+    """Loads one `.data` chunk file. `parent` of the returned chunk is None."""
+    return decode_chunk(read_chunk_file(path, allow_pickle), allow_pickle)
+
+
+def load_chunk_files(paths: List[str], workers: int | None = None) -> Iterator[Chunk]:
+    """
+    Loads many `.data` chunk files. The files are read and decompressed on `workers` threads,
+    decoding happens on the calling thread while the next files are still decompressing.
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chunk-load") as executor:
+        for data in executor.map(read_chunk_file, paths):
+            yield decode_chunk(data)
+
 
-    file_name = f"{directory}/{str(tuple(chunk.pos))}.data"
-    with open(file_name, "wb+") as f:
+def chunk_file_pos(file_name: str) -> Tuple[float, float] | None:
+    """'(1.0, -2.0).data' -> (1.0, -2.0)"""
+    if not file_name.endswith(".data"):
+        return None
+    x, y = file_name[:-len(".data")].strip("()").split(",")
+    return (float(x), float(y))
+
+
+def chunk_file_path(directory: str, chunk_pos: Tuple) -> str:
+    return f"{directory}/{str((float(chunk_pos[0]), float(chunk_pos[1])))}.data"
+
+
+def write_chunk_file(path: str, data: bytes) -> None:
+    """
+    Compresses `data` from `chunkformat.encode_chunk` and writes it to `path`. Can run on any thread.
+    Goes through a temp file and `os.replace`, after a crash `path` is either the old or the new file.
+    """
+    data = chunkformat.compress_chunk(data)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
         f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def remove_chunk_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def serialize_chunk(chunk: Chunk, directory: str) -> None:
+    write_chunk_file(chunk_file_path(directory, chunk.pos), chunkformat.encode_chunk(chunk))
+
+
+# erst hier, chunkformat braucht die klassen von oben
+from Scripts import chunkformat  # noqa: E402
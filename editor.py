@@ -81,16 +81,13 @@ class Editor:
                 self.display.blit(current_tile_img, mpos)
 
             if self.clicking and self.ongrid:
-                self.tilemap.tilemap[self.layer][str(tile_pos[0]) + ';' + str(tile_pos[1])] = {'type': self.tile_list[self.tile_group], 'variant': self.tile_variant, 'pos': tile_pos}
+                self.tilemap.set_tile(tile_pos, self.tile_list[self.tile_group], self.tile_variant, layer=self.layer)
             if self.right_clicking:
-                tile_loc = str(tile_pos[0]) + ';' + str(tile_pos[1])
-                if tile_loc in self.tilemap.tilemap[self.layer]:
-                    del self.tilemap.tilemap[self.layer][tile_loc]
-                for tile in self.tilemap.offgrid_tiles.copy():
-                    tile_img = self.assets[tile['type']][tile['variant']]
-                    tile_r = pygame.Rect(tile['pos'][0] - self.scroll[0], tile['pos'][1] - self.scroll[1], tile_img.get_width(), tile_img.get_height())
-                    if tile_r.collidepoint(mpos):
-                        self.tilemap.offgrid_tiles.remove(tile)
+                self.tilemap.remove_tile(tile_pos, layer=self.layer)
+                for handle in self.tilemap.offgrid_at((mpos[0] + self.scroll[0], mpos[1] + self.scroll[1])):
+                    self.tilemap.remove_offgrid(handle)
+            if self.clicking or self.right_clicking:
+                self.tilemap.update_autotile(self.layer)
 
             self.display.blit(current_tile_img, (5, 5))
 
@@ -103,7 +100,7 @@ class Editor:
                     if event.button == 1:
                         self.clicking = True
                         if not self.ongrid:
-                            self.tilemap.offgrid_tiles.append({'type': self.tile_list[self.tile_group], 'variant': self.tile_variant, 'pos': (mpos[0] + self.scroll[0], mpos[1] + self.scroll[1])})
+                            self.tilemap.add_offgrid(self.tile_list[self.tile_group], self.tile_variant, (mpos[0] + self.scroll[0], mpos[1] + self.scroll[1]))
                     if event.button == 3:
                         self.right_clicking = True
                     if self.shift_layer:
@@ -146,6 +143,7 @@ class Editor:
                         self.tilemap.autotile(self.layer)
                     if event.key == pygame.K_o:
                         self.tilemap.save('map.json')
+                        self.tilemap.save_binary('map.map')  # die karte die das spiel lädt
                         print("saved tilemap")
                     if event.key == pygame.K_i:
                         try:
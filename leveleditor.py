@@ -1,13 +1,16 @@
 import os
+import shutil
 import time
 from Scripts.CONFIG import *
 from Scripts.utils import draw_text
 from Scripts.utils_math import clamp
 from Scripts.tiles import TileMap, Tile, CustomTile, GrassBlade
+from Scripts.chunk_streaming import ChunkStreamer
 from Scripts.timer import Timer, TimerManager
 
 
 SAVING_SUB_FOLDER = 1
+STREAM_CHUNKS = False  # nur die chunks um die kamera laden (ChunkStreamer) statt des ganzen saves
 
 
 def parse_master_tile_set(path: str, bg_color=(36, 0, 36)) -> list[list[Surface]]:
@@ -32,23 +35,30 @@ def load() -> TileMap:
     return TileMap.deserialize("saves/t1")
 
 
-def save(tilemap, do_backup: bool = False):
+def load_streamed(radius: int) -> ChunkStreamer:
+    return ChunkStreamer(TileMap(), "saves/t1", radius=radius)
+
+
+def save(tilemap, do_backup: bool = False, streamer: ChunkStreamer | None = None):
     if do_backup:
         backup()
-    for file in os.scandir(f"saves/t1"):
-        if file.name.endswith(".data"):
-            os.unlink(file.path)
-    tilemap.serialize(f"saves/t1")
+    # nur geänderte chunks, leer gewordene werden gelöscht
+    if streamer is not None:
+        streamer.save()
+    else:
+        tilemap.save(f"saves/t1")
 
 
 def backup():
     idx = 0
     directory = f"saves/t{SAVING_SUB_FOLDER}"
-    os.mkdir(f"{directory}/backup{idx}")
-    for file_name in [f for f in os.listdir(f"{directory}/backup{idx}") if f.endswith(".data")]:
-        os.remove(f"{directory}/backup{idx}/{file_name}")
+    backup_directory = f"{directory}/backup{idx}"
+    os.makedirs(backup_directory, exist_ok=True)
+    for file_name in [f for f in os.listdir(backup_directory) if f.endswith(".data")]:
+        os.remove(f"{backup_directory}/{file_name}")
+    # kopieren statt verschieben, save() schreibt nur die geänderten chunks neu
     for file_name in [f for f in os.listdir(directory) if f.endswith(".data")]:
-        os.replace(f"{directory}/{file_name}", f"{directory}/backup{idx}/{file_name}")
+        shutil.copy2(f"{directory}/{file_name}", f"{backup_directory}/{file_name}")
 
 
 RES = Vector2(1200, 700)
@@ -67,6 +77,7 @@ class LevelEditor:
         self.x_off = 0
         self.y_off = 0
         self.tilemap = TileMap()
+        self.streamer: ChunkStreamer | None = None  # nur mit STREAM_CHUNKS
         self.tile_position = Vector2(0)
         self.sub_tile_position = Vector2(0)
 
@@ -92,6 +103,7 @@ class LevelEditor:
 
         self.selected_tile = (0, 0)
         self.hold_to_place = True
+        self.show_chunk_borders = True
 
         self.clicks = [False, False, False]
         self.last_mClicks = (False, False, False)
@@ -138,6 +150,8 @@ class LevelEditor:
             self.update()
 
             self.render()
+        if self.streamer is not None:
+            self.streamer.close()
         pygame.quit()
 
     def handle_event(self, event: pygame.event.Event):
@@ -147,9 +161,16 @@ class LevelEditor:
             if event.key == pygame.K_t:
                 self.tool = (self.tool + 1) % len(self.tools)
             if event.key == pygame.K_o:
-                save(self.tilemap)
+                save(self.tilemap, streamer=self.streamer)
             if event.key == pygame.K_i:
-                self.tilemap = load()
+                if STREAM_CHUNKS:
+                    if self.streamer is not None:
+                        self.streamer.close()
+                    # radius in chunks, so dass der ganze bildschirm um die mitte geladen ist
+                    self.streamer = load_streamed(int(max(RES) / 2 // CHUNKWIDTH) + 1)
+                    self.tilemap = self.streamer.tilemap
+                else:
+                    self.tilemap = load()
             if event.key == pygame.K_u:
                 backup()
             if event.key == pygame.K_g:
@@ -162,6 +183,8 @@ class LevelEditor:
                 self.brush_type = self.brush_types[self.brush_type_idx]
             if event.key == pygame.K_q:
                 self.hold_to_place = not self.hold_to_place
+            if event.key == pygame.K_c:
+                self.show_chunk_borders = not self.show_chunk_borders
 
         elif event.type == pygame.MOUSEBUTTONDOWN:
             if self.tool == 1:  # rect tool
@@ -180,6 +203,7 @@ class LevelEditor:
             self.rect_tool_end = self.mPos
 
         keys = pygame.key.get_pressed()
+        last_offset = self.offset.copy()
         self.last_mPos = self.mPos.copy()
         self.mPos = Vector2(pygame.mouse.get_pos())
         self.tile_position = Vector2(int((self.mPos[0] + self.offset.x) // TILESIZE), int((self.mPos[1] + self.offset.y) // TILESIZE))
@@ -215,24 +239,26 @@ class LevelEditor:
                 if self.tool == 0:
                     if self.mode == 0:
                         offgrid = False
-                        for position in self.get_positions():
-                            idx = f"c_tile({self.selected_tile[1]};{self.selected_tile[0]})"
-                            if self.selected_tile in [(14, 0), (14, 1), (14, 2), (15, 0), (15, 1), (15, 2), (16, 0), (16, 1), (16, 2)]:
-                                t = Tile(position, img_idx=f"TEST{idx}")
-                            elif self.selected_tile in [(14, 3), (14, 4), (14, 5), (14, 6), (14, 7), (14, 8), (14, 9)]:
-                                img_idx = f"{self.selected_tile[1]-3}"
-                                p = self.mPos - Vector2(GrassBlade.img_cache[f"{img_idx};0"].get_size()) / 2
-                                t = GrassBlade((p + self.offset) / TILESIZE, img_idx=img_idx)
-                                t.img_idx = f"{img_idx};0"
-                                offgrid = True
-                                print(self.selected_tile, img_idx, t.img_idx)
-                            else:
-                                t = CustomTile(position, idx, idx)
-                            if offgrid:
-                                self.tilemap.add_offgrid(t)
-                            else:
-                                self.tilemap.add(t)
-                        self.tilemap.pre_render_chunks()
+                        if self.streamer is not None:
+                            self.streamer.require(self.get_positions())
+                        with self.tilemap.batch():  # ghost tiles und pre-render einmal pro chunk
+                            for position in self.get_positions():
+                                idx = f"c_tile({self.selected_tile[1]};{self.selected_tile[0]})"
+                                if self.selected_tile in [(14, 0), (14, 1), (14, 2), (15, 0), (15, 1), (15, 2), (16, 0), (16, 1), (16, 2)]:
+                                    t = Tile(position, img_idx=f"TEST{idx}")
+                                elif self.selected_tile in [(14, 3), (14, 4), (14, 5), (14, 6), (14, 7), (14, 8), (14, 9)]:
+                                    img_idx = f"{self.selected_tile[1]-3}"
+                                    p = self.mPos - Vector2(GrassBlade.img_cache[f"{img_idx};0"].get_size()) / 2
+                                    t = GrassBlade((p + self.offset) / TILESIZE, img_idx=img_idx)
+                                    t.img_idx = f"{img_idx};0"
+                                    offgrid = True
+                                    print(self.selected_tile, img_idx, t.img_idx)
+                                else:
+                                    t = CustomTile(position, idx, idx)
+                                if offgrid:
+                                    self.tilemap.add_offgrid(t)
+                                else:
+                                    self.tilemap.add(t)
                     elif self.mode == 1:
                         pass
         if self.clicks[2]:
@@ -242,16 +268,18 @@ class LevelEditor:
                 if self.tool == 0:
                     if self.mode == 0:
                         offgrid = False
-                        for position in self.get_positions():
-                            if self.selected_tile in [(14, 3), (14, 4), (14, 5), (14, 6), (14, 7), (14, 8), (14, 9)]:
-                                offgrid = True
-                            if offgrid:
-                                img_idx = f"{self.selected_tile[1]-3}"
-                                p = self.mPos - Vector2(GrassBlade.img_cache[f"{img_idx};0"].get_size()) / 2
-                                self.tilemap.remove_offgrid((p + self.offset) / TILESIZE)
-                            else:
-                                self.tilemap.remove(position)
-                        self.tilemap.pre_render_chunks()
+                        if self.streamer is not None:
+                            self.streamer.require(self.get_positions())
+                        with self.tilemap.batch():
+                            for position in self.get_positions():
+                                if self.selected_tile in [(14, 3), (14, 4), (14, 5), (14, 6), (14, 7), (14, 8), (14, 9)]:
+                                    offgrid = True
+                                if offgrid:
+                                    img_idx = f"{self.selected_tile[1]-3}"
+                                    p = self.mPos - Vector2(GrassBlade.img_cache[f"{img_idx};0"].get_size()) / 2
+                                    self.tilemap.remove_offgrid((p + self.offset) / TILESIZE)
+                                else:
+                                    self.tilemap.remove(position)
 
         if self.do_rect_tool:
             print(self.rect_tool_start, self.rect_tool_end)
@@ -267,6 +295,13 @@ class LevelEditor:
             self.rect_tool_end = None
             self.do_rect_tool = False
 
+        if self.streamer is not None:
+            # lädt die chunks um die bildmitte (in bewegungsrichtung voraus), entlädt ferne und rendert vor
+            self.streamer.update(self.offset + RES / 2, self.offset - last_offset)
+        else:
+            # geänderte chunks, die nächsten zur maus zuerst, mit zeitbudget pro frame
+            self.tilemap.pre_render_chunks(self.mPos + self.offset)
+
     def render_grid(self):
         for y in range(-TILESIZE, int(RES.y) + TILESIZE, TILESIZE):
             for x in range(left_menu_offset - TILESIZE, int(RES.x) + TILESIZE, TILESIZE):
@@ -307,6 +342,7 @@ class LevelEditor:
         draw_text(self.screen, f"Cycle brush sizes with 'H'", (right_ui_pos, 70), color="yellow", background_color="black")
         draw_text(self.screen, f"Cycle brush types with 'J'", (right_ui_pos, 100), color="yellow", background_color="black")
         draw_text(self.screen, f"Cycle tools with 'T'", (right_ui_pos, 130), color="yellow", background_color="black")
+        draw_text(self.screen, f"Toggle chunk borders with 'C'", (right_ui_pos, 160), color="yellow", background_color="black")
         draw_text(self.screen, f"Num Tiles: {self.tilemap.amount_of_tiles} | Num Chunks: {self.tilemap.amount_of_chunks}", (left_ui_pos, 10), background_color="black")
         draw_text(self.screen, f"Offset: {self.offset}", (left_ui_pos, 40), background_color="black")
         draw_text(self.screen, f"Tile Offset: {Vector2(self.x_off, self.y_off)}", (left_ui_pos, 70), background_color="black")
@@ -320,7 +356,7 @@ class LevelEditor:
     def render(self):
         self.screen.fill((92, 95, 89))
         self.render_grid()
-        self.tilemap.render(self.screen, self.mPos + self.offset, offset=self.offset)  # TODO so was wie: culling_rect=Rect(left_menu_offset, 0, RES.x - left_menu_offset, RES.y) einbauen
+        self.tilemap.render(self.screen, self.mPos + self.offset, offset=self.offset, debug=self.show_chunk_borders)  # TODO so was wie: culling_rect=Rect(left_menu_offset, 0, RES.x - left_menu_offset, RES.y) einbauen
         self.render_selected_tile()
 
         # rect tool
@@ -5,6 +5,7 @@ import random
 import pygame
 import os
 import math
+import numpy as np
 
 from Scripts.tilemap import TileMap
 from Scripts.CONFIG import *
@@ -60,7 +61,7 @@ class Game:
         self.scroll = Vector2(0)
         self.pygame_gui_manager = pygame_gui.ui_manager.UIManager((800, 600))
         self.tile_map = TileMap(self)
-        self.tile_map.load("map.json")
+        self.tile_map.load("map.map")  # aus map.json, siehe tools/convert_map.py
 
         self.img_cache = ImageCache(load_image)
         self.particle_group = ParticleGroup(self.img_cache)
@@ -250,11 +251,12 @@ class Game:
             self.scroll += ((self.component_manager.get_component(self.p, Transform).pos - Vector2(TILESIZE / 2)) - DOWNSCALED_RES / 2 - self.scroll) / 30
             screen.fill((0, 0, 0))
 
-            def rot_function(x) -> int: return int(math.sin(master_time / 60 + x / 100) * 15)
-            # def rot_function(x): return 1
-            self.tile_map.rotate_grass(rot_function=rot_function)
+            def rot_function(x: np.ndarray) -> np.ndarray: return np.trunc(np.sin(master_time / 60 + x / 100) * 15)
+            # def rot_function(x): return np.ones_like(x)
+            view_rect = (self.scroll.x, self.scroll.y, screen.get_width(), screen.get_height())
+            self.tile_map.rotate_grass(rot_function=rot_function, view_rect=view_rect)
             all_entity_rects = [p_transform.frect] + [self.component_manager.get_component(en, Transform).frect for en in self.enemies + self.items]
-            self.tile_map.update_grass(all_entity_rects, 1, 12, particle_method=self.add_particle)
+            self.tile_map.update_grass(all_entity_rects, 1, 12, particle_method=self.add_particle, view_rect=view_rect)
 
             if right:
                 self.player_movement[0] = 1
@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scripts.tiles import TileMap, CustomTile, Vector2, load_chunk_file  # noqa: E402
+
+# 100 x 100 chunks = 10k .data dateien
+CHUNKS_X, CHUNKS_Y = 100, 100
+TILES_PER_CHUNK = 24
+
+
+def build_tilemap() -> TileMap:
+    tilemap = TileMap()
+    with tilemap.batch():
+        for cy in range(CHUNKS_Y):
+            for cx in range(CHUNKS_X):
+                for i in range(TILES_PER_CHUNK):
+                    x, y = cx * tilemap.chunk_size[0] + i % 8, cy * tilemap.chunk_size[1] + i // 8 + 2
+                    tilemap.add(CustomTile(Vector2(x, y), "c_tile(1;1)", "c_tile(1;1)"))
+    return tilemap
+
+
+def timed(name: str, func):
+    t = time.perf_counter()
+    ret = func()
+    print(f"{name:<28}{time.perf_counter() - t:8.3f}s")
+    return ret
+
+
+if __name__ == "__main__":
+    tilemap = timed("build", build_tilemap)
+    with tempfile.TemporaryDirectory() as directory:
+        timed("serialize", lambda: tilemap.serialize(directory))
+        files = [f"{directory}/{f}" for f in os.listdir(directory) if f.endswith(".data")]
+        print(f"{len(files)} chunk files, {sum(os.path.getsize(f) for f in files) / 1024 / 1024:.1f} MiB")
+
+        timed("load one after another", lambda: [load_chunk_file(f) for f in files])
+        loaded = timed("deserialize (thread pool)", lambda: TileMap.deserialize(directory))
+        assert len(loaded._chunks) == len(tilemap._chunks)
@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scripts import Ecs  # noqa: E402
+
+# viele entities, systeme die fast nichts machen → misst nur den overhead vom dispatch
+ENTITIES = 5000
+FRAMES = 100
+
+
+class Position(Ecs.BaseComponent):
+    def __init__(self, x: float, y: float) -> None:
+        super().__init__()
+        self.x = x
+        self.y = y
+
+
+class Speed(Ecs.BaseComponent):
+    def __init__(self, x: float) -> None:
+        super().__init__()
+        self.x = x
+
+
+class Tag(Ecs.BaseComponent):
+    pass
+
+
+class SpecialTag(Tag):  # subclass, wie Gun für Item
+    pass
+
+
+class Mover(Ecs.BaseSystem):
+    def __init__(self) -> None:
+        super().__init__([Position, Speed])
+
+    def update_entity(self, entity, entity_components, **kwargs) -> None:
+        entity_components[Position].x += entity_components[Speed].x * kwargs["dt"]
+
+
+class Counter(Ecs.ExtendedSystem):
+    def __init__(self) -> None:
+        super().__init__([Position, Tag])
+
+    def update_entities(self, entites_data, **kwargs) -> int:
+        return len(entites_data)
+
+
+def populate() -> tuple:
+    component_manager, entity_manager, system_manager = Ecs.managers.make_all_managers()
+    mover, counter = Mover(), Counter()
+    for i in range(ENTITIES):
+        entity = entity_manager.add_entity()
+        components = [Position(i, 0), Speed(1)]
+        if i % 3 == 0:
+            components.append(Tag())
+        elif i % 3 == 1:
+            components.append(SpecialTag())
+        component_manager.add_component(entity, components)
+        system_manager.add_system(entity, mover)
+        if i % 3 != 2:
+            system_manager.add_extended_system(entity, counter)
+    return component_manager, entity_manager, system_manager, mover, counter
+
+
+def run() -> float:
+    component_manager, entity_manager, system_manager, mover, counter = populate()
+    allocations = system_manager.dict_allocations
+    t = time.perf_counter()
+    for _ in range(FRAMES):
+        ret = system_manager.run_all_systems(dt=0.016)
+    t = time.perf_counter() - t
+    assert ret[Counter][counter] == ENTITIES - ENTITIES // 3
+    return t, (system_manager.dict_allocations - allocations) / FRAMES
+
+
+def remove_burst(count: int = 1000) -> float:
+    """Removing `count` entities (wie ein haufen partikel) bis einschließlich dem nächsten frame."""
+    component_manager, entity_manager, system_manager, mover, counter = populate()
+    system_manager.run_all_systems(dt=0.016)
+    t = time.perf_counter()
+    for entity_id in range(count):
+        entity_manager.remove_entity(entity_id)
+    ret = system_manager.run_all_systems(dt=0.016)
+    t = time.perf_counter() - t
+    assert len(entity_manager) == ENTITIES - count
+    assert ret[Counter][counter] == (ENTITIES - count) - (ENTITIES - count) // 3
+    return t
+
+
+if __name__ == "__main__":
+    t, allocations = run()
+    print(f"{t / FRAMES * 1000:8.3f} ms/frame{allocations:8.1f} dicts/frame{remove_burst() * 1000:8.3f} ms for removing 1000 + frame")
@@ -0,0 +1,42 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scripts.mapformat import MapFile, is_binary_map, write_map  # noqa: E402
+
+
+def json_to_binary(json_path, binary_path):
+    with open(json_path, "r") as f:
+        map_data = json.load(f)
+
+    layers = {layer: [(int(t["pos"][0]), int(t["pos"][1]), t["type"], t["variant"]) for t in tiles.values()]
+              for layer, tiles in map_data["tilemap"].items()}
+    write_map(binary_path, map_data["tile_size"], layers, map_data["offgrid"])
+
+
+def binary_to_json(binary_path, json_path):
+    map_file = MapFile(binary_path)
+    tilemap = {}
+    for layer in ("-3", "-2", "-1", "0", "1", "2", "3"):
+        tilemap[layer] = {f"{x};{y}": {"type": t, "variant": v, "pos": [x, y]} for x, y, t, v in map_file.tiles(layer)}
+    map_data = {"tilemap": tilemap, "tile_size": map_file.tile_size, "offgrid": map_file.offgrid()}
+    map_file.close()
+
+    with open(json_path, "w") as f:
+        json.dump(map_data, f)
+
+
+# python tools/convert_map.py map.json map.map  (oder umgekehrt)
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python tools/convert_map.py <input> <output>")
+        sys.exit(1)
+
+    input_path, output_path = sys.argv[1], sys.argv[2]
+    if is_binary_map(input_path):
+        binary_to_json(input_path, output_path)
+    else:
+        json_to_binary(input_path, output_path)
+    print(f"Map saved as {output_path}")
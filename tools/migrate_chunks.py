@@ -0,0 +1,33 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scripts.chunkformat import encode_chunk, is_chunk_format  # noqa: E402
+from Scripts.tiles import load_chunk_file, write_chunk_file  # noqa: E402
+
+
+def migrate_directory(directory):
+    """Converts every old pickled `.data` file in `directory` to the chunk format. Only run it on your own saves."""
+    converted = 0
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(".data"):
+            continue
+        path = f"{directory}/{file_name}"
+        with open(path, "rb") as f:
+            if is_chunk_format(f.read(16)):
+                continue
+
+        chunk = load_chunk_file(path, allow_pickle=True)
+        # über eine temp datei, nach einem absturz ist die datei entweder alt oder neu
+        write_chunk_file(path, encode_chunk(chunk))
+        converted += 1
+
+    return converted
+
+
+# python tools/migrate_chunks.py saves/t1
+if __name__ == "__main__":
+    directories = sys.argv[1:] or ["saves/t1"]
+    for directory in directories:
+        print(f"{directory}: {migrate_directory(directory)} chunk files converted")